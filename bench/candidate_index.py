@@ -0,0 +1,60 @@
+"""
+候補モデルのスケーリング（10k / 100k 候補）
+- 旧: ページごとに discovered 全体を線形走査して source_query を逆引き（O(n²)）
+- 新: PageQueryIndex（O(1) 逆引き）＋ slots 付き Candidate / LinkCheck
+usage: python -m bench.candidate_index [--sizes 10000 100000]
+"""
+import argparse, random, time, tracemalloc
+from src.models import Candidate, LinkCheck, PageQueryIndex
+
+def _discovered(n: int, seed: int = 3) -> list[tuple[str, str, str, str]]:
+    rnd = random.Random(seed)
+    queries = [f"クエリ{i}" for i in range(max(10, n // 20))]
+    pages = max(1, n * 2 // 3)  # 3 件に 1 件は別クエリで見つかった同じページ
+    return [(f"https://h{rnd.randrange(pages // 10 + 1)}.jp/p/{rnd.randrange(pages)}", "", rnd.choice(queries), "")
+            for _ in range(n)]
+
+def _legacy(discovered, sample: int) -> float:
+    # 旧実装：qs = [d[2] for d in discovered if d[0] == url] をページごとに（sample ページ分を測って外挿）
+    urls = list(dict.fromkeys(d[0] for d in discovered))
+    t = time.perf_counter()
+    for url in urls[:sample]:
+        qs = [d[2] for d in discovered if d[0] == url]
+    return (time.perf_counter() - t) * len(urls) / min(sample, len(urls))
+
+def _indexed(discovered) -> float:
+    t = time.perf_counter()
+    idx = PageQueryIndex()
+    fetch = [c.page_url for c in (Candidate(u, q, title) for u, title, q, _ in discovered) if idx.add(c.page_url, c.source_query)]
+    for url in fetch:
+        qs = idx.queries(url)
+    return time.perf_counter() - t
+
+def _memory(discovered) -> tuple[int, int]:
+    # 検査待ちリンク（1 ページ 5 本）を tuple + list で持つ場合と LinkCheck で持つ場合
+    def measure(make):
+        tracemalloc.start()
+        items = make()
+        cur, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del items
+        return cur
+    old = measure(lambda: [(u, [q], f"https://x.jp/{i}", "アンカー") for u, _, q, _ in discovered for i in range(5)])
+    new = measure(lambda: [LinkCheck(u, (q,), f"https://x.jp/{i}", "アンカー") for u, _, q, _ in discovered for i in range(5)])
+    return old, new
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    p.add_argument("--legacy-sample", type=int, default=500)
+    args = p.parse_args()
+    print(f"{'candidates':>10} {'legacy O(n^2) (est.)':>22} {'index':>10} {'index us/cand':>14} {'mem tuple':>10} {'mem slots':>10}")
+    for n in args.sizes:
+        d = _discovered(n)
+        leg = _legacy(d, args.legacy_sample)
+        new = min(_indexed(d) for _ in range(3))
+        mo, mn = _memory(d)
+        print(f"{n:>10,} {leg:>21.2f}s {new:>9.3f}s {new / n * 1e6:>14.2f} {mo / 2**20:>8.1f}MB {mn / 2**20:>8.1f}MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+代替記事スコアリングのベンチマーク（difflib 総当たり vs batch_fit_scores の行列演算）
+usage: python -m bench.fit_scores [--catalog catalog.sample.csv] [--anchors 5000]
+"""
+import argparse, csv, difflib, random, time
+from src.scorer import batch_fit_scores
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--catalog", default="catalog.sample.csv")
+    p.add_argument("--anchors", type=int, default=5000)
+    p.add_argument("--difflib-anchors", type=int, default=200)  # 総当たりは遅いので一部だけ測って外挿
+    args = p.parse_args()
+    with open(args.catalog, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.reader(f))[1:]
+    titles = [r[2] or r[0].replace("|", " ") for r in rows]
+    rnd = random.Random(1)
+    anchors = [rnd.choice(rows)[0].split("|")[0] + " " + rnd.choice(["とは", "の解説", "比較", ""]) for _ in range(args.anchors)]
+
+    m = min(args.difflib_anchors, len(anchors))
+    t = time.perf_counter()
+    for a in anchors[:m]:
+        max(difflib.SequenceMatcher(None, a, ti).ratio() for ti in titles)
+    d = (time.perf_counter() - t) * len(anchors) / m
+    t = time.perf_counter()
+    batch_fit_scores(anchors, titles, k=5)
+    b = time.perf_counter() - t
+    print(f"{len(anchors)} anchors x {len(titles)} titles")
+    print(f"difflib (est.)   {d:8.3f}s")
+    print(f"batch_fit_scores {b:8.3f}s  ({d / b:.0f}x)")
+
+if __name__ == "__main__":
+    main()
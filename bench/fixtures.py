@@ -0,0 +1,77 @@
+"""ベンチマーク用の合成フィクスチャ（固定シードで再現可能）"""
+import gzip, json, random
+
+WORDS = ["棲み分け", "住み分け", "クラウド", "セキュリティ", "データ移行", "予約", "ホテル", "比較", "おすすめ", "使い方"]
+FILLER = ["お知らせ", "トップ", "会社概要", "ブログ", "news", "home", "contact", "サービス一覧"]
+TLDS = ["jp", "co.jp", "com", "org", "net", "de"]
+
+def _links(rnd: random.Random, host: str) -> list[dict]:
+    out = []
+    for k in range(rnd.randint(0, 30)):
+        same = rnd.random() < 0.6
+        h = host if same else f"ext{rnd.randint(0, 5000)}.{rnd.choice(TLDS)}"
+        words = FILLER if rnd.random() < 0.97 else WORDS
+        out.append({"path": "A@/href", "url": f"https://{h}/p/{rnd.randint(0, 99999)}",
+                    "text": " ".join(rnd.sample(words, 2)) + " の記事"})
+    return out
+
+def write_wat(path: str, n_records: int = 3000, seed: int = 1, ensure_ascii: bool = False):
+    """
+    WAT に近い構造（WARC ヘッダ行 + 1 行 JSON、request/metadata レコード混在）の .wat.gz を書く
+    """
+    rnd = random.Random(seed)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for r in range(n_records):
+            host = f"site{rnd.randint(0, 2000)}.{rnd.choice(TLDS)}"
+            uri = f"https://{host}/page/{r}"
+            kind = rnd.choice(["request", "response", "response", "metadata"])
+            meta = {"WARC-Header-Metadata": {"WARC-Type": kind, "WARC-Target-URI": uri,
+                                             "WARC-Date": "2025-02-01T00:00:00Z"}}
+            if kind == "response":
+                meta["Payload-Metadata"] = {"HTTP-Response-Metadata": {
+                    "Headers": {"Content-Type": "text/html; charset=UTF-8", "Server": "nginx"},
+                    "HTML-Metadata": {"Head": {"Title": f"ページ {r}"}, "Links": _links(rnd, host)}}}
+            body = json.dumps({"Container": {"Filename": "fixture.warc.gz"}, "Envelope": meta},
+                              ensure_ascii=ensure_ascii)
+            f.write(f"WARC/1.0\r\nWARC-Type: metadata\r\nWARC-Target-URI: {uri}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body.encode('utf-8'))}\r\n\r\n")
+            f.write(body + "\r\n\r\n")
+
+VENDOR_BITS = ["価格", "料金プラン", "資料請求はこちら", "お問い合わせ", "導入事例", "ログイン", "会社情報", "採用情報",
+               "プレスリリース", '<a href="/pricing/">Pricing</a>', '<script type="application/ld+json">{"@type":"Product"}</script>']
+NEWS_BITS = ["ニュース", "速報", "配信", '<meta property="og:type" content="article">', '<time datetime="2025-01-02">1/2</time>']
+
+def html_page(rnd: random.Random, i: int) -> str:
+    """ベンダー/ニュース/資料置き場の特徴を確率的に含む記事ページ（数十〜数百 KB）"""
+    kind = rnd.choice(["blog", "blog", "vendor", "news", "docrepo"])
+    parts = [f"<!doctype html><html><head><meta charset='utf-8'><title>ページ {i}</title>",
+             "<script>window.dataLayer=[];function gtag(){dataLayer.push(arguments)}</script>",
+             "<style>body{font-family:sans-serif}.nav a{color:#333}</style></head><body>",
+             "<nav class='nav'>" + "".join(f"<a href='/cat/{k}/'>カテゴリ{k}</a>" for k in range(20)) + "</nav><main>"]
+    n_blocks = rnd.randint(50, 600)
+    for k in range(n_blocks):
+        r = rnd.random()
+        if kind == "docrepo" and r < 0.3:
+            parts.append(f'<li><a href="/files/doc{k}.{rnd.choice(["pdf", "xlsx", "docx", "zip"])}">資料 {k}</a></li>')
+        elif kind == "vendor" and r < 0.05:
+            parts.append(f"<div>{rnd.choice(VENDOR_BITS)}</div>")
+        elif kind == "news" and r < 0.05:
+            parts.append(f"<div>{rnd.choice(NEWS_BITS)}</div>")
+        elif kind != "docrepo" and r < 0.6:
+            parts.append(f"<p>クラウドの棲み分けについて解説します。{WORDS[k % len(WORDS)]}の選び方、比較、注意点など。" * 2 + "</p>")
+        else:
+            parts.append(f'<div class="card"><a href="https://ext{rnd.randint(0, 999)}.jp/p/{k}">{rnd.choice(WORDS)} 関連記事</a></div>')
+    parts.append("</main><footer>&copy; example</footer></body></html>")
+    return "".join(parts)
+
+def html_corpus(n: int = 200, seed: int = 7) -> list[tuple[str, str]]:
+    """return: [(url, html)]"""
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        url = f"https://site{i}.jp/" + rnd.choice(["blog/post-%d" % i, "news/2025/01/%02d/item" % (i % 28 + 1), "products/x"])
+        out.append((url, html_page(rnd, i)))
+    return out
+
+if __name__ == "__main__":
+    write_wat("bench/data/sample.wat.gz")
@@ -0,0 +1,293 @@
+"""
+オフラインの通しベンチマーク：pipeline.run をローカルの HTTP サーバ相手に最後まで実行し、保存済みの基準値と比べる
+- 合成サイト（別プロセスで起動し、計測側の RSS・CPU に含めない）
+  - 候補ページ site<英字>.jp：クエリ語を含むアンカーで外部リンクを links_per_page 本持つ
+  - リンク先 live / dead(404) / gone(410) / soft(200 の soft404) / moved(301 → live) / slow（遅延 slow_ms）を --mix の比率で
+  - 候補の一部は前段フィルタ（ユーティリティパス）・後段フィルタ（HTML 以外）で落ちる
+- CC インデックス / CDX のスタブ（/idx・/cdx）、カタログ・出力シートは FakeSpreadsheet（BLB_LOCAL_CATALOG）
+- WAT 走査（cc_wat）は pipeline.run の外なので、フィクスチャ WAT（bench.fixtures.write_wat）で別に測る
+https:// の通信は Session のアダプタでローカルサーバへ振り替える（ホスト名はパスに載せて渡す）
+usage: python -m bench.offline [--terms 8] [--pages-per-term 12] [--latency-ms 20] [--check] [--save-baseline]
+"""
+import argparse, csv, json, multiprocessing, os, random, resource, shutil, sys, tempfile, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote, unquote
+from .fixtures import WORDS, write_wat
+
+BASELINE = os.path.join(os.path.dirname(__file__), "data", "offline_baseline.json")
+LINK_KINDS = ("live", "dead", "gone", "soft", "moved", "slow")
+# 大きいほど良い / 小さいほど良い
+HIGHER = ("pages_per_s", "links_per_s", "wat_records_per_s")
+LOWER = ("wall_s", "peak_rss_mb")
+
+class _Site(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_s = 0.02
+    slow_s = 0.4
+    pages_per_term = 12
+    links_per_page = 8
+    page_kb = 40
+    mix = (0.55, 0.15, 0.05, 0.1, 0.1, 0.05)
+
+    def log_message(self, *a):
+        pass
+
+    def _send(self, code: int, body: str = "", ct: str = "text/html; charset=utf-8", headers: dict | None = None):
+        b = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", ct)
+        self.send_header("Content-Length", str(len(b)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(b)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def _index(self, u, q):
+        if q.get("showNumPages"):
+            return self._send(200, json.dumps({"pages": 1}), "application/json")
+        term = unquote(q["url"].split("*")[2])  # searchers._pattern_for: *.jp/*{term}*
+        rnd = random.Random(f"{u.path}|{term}")
+        n = min(int(q.get("limit", "10")), self.pages_per_term)
+        urls = []
+        for i in range(n):
+            k = rnd.randrange(1000)
+            # 1 割はユーティリティパス（pre_http_filter で除外）
+            path = "login" if rnd.random() < 0.1 else str(rnd.randrange(100))
+            urls.append(f"https://site{_alpha(k)}.jp/{path}/{quote(term)}")
+        if u.path.startswith("/cdx"):
+            rows = [["urlkey", "timestamp", "original"]] + [["k", "20240101000000", x] for x in urls]
+            return self._send(200, json.dumps(rows), "application/json")
+        return self._send(200, "\n".join(json.dumps({"url": x}) for x in urls), "text/x-ndjson")
+
+    def _page(self, host: str, path: str):
+        rnd = random.Random(host + path)
+        if rnd.random() < 0.05:
+            return self._send(200, "%PDF-1.4", "application/pdf")  # post_http_filter: non-html
+        term = unquote(path.rsplit("/", 1)[-1])
+        links = []
+        for i in range(self.links_per_page):
+            kind = rnd.choices(LINK_KINDS, self.mix)[0]
+            links.append(f'<a href="https://{kind}{rnd.randrange(40)}.jp/{rnd.randrange(200)}">{term}の解説 {i}</a>')
+        filler = "<p>" + "本文の段落です。" * 64 + "</p>"
+        body = "".join(filler for _ in range(max(1, self.page_kb * 1024 // (len(filler.encode("utf-8")) or 1))))
+        return self._send(200, f"<html><head><title>{term}</title></head><body><p>{term}とは。</p>"
+                               f"{''.join(links)}{body}</body></html>")
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        if u.path.startswith(("/idx", "/cdx")):
+            return self._index(u, q)
+        # /_/<host>/<path>
+        parts = u.path.split("/", 3)
+        host, path = parts[2], "/" + (parts[3] if len(parts) > 3 else "")
+        time.sleep(self.slow_s if host.startswith("slow") else self.latency_s)
+        if host.startswith("site"):
+            return self._page(host, path)
+        if host.startswith("dead"):
+            return self._send(404, "<html><body>Not Found</body></html>")
+        if host.startswith("gone"):
+            return self._send(410, "<html><body>Gone</body></html>")
+        if host.startswith("soft"):
+            return self._send(200, "<html><body><h1>ページが見つかりません</h1>お探しのページは移動または削除されました。</body></html>")
+        if host.startswith("moved"):
+            return self._send(301, "", headers={"Location": f"https://live{host[5:]}{path}"})
+        return self._send(200, "<html><body>" + "ふつうの記事本文です。" * 40 + "</body></html>")
+
+def _alpha(k: int) -> str:
+    # 数字入りの SLD は pre_http_filter（numeric-sld）で落ちるので、候補ページのホスト名は英字だけにする
+    out = ""
+    while True:
+        k, r = divmod(k, 26)
+        out = chr(97 + r) + out
+        if not k:
+            return out
+
+def _serve(port_q, opts: dict):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), type("Site", (_Site,), opts))
+    port_q.put(srv.server_port)
+    srv.serve_forever()
+
+def _local_adapter(base: str):
+    from requests.adapters import HTTPAdapter
+
+    class Local(HTTPAdapter):
+        # https://<host>/<path> → <base>/_/<host>/<path>（レスポンスの url は元に戻す）
+        def send(self, req, **kw):
+            orig = req.url
+            p = urlparse(orig)
+            req.url = f"{base}/_/{p.hostname}{p.path}" + (f"?{p.query}" if p.query else "")
+            r = super().send(req, **kw)
+            r.url = orig
+            return r
+    return Local
+
+def _write_inputs(d: str, n_terms: int, args) -> None:
+    terms = [WORDS[i % len(WORDS)] + (str(i // len(WORDS)) if i >= len(WORDS) else "") for i in range(n_terms)]
+    with open(os.path.join(d, "catalog.csv"), "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["queries_top10_pipe", "url", "title", "clicks_total", "first_seen_utc", "last_seen_utc", "new_flag"])
+        for i, t in enumerate(terms):
+            w.writerow([t, f"https://digi-mado.jp/a/{i}", f"{t}とは", 1000 - i, "", "", ""])
+    os.makedirs(os.path.join(d, "wat"), exist_ok=True)
+    for k in range(args.wat_files):
+        write_wat(os.path.join(d, "wat", f"f{k}.wat.gz"), args.wat_records, seed=k + 1)
+    with open(os.path.join(d, "config.yaml"), "w", encoding="utf-8") as f:
+        json.dump({  # JSON は YAML としても読める
+            "max_workers": args.workers,
+            "sleep_ms_between_fetches": args.interval_ms,
+            "results_per_query": 30,
+            "sheets": {"spool_dir": os.path.join(d, "spool"), "batch_rows": 500},
+            "index_query": {"workers": 4, "cc_rate_per_s": 0, "cdx_rate_per_s": 0, "max_pages": 1},
+            "stream": {"fetch_workers": args.workers, "check_workers": args.workers},
+            "budget": {"reserve_s": 0},
+            "cc": {"wat_source": os.path.join(d, "wat"), "wat_stride": 1, "max_wat_files": args.wat_files,
+                   "outlinks_per_file": 10 ** 6, "workers": 1, "tld_filter": ".jp"},
+        }, f, ensure_ascii=False)
+
+def run_once(args) -> dict:
+    """1 回分を実行して計測値を返す（カレントディレクトリと環境変数を書き換えるので、別プロセスで呼ぶ）"""
+    d, cwd = tempfile.mkdtemp(prefix="blb-bench-"), os.getcwd()
+    _write_inputs(d, args.terms, args)
+    port_q = multiprocessing.Queue()
+    opts = {"latency_s": args.latency_ms / 1000, "slow_s": args.slow_ms / 1000, "pages_per_term": args.pages_per_term,
+            "links_per_page": args.links_per_page, "page_kb": args.page_kb,
+            "mix": tuple(float(x) for x in args.mix.split(","))}
+    server = multiprocessing.Process(target=_serve, args=(port_q, opts), daemon=True)
+    server.start()
+    base = f"http://127.0.0.1:{port_q.get(timeout=30)}"
+    try:
+        # 設定・エンドポイントはモジュールの読み込み時に決まるので、import より先に環境変数を置く
+        os.environ.update(BLB_CONFIG=os.path.join(d, "config.yaml"), BLB_LOCAL_CATALOG=os.path.join(d, "catalog.csv"),
+                          CC_INDEX_BASE=base + "/idx", CDX_ENDPOINT=base + "/cdx",
+                          MAX_QUERIES=str(args.terms), TOPK_PER_QUERY=str(args.pages_per_term))
+        os.chdir(d)  # outputs/ は作業ディレクトリに書かれる
+        from src.client import build_session, set_session
+        from src.config import load_config
+        from src.metrics import get_metrics
+        from src.sheets import open_sheet, read_catalog
+        from src import pipeline, cc_wat
+        session = build_session()
+        session.mount("https://", _local_adapter(base)())
+        set_session(session)
+
+        t = time.perf_counter()
+        pipeline.run(time_budget_min=600)
+        wall = time.perf_counter() - t
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux は KB
+        m = get_metrics().to_dict()
+
+        t = time.perf_counter()
+        found = cc_wat.find_candidates_for_catalog(session, read_catalog(open_sheet()), load_config())
+        wat_s = time.perf_counter() - t
+    finally:
+        server.terminate()
+        server.join()
+        os.chdir(cwd)
+        if args.keep:
+            print(f"outputs: {os.path.join(d, 'outputs')}")  # metrics.json / report.md
+        else:
+            shutil.rmtree(d, ignore_errors=True)
+    c = m["counters"]
+    pages = c.get("pages", {}).get("fetched", 0)
+    links = c.get("links", {}).get("checked", 0)
+    records = args.wat_files * args.wat_records
+    return {
+        "wall_s": round(wall, 3),
+        "pages": pages,
+        "links_checked": links,
+        "broken": sum(m.get("broken", {}).get("by_domain", {}).values()),
+        "pages_per_s": round(pages / wall, 2),
+        "links_per_s": round(links / wall, 2),
+        "peak_rss_mb": round(rss, 1),
+        "stages": {k: {"busy_s": round(v["busy_s"], 3), "wall_s": round((v["last_s"] or 0) - (v["first_s"] or 0), 3)}
+                   for k, v in m.get("stages", {}).items()},
+        "timers": {k: v["seconds"] for k, v in m["timers"].items()},
+        "requests": c.get("requests", {}),
+        "wat_records_per_s": round(records / wat_s, 1),
+        "wat_matched_rows": len(found),
+    }
+
+def _child(args, out_q):
+    try:
+        out_q.put(run_once(args))
+    except BaseException as e:
+        out_q.put({"error": repr(e)})
+        raise
+
+def compare(cur: dict, base: dict, tolerance: float) -> list[tuple[str, float, float, float, bool]]:
+    """return: [(項目, 基準, 今回, 比, 悪化か)]（比は「大きいほど良い」向きに揃える）"""
+    out = []
+    for k in HIGHER + LOWER:
+        if k not in base or k not in cur or not base[k] or not cur[k]:
+            continue
+        ratio = cur[k] / base[k] if k in HIGHER else base[k] / cur[k]
+        out.append((k, base[k], cur[k], ratio, ratio < 1 - tolerance))
+    return out
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--terms", type=int, default=8)
+    p.add_argument("--pages-per-term", type=int, default=12)
+    p.add_argument("--links-per-page", type=int, default=8)
+    p.add_argument("--page-kb", type=int, default=40)
+    p.add_argument("--latency-ms", type=float, default=20)
+    p.add_argument("--slow-ms", type=float, default=400)
+    p.add_argument("--interval-ms", type=float, default=50, help="同一ホストの間隔（sleep_ms_between_fetches）")
+    p.add_argument("--workers", type=int, default=3)
+    p.add_argument("--mix", default="0.55,0.15,0.05,0.1,0.1,0.05", help="リンク先の比率 " + "/".join(LINK_KINDS))
+    p.add_argument("--wat-files", type=int, default=2)
+    p.add_argument("--wat-records", type=int, default=3000)
+    p.add_argument("--baseline", default=BASELINE)
+    p.add_argument("--tolerance", type=float, default=0.2, help="基準からこの割合以上悪化したら回帰とみなす")
+    p.add_argument("--save-baseline", action="store_true")
+    p.add_argument("--check", action="store_true", help="回帰があれば終了コード 1")
+    p.add_argument("--keep", action="store_true", help="作業ディレクトリ（outputs/metrics.json・report.md）を残す")
+    args = p.parse_args()
+
+    # 計測は毎回新しいプロセスで（モジュールの設定・共有 Session・ピーク RSS を持ち越さない）
+    out_q = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_child, args=(args, out_q))
+    child.start()
+    res = out_q.get()
+    child.join()
+    if "error" in res:
+        sys.exit(f"benchmark failed: {res['error']}")
+    params = {k: v for k, v in vars(args).items() if k not in ("baseline", "tolerance", "save_baseline", "check", "keep")}
+
+    print(f"wall {res['wall_s']:.2f}s  pages {res['pages']} ({res['pages_per_s']}/s)  "
+          f"links {res['links_checked']} ({res['links_per_s']}/s)  broken {res['broken']}  "
+          f"peak RSS {res['peak_rss_mb']} MB  WAT {res['wat_records_per_s']} rec/s")
+    print(f"{'stage':<14} {'busy_s':>8} {'wall_s':>8}")
+    for k, v in res["stages"].items():
+        print(f"{k:<14} {v['busy_s']:>8.2f} {v['wall_s']:>8.2f}")
+    for k, v in res["timers"].items():
+        print(f"{k:<14} {'':>8} {v:>8.2f}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"params": params, "result": res}, f, ensure_ascii=False, indent=2)
+        print(f"baseline saved: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print("no baseline（--save-baseline で保存）")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    if base.get("params") != params:
+        print("warning: baseline のパラメータが今回と異なる", {k: v for k, v in base.get("params", {}).items()
+                                                    if params.get(k) != v})
+    rows = compare(res, base["result"], args.tolerance)
+    print(f"\n{'metric':<18} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for k, b, c, r, bad in rows:
+        print(f"{k:<18} {b:>10} {c:>10} {r:>7.2f}{'  REGRESSION' if bad else ''}")
+    if args.check and any(bad for *_, bad in rows):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+post_http_filter のペナルティ計算ベンチマーク（従来の個別 re.search ×約 10 回 vs PenaltyEngine 1 パス）
+usage: python -m bench.penalty_engine [--dir 保存済み HTML のディレクトリ] [--pages 200]
+"""
+import argparse, os, re, time
+from src.filter import PenaltyEngine
+from bench.fixtures import html_corpus
+
+# --- 従来実装（比較用にそのまま残す）
+def _vendor_penalty(html: str) -> float:
+    score = 0.0
+    if re.search(r'価格|料金|資料請求|お問い合わせ|導入事例|無料トライアル|デモ|ログイン|サインイン|購入', html):
+        score += 1.0
+    if re.search(r'/(pricing|price|products?|solutions?|lp|contact|demo|trial|signup|register)(/|$)', html):
+        score += 0.8
+    if re.search(r'会社情報|採用|IR|プレスリリース', html):
+        score += 0.6
+    if '"@type":"Product"' in html or '"@type":"Offer"' in html:
+        score += 0.6
+    return min(score, 2.0)
+
+def _news_penalty(html: str, url: str) -> float:
+    s = 0.0
+    if re.search(r'/news/.*\d{4}[-/]\d{2}[-/]\d{2}', url):
+        s += 1.0
+    if 'property="og:type" content="article"' in html and re.search(r'<time[^>]+datetime=', html):
+        s += 0.6
+    if re.search(r'ニュース|速報|プレスリリース|配信', html):
+        s += 0.6
+    return min(s, 1.5)
+
+def _docrepo_penalty(html: str) -> float:
+    links = len(re.findall(r'href="[^"]+\.(pdf|docx?|pptx?|xlsx?|zip|svg|jpe?g|png|webp)"', html, flags=re.I))
+    p_count = len(re.findall(r'<p\b', html, flags=re.I))
+    s = 0.0
+    if links >= 5 and p_count <= 3:
+        s += 1.0
+    return min(s, 1.0)
+
+def legacy(url: str, html: str) -> dict:
+    return {"vendor_penalty": _vendor_penalty(html), "news_penalty": _news_penalty(html, url),
+            "docrepo_penalty": _docrepo_penalty(html)}
+
+def _load_dir(d: str) -> list[tuple[str, str]]:
+    out = []
+    for f in sorted(os.listdir(d)):
+        if f.endswith((".html", ".htm")):
+            with open(os.path.join(d, f), encoding="utf-8", errors="replace") as fh:
+                out.append((f"https://{os.path.splitext(f)[0]}/", fh.read()))
+    return out
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--dir", default="")
+    p.add_argument("--pages", type=int, default=200)
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+    corpus = _load_dir(args.dir) if args.dir else html_corpus(args.pages)
+    mb = sum(len(h.encode("utf-8")) for _, h in corpus) / 1e6
+    engine = PenaltyEngine()
+    diff = sum(1 for u, h in corpus if engine.scan(h, u) != legacy(u, h))
+    for label, fn in (("legacy (re x10)", legacy), ("PenaltyEngine", lambda u, h: engine.scan(h, u))):
+        best = min(_time(fn, corpus) for _ in range(args.repeat))
+        print(f"{label:16s} {len(corpus) / best:10,.0f} pages/sec  {mb / best:8.1f} MB/s")
+    print(f"pages={len(corpus)} size={mb:.1f}MB mismatches={diff}")
+
+def _time(fn, corpus) -> float:
+    t = time.perf_counter()
+    for u, h in corpus:
+        fn(u, h)
+    return time.perf_counter() - t
+
+if __name__ == "__main__":
+    main()
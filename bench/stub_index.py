@@ -0,0 +1,76 @@
+"""
+CC インデックス（pywb）/ Wayback CDX のローカルスタブ。CC_INDEX_BASE / CDX_ENDPOINT をここに向けて使う
+- CC: showNumPages=true → {"pages": N}、page=i → NDJSON（1 ページ page_size 件）。パターンに "none" を含むと 404
+- CDX: output=json、limit 件ごとに [], [resumeKey] を付けて返す。パターンに "fail" を含むと 500
+usage: python -m bench.stub_index [--port 8765]
+"""
+import argparse, json, threading, time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+class _Handler(BaseHTTPRequestHandler):
+    pages = 4
+    page_size = 3
+    cdx_total = 7
+    delay_s = 0.0
+
+    def log_message(self, *a):
+        pass
+
+    def _send(self, code: int, body: str, ct: str = "application/json"):
+        b = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", ct)
+        self.send_header("Content-Length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def do_GET(self):
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        pat = q.get("url", "")
+        if self.delay_s:
+            time.sleep(self.delay_s)
+        if u.path.startswith("/cdx"):
+            if "fail" in pat:
+                return self._send(500, "error", "text/plain")
+            start = int(q.get("resumeKey", "0"))
+            end = min(self.cdx_total, start + min(self.page_size, int(q.get("limit", "10"))))
+            rows = [["urlkey", "timestamp", "original"]]
+            rows += [["k", "20240101000000", f"https://cdx.example.jp/{pat.strip('*')}/{i}"] for i in range(start, end)]
+            if end < self.cdx_total and q.get("showResumeKey"):
+                rows += [[], [str(end)]]
+            return self._send(200, json.dumps(rows))
+        if "none" in pat:
+            return self._send(404, "No Captures found", "text/plain")
+        if q.get("showNumPages"):
+            return self._send(200, json.dumps({"pages": self.pages, "pageSize": 5, "blocks": self.pages * 5}))
+        p = int(q.get("page", "0"))
+        n = min(self.page_size, int(q.get("limit", "10")))
+        lines = [json.dumps({"url": f"https://cc.example.jp/{pat.strip('*')}/p{p}/{i}"}) for i in range(n)]
+        return self._send(200, "\n".join(lines), "text/x-ndjson")
+
+@contextmanager
+def serve(port: int = 0, **opts):
+    """return: ベース URL（CC_INDEX_BASE 用。CDX_ENDPOINT は base + "/cdx"）"""
+    handler = type("Handler", (_Handler,), opts)
+    srv = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    th = threading.Thread(target=srv.serve_forever, daemon=True)
+    th.start()
+    try:
+        yield f"http://127.0.0.1:{srv.server_port}"
+    finally:
+        srv.shutdown()
+        srv.server_close()
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--port", type=int, default=8765)
+    args = p.parse_args()
+    with serve(args.port) as base:
+        print(f"CC_INDEX_BASE={base} CDX_ENDPOINT={base}/cdx")
+        threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+HTTP 前フィルタのベンチマーク（URL/sec：旧 pre_http_filter の 1 件ずつ vs URLFilter.filter の一括）と判定の差分
+usage: python -m bench.url_filter [--n 1000000] [--hosts 20000] [--unique 0.3]
+（--unique: 異なる URL の割合。CC の外部リンクは同じ URL が多くのページから張られる）
+"""
+import argparse, random, re, time
+from collections import Counter
+from src.filter import URLFilter, REASONS, reason_counts, JA_RE
+from src.config import load_config
+
+# 旧実装（URL 文字列全体に正規表現を順に当てる）
+_ATTACH_EXT = re.compile(r'\.(pdf|zip|docx?|xlsx?|pptx?|svg|jpe?g|png|gif|webp)(?:$|\?)', re.I)
+_UTIL_PATH = re.compile(r'/(index\.[a-z0-9]+|wp-content/uploads/|feed|rss|atom|sitemap(\.xml)?|login|signin|register|cart|wp-admin)(/|$)', re.I)
+_NUM_SLD = re.compile(r'://\d{1,3}(\.\d{1,3}){3}|://[a-z]*\d+[a-z]*\.')
+
+def legacy_pre_http_filter(url: str) -> tuple[bool, str]:
+    if not url.startswith("https://"):
+        return (False, "http-scheme")
+    if url.endswith(".org") or re.search(r'\.org(?=/|$)', url):
+        return (False, "tld-org")
+    if _ATTACH_EXT.search(url):
+        return (False, "attachment")
+    if _UTIL_PATH.search(url):
+        return (False, "utility")
+    if _NUM_SLD.search(url):
+        return (False, "numeric-sld")
+    is_jp = (".jp/" in url) or bool(JA_RE.search(url))
+    if ".com/" in url and not is_jp:
+        return (False, "com-nonja")
+    if not (".jp/" in url or is_jp):
+        return (False, "non-ja")
+    return (True, "")
+
+WORDS = ["blog", "news", "column", "article", "guide", "review", "category", "tag", "2024", "p"]
+TAILS = ["", "/", ".html", ".pdf", ".png", "/feed", "/login", "/wp-content/uploads/a.jpg", "/棲み分け", "?page=2"]
+
+def make_urls(n: int, n_hosts: int, seed: int = 5, unique: float = 1.0) -> list[str]:
+    """CC の外部リンクに近い URL 群（同じホストが何度も出る。unique < 1 なら同じ URL も繰り返す）"""
+    rnd = random.Random(seed)
+    tlds = ["jp", "co.jp", "ne.jp", "com", "net", "org", "io", "de"]
+    hosts = []
+    for i in range(n_hosts):
+        r = rnd.random()
+        if r < 0.05:
+            hosts.append(rnd.choice(["www.facebook.com", "x.com", "www.youtube.com", "jp.pinterest.com", "twitter.com"]))
+        elif r < 0.1:
+            hosts.append(f"cdn{rnd.randrange(99)}.example.{rnd.choice(tlds)}")
+        else:
+            hosts.append(f"{rnd.choice(['www.', '', 'blog.'])}site{chr(97 + i % 26)}{chr(97 + i // 26 % 26)}{chr(97 + i // 676 % 26)}.{rnd.choice(tlds)}")
+    pool = []
+    for _ in range(max(1, int(n * unique))):
+        scheme = "https" if rnd.random() < 0.9 else "http"
+        path = "/".join(rnd.choice(WORDS) for _ in range(rnd.randint(0, 3)))
+        pool.append(f"{scheme}://{rnd.choice(hosts)}/{path}{rnd.choice(TAILS)}")
+    return pool + [rnd.choice(pool) for _ in range(n - len(pool))]
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--n", type=int, default=1_000_000)
+    p.add_argument("--hosts", type=int, default=20_000)
+    p.add_argument("--unique", type=float, default=0.3)
+    args = p.parse_args()
+    urls = make_urls(args.n, args.hosts, unique=args.unique)
+    blocklist = load_config().get("domain_blocklist") or ()
+
+    t = time.perf_counter()
+    old = [legacy_pre_http_filter(u) for u in urls]
+    dt_old = time.perf_counter() - t
+    # 旧実装は domain_blocklist を見ないので、比較用に 1 件ずつ endswith で当てる
+    t = time.perf_counter()
+    old_bl = [any(u.split("/", 3)[2].endswith(d) for d in blocklist) for u in urls]
+    dt_bl = time.perf_counter() - t
+
+    f = URLFilter(blocklist, https_only=True, com_in_ja=True)
+    t = time.perf_counter()
+    keep, codes = f.filter(urls)
+    dt_new = time.perf_counter() - t
+
+    print(f"{len(urls):,} URLs（異なる URL {len(set(urls)):,}）/ {args.hosts:,} hosts")
+    print(f"legacy per-URL       {dt_old:7.2f}s  {len(urls) / dt_old:>12,.0f} URL/s  (blocklist なし)")
+    print(f"  + blocklist endswith {dt_old + dt_bl:5.2f}s  {len(urls) / (dt_old + dt_bl):>12,.0f} URL/s")
+    print(f"URLFilter.filter     {dt_new:7.2f}s  {len(urls) / dt_new:>12,.0f} URL/s  "
+          f"({dt_old / dt_new:.1f}x / blocklist 込みの旧実装比 {(dt_old + dt_bl) / dt_new:.1f}x)")
+    print("reasons:", reason_counts(codes))
+    diff = Counter()
+    for u, (ok, r), bl, code in zip(urls, old, old_bl, codes):
+        new_r = REASONS[code]
+        if bl and new_r == "blocklist":
+            continue
+        if (ok, r) != (code == 0, new_r):
+            diff[(r or "keep", new_r or "keep")] += 1
+    print("differences (legacy -> new):", dict(diff.most_common()) or "none")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+WAT 前段フィルタのベンチマーク（records/sec：prefilter 無し vs 有り）
+usage: python -m bench.wat_prefilter [--wat bench/data/sample.wat.gz] [--repeat 3]
+"""
+import argparse, time
+from src.cc_wat import _iter_outlinks_from_wat, make_prefilter
+
+TERMS = ["棲み分け", "クラウド", "データ移行"]
+
+def _records(path: str) -> int:
+    import gzip
+    with gzip.open(path, "rb") as f:
+        return sum(1 for line in f if line.startswith(b"WARC/1.0"))
+
+def _run(path: str, prefilter, tld: str | None) -> tuple[float, int]:
+    t = time.perf_counter()
+    n = sum(1 for _ in _iter_outlinks_from_wat(None, path, TERMS, tld, 10**9, 30, 6, 1, [], prefilter=prefilter))
+    return time.perf_counter() - t, n
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--wat", default="bench/data/sample.wat.gz")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--tld", default=".jp")
+    args = p.parse_args()
+    tld = args.tld or None
+    recs = _records(args.wat)
+    for label, pf in (("json.loads all", None),
+                      ("prefilter", make_prefilter(tld, TERMS, 1))):
+        best, n = min(_run(args.wat, pf, tld) for _ in range(args.repeat))
+        print(f"{label:16s} {recs / best:12,.0f} records/sec  ({best:.3f}s, {n} outlinks)")
+
+if __name__ == "__main__":
+    main()
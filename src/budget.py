@@ -0,0 +1,121 @@
+import json, os, threading, time
+
+class TimeBudget:
+    """
+    実行全体の持ち時間（--time-budget-min）。締め切りの reserve_s 秒前を作業の打ち切り時刻とし、
+    残りは spool の送信とチェックポイントの書き出しに使う
+    """
+    def __init__(self, minutes: float, reserve_s: float = 120.0, t0: float | None = None):
+        self.t0 = time.monotonic() if t0 is None else t0
+        self.total_s = max(0.0, float(minutes) * 60)
+        self.reserve_s = min(max(0.0, float(reserve_s)), self.total_s / 2)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.t0
+
+    def remaining(self) -> float:
+        """作業に使える残り秒数（reserve_s を除く）"""
+        return self.total_s - self.reserve_s - self.elapsed()
+
+class BudgetScheduler(threading.Thread):
+    """
+    StreamPipeline を監視し、各段の実測スループット（ホスト間隔の待ちも含む）から
+    キューに残った仕事を捌き切る見込み時間を出して、残り時間に応じて段階的に縮退する。
+    - degrade: 残りが degrade_frac を切るか、見込みが残りを超えたら soft404 用の GET をやめる（HEAD のみ）
+    - close_intake: 見込みが残りを超えたら新しい候補の取り込みをやめ、キューに残った分だけ処理する
+    - stop: 打ち切り時刻で取得・検査待ちを再開用ファイルに退避して止める
+    """
+    def __init__(self, budget: TimeBudget, pipe, degrade_frac: float = 0.25, poll_s: float = 1.0):
+        super().__init__(name="budget", daemon=True)
+        self.budget = budget
+        self.pipe = pipe
+        self.degrade_frac = float(degrade_frac)
+        self.poll_s = float(poll_s)
+        self.degraded = False
+        self.events: list[dict] = []
+        self._done = threading.Event()
+
+    def _event(self, kind: str, **kw):
+        self.events.append({"event": kind, "elapsed_s": round(self.budget.elapsed(), 1), **kw})
+
+    def drain_estimate(self) -> float:
+        """段ごとの キューに残った件数 ÷ ここまでの実測スループット（件/秒）の合計（秒）"""
+        est = 0.0
+        pending = self.pipe.pending()
+        elapsed = max(1e-6, self.budget.elapsed())
+        for name, s in self.pipe.stats.items():
+            if s["in"]:
+                est += pending.get(name, 0) / (s["in"] / elapsed)
+        return est
+
+    def check(self):
+        left = self.budget.remaining()
+        if left <= 0:
+            if not self.pipe.stopping:
+                self._event("stop", pending=self.pipe.pending())
+                self.pipe.stop()
+            return
+        # 立ち上がり直後のスループットは当てにならないので、最初の 1 割（最大 5 分）は見込みを使わない
+        est = self.drain_estimate() if self.budget.elapsed() >= min(300.0, 0.1 * self.budget.total_s) else 0.0
+        if not self.degraded and (left < self.degrade_frac * self.budget.total_s or est > left):
+            self.degraded = True
+            self._event("degrade", remaining_s=round(left, 1), drain_est_s=round(est, 1))
+        if est > left and not self.pipe.intake_closed:
+            self._event("close_intake", remaining_s=round(left, 1), drain_est_s=round(est, 1))
+            self.pipe.close_intake()
+
+    def run(self):
+        while not self._done.wait(self.poll_s):
+            self.check()
+
+    def finish(self):
+        self._done.set()
+
+    def report(self) -> dict:
+        return {"budget_s": self.budget.total_s, "reserve_s": self.budget.reserve_s,
+                "elapsed_s": round(self.budget.elapsed(), 1), "degraded": self.degraded, "events": self.events}
+
+class ResumeLog:
+    """
+    打ち切りで処理できなかった仕事（取得待ちページ・検査待ちリンク）の退避先（JSONL、追記のみ）。
+    次回の実行は load() で読み戻してから新しい候補に進む
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.count = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def load(self) -> list[dict]:
+        """前回の退避分を読み、ファイルは読み込み中として退ける（今回が落ちても消えないよう done() で消す）"""
+        src = self.path + ".loading"
+        if os.path.exists(self.path):
+            if os.path.exists(src):
+                # 前回も読み戻し途中で落ちた：両方を残す
+                with open(self.path, encoding="utf-8") as f, open(src, "a", encoding="utf-8") as g:
+                    g.write(f.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, src)
+        if not os.path.exists(src):
+            return []
+        out = []
+        with open(src, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    out.append(json.loads(line))
+                except ValueError:
+                    break  # 書きかけの末尾行
+        return out
+
+    def add(self, rec: dict):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self.count += 1
+
+    def done(self):
+        """読み戻した分を処理し終えた（または退避し直した）ので消す"""
+        if os.path.exists(self.path + ".loading"):
+            os.remove(self.path + ".loading")
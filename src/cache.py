@@ -0,0 +1,175 @@
+import sqlite3, threading, time, os
+from urllib.parse import urlsplit
+from .utils import normalize_url
+
+# 判定クラスごとの既定 TTL（時間）。404/410 は長く、5xx/タイムアウトは短く
+DEFAULT_TTL_HOURS = {
+    "gone": 720,          # 404/410
+    "ok": 168,            # 2xx/3xx
+    "client_error": 72,   # その他 4xx
+    "server_error": 6,    # 5xx/429
+    "fetch_error": 3,     # タイムアウト・接続失敗
+}
+
+def outcome_class(code: int) -> str:
+    if code in (404, 410):
+        return "gone"
+    if code == -1:
+        return "fetch_error"
+    if code == 429 or code >= 500:
+        return "server_error"
+    if code >= 400:
+        return "client_error"
+    return "ok"
+
+class LinkCache:
+    """
+    リンク検査結果の永続キャッシュ（SQLite、正規化 URL がキー）。
+    status / final_url / content_type / soft_404 / ETag / Last-Modified / checked_at を保持。
+    """
+    def __init__(self, path: str, ttl_hours: dict | None = None):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = {**DEFAULT_TTL_HOURS, **(ttl_hours or {})}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS link_status (
+            url TEXT PRIMARY KEY, status INTEGER, final_url TEXT, content_type TEXT,
+            soft_404 INTEGER, etag TEXT, last_modified TEXT, checked_at REAL)""")
+        self._db.commit()
+
+    def get(self, url: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, final_url, content_type, soft_404, etag, last_modified, checked_at "
+                "FROM link_status WHERE url=?", (normalize_url(url),)).fetchone()
+        if not row:
+            return None
+        status, final_url, ct, soft, etag, lm, checked_at = row
+        ttl_s = float(self.ttl.get(outcome_class(status), 0)) * 3600
+        return {
+            "code": status, "final_url": final_url, "content_type": ct or "",
+            "soft_404": bool(soft), "etag": etag or "", "last_modified": lm or "",
+            "checked_at": checked_at, "fresh": (time.time() - checked_at) < ttl_s,
+        }
+
+    def put(self, url: str, code: int, final_url: str, content_type: str, soft_404: bool,
+            etag: str = "", last_modified: str = ""):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO link_status VALUES (?,?,?,?,?,?,?,?)",
+                (normalize_url(url), code, final_url, content_type or "", int(bool(soft_404)),
+                 etag or "", last_modified or "", time.time()))
+            self._db.commit()
+
+    def broken_hosts(self) -> dict[str, int]:
+        """ホストごとの壊れリンク（404/410・soft404）の件数（リンク検査の優先度付け用）"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url FROM link_status WHERE status IN (404, 410) OR soft_404=1").fetchall()
+        out: dict[str, int] = {}
+        for (u,) in rows:
+            h = urlsplit(u).netloc
+            out[h] = out.get(h, 0) + 1
+        return out
+
+    def touch(self, url: str):
+        """304（変更なし）で再検証できた場合に checked_at だけ更新"""
+        with self._lock:
+            self._db.execute("UPDATE link_status SET checked_at=? WHERE url=?",
+                             (time.time(), normalize_url(url)))
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_link_cache(conf: dict) -> LinkCache | None:
+    """config.yaml の link_cache セクションから開く（path 未指定なら無効）"""
+    lc = conf.get("link_cache", {}) or {}
+    path = lc.get("path") or ""
+    if not path:
+        return None
+    return LinkCache(path, lc.get("ttl_hours"))
+
+class DiscoveryState:
+    """
+    候補探索（CC/CDX 照会）の状態（SQLite、(term, cc_index) がキー）。
+    照会時のカタログ行の署名（last_seen_utc / new_flag）と、それまでに見つかった URL を保持し、
+    インデックスも行も変わっていない語は再照会せず、新しく見つかった URL だけを後段に流す
+    """
+    def __init__(self, path: str, max_age_days: float = 0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_age_s = float(max_age_days or 0) * 86400  # 0 なら署名が変わるまで再照会しない
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS discovery_term (
+            term TEXT, cc_index TEXT, row_sig TEXT, queried_at REAL, PRIMARY KEY (term, cc_index))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS discovery_url (
+            term TEXT, cc_index TEXT, url TEXT, first_seen REAL, PRIMARY KEY (term, cc_index, url))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS host_yield (
+            host TEXT PRIMARY KEY, hits INTEGER, updated_at REAL)""")
+        self._db.commit()
+
+    @staticmethod
+    def row_signature(row) -> str:
+        # カタログ A:G の行（CatalogRow / list）。last_seen_utc と new_flag が変われば再照会
+        v = (list(row) + [""] * 7)[:7]
+        return f"{v[5]}|{v[6]}"
+
+    def is_fresh(self, term: str, cc_index: str, row_sig: str) -> bool:
+        """前回と同じインデックス・同じ行署名で照会済みなら True（再照会不要）"""
+        with self._lock:
+            row = self._db.execute("SELECT row_sig, queried_at FROM discovery_term WHERE term=? AND cc_index=?",
+                                   (term, cc_index)).fetchone()
+        if not row or row[0] != row_sig:
+            return False
+        return not self.max_age_s or (time.time() - row[1]) < self.max_age_s
+
+    def unseen(self, term: str, cc_index: str, urls: list[str]) -> list[str]:
+        """この (term, cc_index) でまだ記録されていない URL（記録はしない）"""
+        with self._lock:
+            return [u for u in dict.fromkeys(urls) if not self._db.execute(
+                "SELECT 1 FROM discovery_url WHERE term=? AND cc_index=? AND url=?",
+                (term, cc_index, normalize_url(u))).fetchone()]
+
+    def record(self, term: str, cc_index: str, row_sig: str, urls: list[str]) -> list[str]:
+        """照会結果を記録し、この (term, cc_index) で初めて見つかった URL だけを返す（順序は保つ）"""
+        now = time.time()
+        new = []
+        with self._lock:
+            for u in dict.fromkeys(urls):
+                cur = self._db.execute("INSERT OR IGNORE INTO discovery_url VALUES (?,?,?,?)",
+                                       (term, cc_index, normalize_url(u), now))
+                if cur.rowcount:
+                    new.append(u)
+            self._db.execute("INSERT OR REPLACE INTO discovery_term VALUES (?,?,?,?)",
+                             (term, cc_index, row_sig, now))
+            self._db.commit()
+        return new
+
+    def add_host_hits(self, host: str, n: int = 1):
+        """候補ページのホストで壊れリンクが見つかった件数を積み増す（次回以降の取得の優先度付け用）"""
+        with self._lock:
+            self._db.execute("INSERT INTO host_yield VALUES (?,?,?) ON CONFLICT(host) DO UPDATE "
+                             "SET hits=hits+excluded.hits, updated_at=excluded.updated_at", (host, n, time.time()))
+            self._db.commit()
+
+    def host_hits(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._db.execute("SELECT host, hits FROM host_yield").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def open_discovery_state(conf: dict) -> DiscoveryState | None:
+    """config.yaml の discovery_state セクションから開く（path 未指定なら無効＝毎回全件照会）"""
+    ds = conf.get("discovery_state", {}) or {}
+    path = ds.get("path") or ""
+    if not path:
+        return None
+    return DiscoveryState(path, ds.get("max_age_days", 0))
@@ -1,45 +1,127 @@
-﻿import io, gzip, json, time
+﻿import io, os, re, gzip, json, time, hashlib
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from urllib.parse import urlparse, urljoin
+from urllib.request import url2pathname
 import requests
-from .utils import normalize_text
+from .utils import normalize_text, split_url
+from .matcher import TermMatcher
+from .client import get_session, build_session
+from .metrics import get_metrics
+
+CKPT_EVERY_LINES = 2000
+CC_DATA_BASE = os.getenv("CC_DATA_BASE", "https://data.commoncrawl.org")
+
+try:  # orjson があれば JSON 解析を高速化
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+TARGET_URI_RE = re.compile(rb'"WARC-Target-URI"\s*:\s*"https?://([^/:"?#]+)')
 
 def _fetch_wat_paths(crawl_id: str) -> list[str]:
-    base = f"https://data.commoncrawl.org/crawl-data/{crawl_id}/wat.paths.gz"
-    r = requests.get(base, timeout=60)
+    base = f"{CC_DATA_BASE}/crawl-data/{crawl_id}/wat.paths.gz"
+    r = get_session().get(base, timeout=60)
     r.raise_for_status()
     data = gzip.decompress(r.content).decode("utf-8").splitlines()
-    return [f"https://data.commoncrawl.org/{p}" for p in data]
+    return [f"{CC_DATA_BASE}/{p}" for p in data]
 
-def _host_endswith(url: str, tld: str) -> bool:
-    try:
-        host = urlparse(url).hostname or ""
-        return host.endswith(tld)
-    except Exception:
-        return False
+def _local_path(src: str) -> str:
+    return url2pathname(urlparse(src).path) if src.startswith("file://") else src
+
+def _list_local_wat_paths(source: str) -> list[str]:
+    """ローカルディレクトリ（または file:// ディレクトリ）の *.wat.gz を列挙（テスト・フィクスチャ用）"""
+    d = _local_path(source)
+    return [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith(".wat.gz")]
+
+@contextmanager
+def _open_wat(session, wat_url: str, timeout: int):
+    if wat_url.startswith(("http://", "https://")):
+        with session.get(wat_url, stream=True, timeout=timeout) as resp:
+            resp.raise_for_status()
+            yield gzip.GzipFile(fileobj=resp.raw)
+    else:
+        with gzip.open(_local_path(wat_url), "rb") as gz:
+            yield gz
+
+def _bad_path(path: str, query: str, excludes: list[str]) -> bool:
+    p = path + (("?" + query) if query else "")
+    return any(sub in p for sub in excludes)
 
-def _bad_path(url: str, excludes: list[str]) -> bool:
-    u = urlparse(url)
-    p = (u.path or "") + (("?" + u.query) if u.query else "")
-    return any(sub in p for sub in (excludes or []))
+def make_prefilter(tld_filter: str | None, terms: list[str], min_terms_matched: int,
+                   use_terms: bool = True, matcher: TermMatcher | None = None):
+    """
+    生バイトのまま不要レコードを弾く関数 line -> bool を返す（True = JSON 解析に進む）
+    - "Links" を含まない行（WARC ヘッダ行・リンク無しレコード）
+    - WARC-Target-URI のホストが tld_filter で終わらない
+    - 照合語（UTF-8 / JSON エスケープ表記）をどれも含まない（use_terms かつ min_terms_matched >= 1 のとき。
+      matcher は 0 でも 1 語以上の一致を求めるので、matcher を渡した場合は常に）
+      ※ NFKC の揺れ（全角英数など）は取りこぼすため、必要なら cc.prefilter_terms: false
+    """
+    tld = (tld_filter or "").lower().encode("utf-8")
+    words = matcher.terms if matcher is not None else [normalize_text(t) for t in terms if t]
+    term_re = None
+    need = max(1, min_terms_matched) if matcher is not None else min_terms_matched
+    if use_terms and need >= 1 and words:
+        variants = set()
+        for w in words:
+            variants.add(w.encode("utf-8"))
+            variants.add(json.dumps(w)[1:-1].encode("ascii"))
+        term_re = re.compile(b"|".join(re.escape(v) for v in sorted(variants, key=len, reverse=True)), re.I)
+
+    def _keep(line: bytes) -> bool:
+        if b'"Links"' not in line:
+            return False
+        if tld:
+            m = TARGET_URI_RE.search(line)
+            if m and not m.group(1).lower().endswith(tld):
+                return False
+        if term_re is not None and not term_re.search(line):
+            return False
+        return True
+    return _keep
 
 def _iter_outlinks_from_wat(session: requests.Session, wat_url: str, terms: list[str],
                             tld_filter: str | None, max_yield: int, timeout: int,
                             min_anchor_chars: int, min_terms_matched: int,
-                            path_excludes: list[str]):
-    with session.get(wat_url, stream=True, timeout=timeout) as resp:
-        resp.raise_for_status()
-        gz = gzip.GzipFile(fileobj=resp.raw)
+                            path_excludes: list[str], state: dict | None = None, progress=None,
+                            matcher: TermMatcher | None = None, prefilter=None):
+    """
+    prefilter（make_prefilter）を渡すと、弾かれた行は JSON を解析しない。
+    matcher を渡すと terms の代わりにカタログ全行の語で照合し、item に "matches": [[行, [語...]], ...] を付ける。
+    state: {"offset": 展開後バイト位置, "eof": bool} を読み書きする（再開用）。offset は処理し終えた行の末尾
+    （処理中の行は含めない）。offset より前の行は JSON を解析せずに読み飛ばす。
+    各 item にはその行の末尾の位置 "_offset" を付ける。progress(offset) は CKPT_EVERY_LINES 行ごとに呼ばれる
+    """
+    state = state if state is not None else {}
+    start = int(state.get("offset", 0))
+    with _open_wat(session, wat_url, timeout) as gz:
         yielded = 0
+        pos = 0
+        n = 0
         for line in gz:
             if yielded >= max_yield:
                 return
+            if pos > start:
+                state["offset"] = pos  # ここまで戻ってきたので前の行は処理し終えている
+            pos += len(line)
+            if pos <= start:
+                continue
+            n += 1
+            if progress and n % CKPT_EVERY_LINES == 0:
+                progress(state["offset"])
+            if prefilter is not None and not prefilter(line):
+                continue
             try:
-                rec = json.loads(line)
+                rec = _loads(line)
                 env = rec.get("Envelope", {})
                 src = env.get("WARC-Header-Metadata", {}).get("WARC-Target-URI")
                 if not src:
                     continue
-                if tld_filter and not _host_endswith(src, tld_filter):
+                # URL は split_url で 1 回だけ分解する（ホスト・パスの判定で使い回す）
+                src_host = split_url(src)[1]
+                if tld_filter and not src_host.endswith(tld_filter):
                     continue
                 links = (env.get("Payload-Metadata", {})
                            .get("HTTP-Response-Metadata", {})
@@ -47,7 +129,6 @@ def _iter_outlinks_from_wat(session: requests.Session, wat_url: str, terms: list
                            .get("Links", []))
                 if not links:
                     continue
-                src_host = (urlparse(src).hostname or "")
                 for lk in links:
                     raw = lk.get("url") or lk.get("href")
                     text = (lk.get("text") or "").strip()
@@ -55,31 +136,128 @@ def _iter_outlinks_from_wat(session: requests.Session, wat_url: str, terms: list
                         continue
                     if len(text) < min_anchor_chars:
                         continue
-                    abs_url = urljoin(src, raw)
-                    if not abs_url.startswith(("http://","https://")):
+                    abs_url = raw if raw.startswith(("http://", "https://")) else urljoin(src, raw)
+                    scheme, host, path, query = split_url(abs_url)
+                    if scheme not in ("http", "https"):
                         continue
                     # 内部リンクは除外（外部だけ）
-                    if (urlparse(abs_url).hostname or "") == src_host:
+                    if host == src_host:
                         continue
-                    if _bad_path(abs_url, path_excludes):
-                        continue
-                    tnorm = normalize_text(text)
-                    matched = sum(1 for t in terms if t and t in tnorm)
-                    if matched < min_terms_matched:
+                    if path_excludes and _bad_path(path, query, path_excludes):
                         continue
+                    item = {"source_url": src, "anchor_text": text, "link_url": abs_url, "_offset": pos}
+                    if matcher is not None:
+                        hits = matcher.match(text, min_terms_matched)
+                        if not hits:
+                            continue
+                        item["matches"] = [[r, ts] for r, ts in sorted(hits.items())]
+                    else:
+                        tnorm = normalize_text(text)
+                        matched = sum(1 for t in terms if t and t in tnorm)
+                        if matched < min_terms_matched:
+                            continue
                     yielded += 1
-                    yield {"source_url": src, "anchor_text": text, "link_url": abs_url}
+                    yield item
                     if yielded >= max_yield:
                         return
-            except Exception:
+            except Exception as e:
+                get_metrics().error("cc_wat.record", e)  # 壊れたレコードは飛ばす
                 continue
+        state["offset"] = max(pos, start)
+        state["eof"] = True
 
-def find_candidates_from_commoncrawl(session, terms: list[str], conf: dict) -> list[dict]:
+def _ckpt_path(ckpt_dir: str, wat_url: str, sig: str = "") -> str:
+    # 照合語が変わったら別チェックポイントにする
+    return os.path.join(ckpt_dir, hashlib.sha1(f"{wat_url}\n{sig}".encode("utf-8")).hexdigest() + ".jsonl")
+
+def _load_ckpt(path: str) -> tuple[list[dict], int, bool]:
+    """チェックポイント（追記型 JSONL）から (取得済み item, 再開オフセット, 完了済みか) を復元"""
+    items, offset, done = [], 0, False
+    if not path or not os.path.exists(path):
+        return items, offset, done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = _loads(line)
+            except Exception:
+                continue  # 書きかけの末尾行
+            offset = max(offset, int(rec.get("offset", 0)))
+            items.extend(rec.get("items", []))
+            if rec.get("done"):
+                done = True
+    return items, offset, done
+
+def _scan_wat_file(session, wat_url: str, terms: list[str], tld: str | None, per_file: int,
+                   max_yield: int, timeout: int, min_anchor_chars: int, min_terms_matched: int,
+                   path_excludes: list[str], ckpt_dir: str = "", sleep_ms: int = 0,
+                   matcher: TermMatcher | None = None, prefilter: bool = True,
+                   prefilter_terms: bool = True) -> list[dict]:
+    """
+    1 WAT ファイル分の outlink を返す。ckpt_dir があれば item とオフセットを逐次記録し、
+    中断後は続きから再開する（完了済みファイルは開かない）
+    """
+    sig = json.dumps([matcher.signature() if matcher is not None else terms, tld, min_anchor_chars,
+                      min_terms_matched, path_excludes], ensure_ascii=False)
+    path = _ckpt_path(ckpt_dir, wat_url, sig) if ckpt_dir else ""
+    items, offset, done = _load_ckpt(path)
+    if done or len(items) >= max_yield:
+        return items[:max_yield]
+    pf = make_prefilter(tld, terms, min_terms_matched, prefilter_terms, matcher) if prefilter else None
+    state = {"offset": offset}
+    ck = open(path, "a", encoding="utf-8") if path else None
+    # 1 レコード（同じ offset）の item はまとめて 1 行で書く（途中で落ちてもレコード単位で整合する）
+    pending, pending_off = [], 0
+    def _flush(off: int):
+        nonlocal pending
+        ck.write(json.dumps({"offset": off, "items": pending}, ensure_ascii=False) + "\n")
+        ck.flush()
+        pending = []
+    def _progress(off: int):
+        if not pending:
+            _flush(off)
+    try:
+        for item in _iter_outlinks_from_wat(session, wat_url, terms, tld, max_yield - len(items), timeout,
+                                            min_anchor_chars, min_terms_matched, path_excludes, state,
+                                            _progress if ck else None, matcher, pf):
+            off = item.pop("_offset")
+            items.append(item)
+            if ck:
+                if pending and off != pending_off:
+                    _flush(pending_off)
+                pending.append(item)
+                pending_off = off
+        if ck and pending:
+            _flush(pending_off)
+        if ck:
+            done = state.get("eof", False) or len(items) >= per_file
+            ck.write(json.dumps({"offset": state.get("offset", 0), "done": done}) + "\n")
+    except Exception as e:
+        get_metrics().error("cc_wat.scan", e)
+        # 途中で落ちた行の item は書かない（再開時にその行を読み直して全部出し直す）
+        if ck and pending and pending_off <= state.get("offset", 0):
+            _flush(pending_off)
+        pending = []
+        if ck and state.get("offset", 0) > offset:
+            _flush(state["offset"])
+    finally:
+        if ck:
+            ck.close()
+    if sleep_ms:
+        time.sleep(sleep_ms/1000.0)
+    return items
+
+def _scan_wat_job(kw: dict) -> list[dict]:
+    # プロセスプール用（Session はプロセスごとに作る。fork 元の接続プールは共有しない）
+    with build_session() as session:
+        return _scan_wat_file(session, **kw)
+
+def _collect(session, conf: dict, terms: list[str], matcher: TermMatcher | None, cap: int) -> list[dict]:
     cc = conf.get("cc", {}) or {}
     crawl_id = cc.get("crawl_id", "")
-    if not crawl_id:
+    source = cc.get("wat_source") or ""
+    if not crawl_id and not source:
         return []
-    paths = _fetch_wat_paths(crawl_id)
+    paths = _list_local_wat_paths(source) if source else _fetch_wat_paths(crawl_id)
     stride = max(1, int(cc.get("wat_stride", 4000)))
     max_files = int(cc.get("max_wat_files", 20))
     tld = cc.get("tld_filter") or None
@@ -87,21 +265,74 @@ def find_candidates_from_commoncrawl(session, terms: list[str], conf: dict) -> l
     min_anchor_chars = int(cc.get("min_anchor_chars", 6))
     min_terms_matched = int(cc.get("min_terms_matched", 1))
     path_excludes = cc.get("path_exclude_substrings", [])
+    workers = int(cc.get("workers", 1))
+    ckpt_dir = cc.get("checkpoint_dir") or ""
+    if ckpt_dir:
+        os.makedirs(ckpt_dir, exist_ok=True)
 
     results = []
     timeout = conf.get("timeout_seconds", 30)
     sleep_ms = conf.get("sleep_ms_between_fetches", 0)
     picked = paths[::stride][:max_files]
+    kw = dict(terms=terms, tld=tld, per_file=per_file, timeout=timeout, min_anchor_chars=min_anchor_chars,
+              min_terms_matched=min_terms_matched, path_excludes=path_excludes, ckpt_dir=ckpt_dir,
+              sleep_ms=sleep_ms, matcher=matcher, prefilter=bool(cc.get("prefilter", True)),
+              prefilter_terms=bool(cc.get("prefilter_terms", True)))
+
+    if workers <= 1:
+        for wat_url in picked:
+            try:
+                results.extend(_scan_wat_file(session, wat_url, max_yield=min(per_file, cap - len(results)), **kw))
+            except Exception as e:
+                get_metrics().error("cc_wat.file", e)
+            if len(results) >= cap:
+                return results[:cap]
+        return results
+
+    # 並列: 完了順に受け取り、先頭から連続して揃った分で上限に達したら残りを打ち切る（結果は逐次版と同じ順序）
+    per = [None] * len(picked)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = {ex.submit(_scan_wat_job, dict(kw, wat_url=u, max_yield=per_file)): i for i, u in enumerate(picked)}
+        for f in as_completed(futs):
+            try:
+                per[futs[f]] = f.result()
+            except Exception as e:
+                get_metrics().error("cc_wat.file", e)  # 子プロセス内のエラー件数は集計されない
+                per[futs[f]] = []
+            n = 0
+            for items in per:
+                if items is None:
+                    break
+                n += len(items)
+            if n >= cap:
+                for g in futs:
+                    g.cancel()
+                break
+    for items in per:
+        if items is None:
+            break
+        results.extend(items)
+    return results[:cap]
+
+def find_candidates_from_commoncrawl(session, terms: list[str], conf: dict) -> list[dict]:
+    """
+    cc.workers > 1 なら WAT ファイルをプロセスプールで並列に走査する。
+    cc.checkpoint_dir を指定すると中断後に続きから再開、cc.wat_source でローカルの *.wat.gz を対象にできる
+    """
+    return _collect(session, conf, terms, None, conf.get("results_per_query", 30))
 
-    for wat_url in picked:
-        try:
-            for item in _iter_outlinks_from_wat(session, wat_url, terms, tld, per_file, timeout,
-                                                min_anchor_chars, min_terms_matched, path_excludes):
-                results.append(item)
-                if len(results) >= conf.get("results_per_query", 30):
-                    return results
-        except Exception:
-            pass
-        if sleep_ms:
-            time.sleep(sleep_ms/1000.0)
-    return results
+def find_candidates_for_catalog(session, rows: list[list[str]], conf: dict) -> dict[int, list[dict]]:
+    """
+    カタログ全行（read_catalog の戻り値）を 1 回の WAT 走査で照合する。
+    return: {カタログ行: [{"source_url", "anchor_text", "link_url", "terms"}, ...]}（各行 results_per_query 件まで）
+    """
+    matcher = TermMatcher.from_catalog(rows)
+    per_row = int(conf.get("results_per_query", 30))
+    out: dict[int, list[dict]] = {}
+    for item in _collect(session, conf, [], matcher, per_row * max(1, len(rows))):
+        for row, ts in item["matches"]:
+            bucket = out.setdefault(row, [])
+            if len(bucket) < per_row:
+                bucket.append({"source_url": item["source_url"], "anchor_text": item["anchor_text"],
+                               "link_url": item["link_url"], "terms": ts})
+    return out
@@ -1,20 +1,219 @@
-import re
-from .fetcher import head_or_get_status
+import re, time, threading
+from functools import lru_cache
+from urllib.parse import urlsplit
+from .fetcher import head_or_get_status, connection_failure, SOFT404_MAX_BYTES
+from .filter import soft404_text, SOFT404_WORDS
+from .parser import text_only
+from .utils import normalize_url
+from .metrics import get_metrics
+
+@lru_cache(maxsize=32)
+def _soft404_re(patterns: tuple[str, ...]):
+    pats = [p for p in patterns if p]
+    return re.compile("|".join(re.escape(p) for p in pats), re.I) if pats else None
 
 def is_soft_404(body: str, patterns: list[str]) -> bool:
+    # 全パターンを 1 本の正規表現にまとめ、1 回の検索で判定
     if not body:
         return False
-    txt = body.lower()
-    return any(p.lower() in txt for p in (patterns or []))
+    rx = _soft404_re(tuple(patterns or ()))
+    return rx is not None and rx.search(body) is not None
+
+def _soft404_stop(patterns: list[str] | None):
+    # 本文の読み取りを打ち切る条件：生 HTML で語が見つかり、かつ可視テキストにも含まれる
+    words = list(patterns) if patterns is not None else list(SOFT404_WORDS)
+    return lambda html: is_soft_404(html, words) and is_soft_404(text_only(html), words)
 
-def check_link(session, url: str, timeout: int, soft404_patterns: list[str]):
-    code, final_url, body = head_or_get_status(session, url, timeout)
-    soft = (code == 200) and is_soft_404(body, soft404_patterns)
+def _verdict(code: int, final_url: str, soft: bool, note: str = "") -> dict:
     is_broken = (code >= 400 and code != 429) or code == -1 or soft
     return {
         "code": code,
         "final_url": final_url,
         "is_broken": is_broken,
         "soft_404": soft,
-        "note": "" if code != -1 else "fetch_error"
+        "note": note or ("" if code != -1 else "fetch_error")
     }
+
+HOST_DOWN = "host_down"  # 停止中のホストへのリンクの note（"host_down:nxdomain" など）
+
+class HostHealth:
+    """
+    リンク先ホストのサーキットブレーカ（スレッドセーフ）。
+    接続段階の失敗（fetcher.connection_failure）が threshold 回続いたホストは停止とし、以後のリンクは
+    リクエストせずに壊れリンク扱いにする。NXDOMAIN は名前解決の否定応答として dns_ttl_s の間覚え、1 回で停止。
+    停止から cooldown_s を過ぎたら 1 本だけ通し、応答があれば復帰する
+    """
+    def __init__(self, threshold: int = 3, cooldown_s: float = 900.0, dns_ttl_s: float = 3600.0,
+                 clock=time.monotonic):
+        self.threshold = max(1, int(threshold))
+        self.clock = clock
+        self.cooldown_s = cooldown_s
+        self.dns_ttl_s = dns_ttl_s
+        self._lock = threading.Lock()
+        self._fails: dict[str, int] = {}                 # ホスト → 連続失敗数
+        self._down: dict[str, tuple[str, float]] = {}    # ホスト → (理由, 停止期限 monotonic)
+        self._probing: set[str] = set()                  # 復帰確認の 1 本を通しているホスト
+
+    @classmethod
+    def from_config(cls, conf: dict) -> "HostHealth | None":
+        hc = conf.get("host_health", {}) or {}
+        if int(hc.get("threshold", 3)) <= 0:
+            return None
+        return cls(int(hc.get("threshold", 3)), float(hc.get("cooldown_s", 900)), float(hc.get("dns_ttl_s", 3600)))
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def is_down(self, url: str) -> bool:
+        """停止中か（復帰確認の枠は使わない。スケジューラでホスト待ちを飛ばす判定用）"""
+        d = self._down.get(self._key(url))
+        return d is not None and self.clock() < d[1]
+
+    def down(self, url: str) -> str:
+        """停止中なら理由（nxdomain / refused / tls など）、リクエストしてよければ ""（期限切れなら 1 本だけ通す）"""
+        host = self._key(url)
+        with self._lock:
+            d = self._down.get(host)
+            if d is None:
+                return ""
+            if self.clock() < d[1] or host in self._probing:
+                return d[0]
+            self._probing.add(host)
+            return ""
+
+    def failure(self, url: str, kind: str) -> bool:
+        """接続段階の失敗を記録する。return: このホストが停止中になったか"""
+        host = self._key(url)
+        with self._lock:
+            self._probing.discard(host)
+            n = self._fails[host] = self._fails.get(host, 0) + 1
+            if kind != "nxdomain" and n < self.threshold:
+                return False
+            tripped = host not in self._down
+            self._down[host] = (kind, self.clock() + (self.dns_ttl_s if kind == "nxdomain" else self.cooldown_s))
+        if tripped:
+            get_metrics().incr("host_health", f"tripped:{kind}")
+        return True
+
+    def release(self, url: str):
+        """復帰確認の 1 本を返す（成否が付かなかったとき。停止期限を過ぎていれば次の 1 本が通る）"""
+        with self._lock:
+            self._probing.discard(self._key(url))
+
+    def success(self, url: str):
+        """ステータスコードが返った（値は問わない）：連続失敗数を戻し、停止中なら復帰"""
+        host = self._key(url)
+        with self._lock:
+            self._fails.pop(host, None)
+            self._probing.discard(host)
+            recovered = self._down.pop(host, None) is not None
+        if recovered:
+            get_metrics().incr("host_health", "recovered")
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"down": {h: {"reason": r, "failures": self._fails.get(h, 0)} for h, (r, _) in self._down.items()}}
+
+def check_link(session, url: str, timeout: int, soft404_patterns: list[str] | None, cache=None,
+               max_bytes: int = SOFT404_MAX_BYTES, soft404: bool = True, health: HostHealth | None = None):
+    """
+    soft404_patterns が None の場合は filter.soft404_text（本文テキストで判定）を使う。
+    cache（cache.LinkCache）があれば先に参照し、期限切れでも ETag/Last-Modified があれば条件付きで再検証する。
+    本文は先頭 max_bytes までしか読まず、soft404 の語が見つかった時点で打ち切る。
+    soft404=False なら HEAD が通ったリンクは GET しない（soft404 は未判定のため、キャッシュにも書かない）
+    health（HostHealth）があれば、接続段階の失敗と停止中のホストへのリンク（リクエストしない）を
+    note="host_down:<理由>" の壊れリンクとして返す
+    """
+    cond = {}
+    hit = cache.get(url) if cache is not None else None
+    if hit:
+        if hit["fresh"]:
+            get_metrics().incr("cache", "hit")
+            return _verdict(hit["code"], hit["final_url"], hit["soft_404"], "cache")
+        if hit["etag"]:
+            cond["If-None-Match"] = hit["etag"]
+        if hit["last_modified"]:
+            cond["If-Modified-Since"] = hit["last_modified"]
+    if health is not None:
+        why = health.down(url)
+        if why:
+            get_metrics().incr("host_health", "skipped")
+            return _verdict(-1, url, False, f"{HOST_DOWN}:{why}")
+
+    errors = [] if health is not None else None
+    try:
+        code, final_url, body, hdrs = head_or_get_status(session, url, timeout, cond or None,
+                                                         max_bytes, _soft404_stop(soft404_patterns),
+                                                         head_only=not soft404, errors=errors)
+    except BaseException:
+        if health is not None:
+            health.release(url)  # 成否が付かなかった：復帰確認の枠を返す
+        raise
+    note = ""
+    if health is not None:
+        if code != -1:
+            health.success(url)
+        else:
+            # 読み取りタイムアウト・応答途中の切断などはホストに届いているので、どちらにも数えない
+            kind = next((k for k in map(connection_failure, errors) if k), "")
+            if kind:
+                health.failure(url, kind)
+                note = f"{HOST_DOWN}:{kind}"
+    if code == 304 and hit:
+        cache.touch(url)
+        get_metrics().incr("cache", "revalidated")
+        return _verdict(hit["code"], hit["final_url"], hit["soft_404"], "revalidated")
+    if not soft404 and not body and 200 <= code < 400:
+        return _verdict(code, final_url, False, "head_only")
+    if cache is not None:
+        get_metrics().incr("cache", "miss")
+    soft = False
+    if body and 200 <= code < 300:  # soft404 は 2xx で「見つかりません」を返すページ
+        txt = text_only(body)
+        soft = is_soft_404(txt, soft404_patterns) if soft404_patterns is not None else soft404_text(txt)
+    if cache is not None:
+        cache.put(url, code, final_url, hdrs.get("content-type", "").split(";")[0], soft,
+                  hdrs.get("etag", ""), hdrs.get("last-modified", ""))
+    return _verdict(code, final_url, soft, note)
+
+class LinkDeduper:
+    """
+    ストリーミング用の重複排除：同じ正規化 URL は最初の 1 件だけ検査に回し、
+    検査中に来た参照元は待ち行列に積んで、結果が出た時点でまとめて配る（新鮮なキャッシュは即答）
+    """
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._done: dict[str, dict] = {}
+        self._waiting: dict[str, list] = {}
+
+    def admit(self, url: str, item) -> tuple[str, dict | None]:
+        """return: ("check", None) 検査する / ("done", verdict) 結果あり / ("wait", None) 検査中（resolve で配られる）"""
+        key = normalize_url(url)
+        with self._lock:
+            if key in self._done:
+                get_metrics().incr("cache", "dedup")
+                return "done", self._done[key]
+            if key in self._waiting:
+                self._waiting[key].append(item)
+                return "wait", None
+            hit = self.cache.get(url) if self.cache is not None else None
+            if hit and hit["fresh"]:
+                get_metrics().incr("cache", "hit")
+                v = self._done[key] = _verdict(hit["code"], hit["final_url"], hit["soft_404"], "cache")
+                return "done", v
+            self._waiting[key] = []
+            return "check", None
+
+    def abandon(self, url: str) -> list:
+        """検査せずに手放す（時間切れの退避）。待っていた参照元を返す"""
+        with self._lock:
+            return self._waiting.pop(normalize_url(url), [])
+
+    def resolve(self, url: str, verdict: dict) -> list:
+        """検査結果を記録し、待っていた参照元を返す"""
+        key = normalize_url(url)
+        with self._lock:
+            self._done[key] = verdict
+            return self._waiting.pop(key, [])
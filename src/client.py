@@ -0,0 +1,55 @@
+import os, threading, requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .config import load_config
+
+DEFAULT_UA = "BLB/1.0 (+contact: you@example.com)"
+RETRY_STATUS = (429, 503)
+RETRY_AFTER_MAX = float(os.getenv("RETRY_AFTER_MAX", "60"))  # Retry-After が長すぎる場合の上限（秒）
+
+_session: requests.Session | None = None
+_lock = threading.Lock()
+
+class _Retry(Retry):
+    # Retry-After は尊重するが、CI の時間を食い潰さないよう上限を設ける
+    def get_retry_after(self, response):
+        v = super().get_retry_after(response)
+        return None if v is None else min(v, RETRY_AFTER_MAX)
+
+def user_agent(conf: dict | None = None) -> str:
+    conf = load_config() if conf is None else conf
+    return os.getenv("BLB_UA") or conf.get("user_agent") or DEFAULT_UA
+
+def build_session(conf: dict | None = None) -> requests.Session:
+    """
+    接続プール（ホストごとに max_workers 本）と 429/503 のリトライ（Retry-After 対応・指数バックオフ）付きの Session
+    config.yaml: max_workers / user_agent / http.retries / http.backoff / http.connect_retries
+    """
+    conf = load_config() if conf is None else conf
+    h = conf.get("http", {}) or {}
+    workers = max(1, int(conf.get("max_workers", 3)))
+    retry = _Retry(total=int(h.get("retries", 3)), connect=int(h.get("connect_retries", 1)),
+                   read=int(h.get("read_retries", 1)), status=int(h.get("retries", 3)),
+                   backoff_factor=float(h.get("backoff", 0.5)), status_forcelist=RETRY_STATUS,
+                   allowed_methods=frozenset({"HEAD", "GET"}), respect_retry_after_header=True,
+                   raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=max(10, workers * 4), pool_maxsize=workers, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers["User-Agent"] = user_agent(conf)
+    return s
+
+def get_session() -> requests.Session:
+    """プロセス内で共有する Session（初回に build_session で作る）"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = build_session()
+        return _session
+
+def set_session(s: requests.Session | None):
+    """共有 Session を差し替える（テストでスタブサーバ向けの Session を注入する等）。None で作り直し"""
+    global _session
+    with _lock:
+        _session = s
@@ -14,3 +14,21 @@ REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "12"))
 TOPK_PER_QUERY = int(os.getenv("TOPK_PER_QUERY", "10"))
 MAX_QUERIES = int(os.getenv("MAX_QUERIES", "50"))
 PER_DOMAIN_MAX_PER_QUERY = int(os.getenv("PER_DOMAIN_MAX_PER_QUERY", "2"))
+# config.yaml（ワーカー数・スリープ・soft404 パターン等）
+CONFIG_PATH = os.getenv("BLB_CONFIG", "config.yaml")
+
+_conf_cache: dict = {}
+
+def load_config(path: str | None = None) -> dict:
+    """config.yaml を読み込んで dict を返す（無ければ空 dict）。同一パスはキャッシュ"""
+    path = path or CONFIG_PATH
+    if path in _conf_cache:
+        return _conf_cache[path]
+    try:
+        import yaml
+        with open(path, encoding="utf-8-sig") as f:
+            conf = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        conf = {}
+    _conf_cache[path] = conf
+    return conf
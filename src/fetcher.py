@@ -1,22 +1,159 @@
-import requests, os, time
-UA = os.getenv("BLB_UA", "BLB/1.0 (+contact: you@example.com)")
+import os, re, ssl, time, errno, codecs, socket
+import requests
+from urllib.parse import urlsplit
+from .client import get_session
+from .metrics import get_metrics, status_class
 TO = float(os.getenv("REQUEST_TIMEOUT","12"))
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(2 * 1024 * 1024)))   # 候補ページ本文の上限
+SOFT404_MAX_BYTES = int(os.getenv("SOFT404_MAX_BYTES", str(64 * 1024)))  # soft404 判定で読む先頭バイト数
+CHUNK = 16 * 1024
+META_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([a-zA-Z0-9_\-]+)', re.I)
 
-def fetch(url: str):
-    r = requests.get(url, headers={"User-Agent": UA, "Accept":"text/html"}, timeout=TO, allow_redirects=True)
+def _is_html(ct: str) -> bool:
+    return (ct or "").split(";")[0].strip().lower().startswith("text/html")
+
+def _charset(r, head: bytes) -> str:
+    # ヘッダの charset → <meta charset> → 推定 → utf-8（requests の既定 ISO-8859-1 は使わない）
+    m = re.search(r'charset=["\']?([\w\-]+)', r.headers.get("content-type", ""), re.I)
+    cands = [m.group(1)] if m else []
+    mm = META_CHARSET.search(head[:4096])
+    if mm:
+        cands.append(mm.group(1).decode("ascii", "ignore"))
+    if not cands and head:
+        from charset_normalizer import from_bytes
+        best = from_bytes(head[:CHUNK]).best()
+        if best:
+            cands.append(best.encoding)
+    for enc in cands + ["utf-8"]:
+        try:
+            return codecs.lookup(enc).name
+        except LookupError:
+            continue
+    return "utf-8"
+
+def read_text(r, max_bytes: int, stop=None) -> str:
+    """
+    レスポンスを最大 max_bytes までストリーミングで読み、検出した charset で逐次デコードする。
+    stop(text) が True を返したら打ち切る（text はそこまでに読んだ全文。チャンクごとに呼ぶので小さい上限で使う）
+    """
+    dec = None
+    parts: list[str] = []
+    got = 0
+    try:
+        for chunk in r.iter_content(CHUNK):
+            if not chunk:
+                continue
+            chunk = chunk[:max_bytes - got]
+            got += len(chunk)
+            get_metrics().incr("bytes", "downloaded", len(chunk))
+            if dec is None:
+                dec = codecs.getincrementaldecoder(_charset(r, chunk))(errors="replace")
+            piece = dec.decode(chunk)
+            parts.append(piece)
+            if stop is not None and stop("".join(parts)):
+                break
+            if got >= max_bytes:
+                break
+        if dec is not None:
+            parts.append(dec.decode(b"", final=True))
+    finally:
+        r.close()
+    return "".join(parts)
+
+def _request(session, method: str, url: str, **kw):
+    """1 リクエスト（ステータス区分の件数とホスト別レイテンシを記録）。失敗は errors に数えて送出"""
+    m = get_metrics()
+    t = time.perf_counter()
+    try:
+        r = session.request(method, url, **kw)
+    except Exception as e:
+        m.incr("requests", "error")
+        m.error(f"fetcher.{method.lower()}", e)
+        raise
+    m.incr("requests", status_class(r.status_code))
+    m.observe(method.lower(), urlsplit(url).netloc, time.perf_counter() - t)
+    return r
+
+_NXDOMAIN = {getattr(socket, n) for n in ("EAI_NONAME", "EAI_NODATA") if hasattr(socket, n)}
+
+def connection_failure(e: BaseException) -> str:
+    """
+    接続できなかった例外の種類（nxdomain / dns / refused / tls / unreachable / connect_timeout）。
+    応答の途中で切れた・読み取りがタイムアウトした等、ホストに届いている失敗は ""
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return "connect_timeout"
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, socket.gaierror):
+            return "nxdomain" if e.errno in _NXDOMAIN else "dns"
+        if isinstance(e, ConnectionRefusedError):
+            return "refused"
+        if isinstance(e, (ssl.SSLError, requests.exceptions.SSLError)):
+            return "tls"
+        if isinstance(e, OSError) and e.errno in (errno.ENETUNREACH, errno.EHOSTUNREACH):
+            return "unreachable"
+        # requests → urllib3 MaxRetryError（reason）→ NewConnectionError → OS の例外、と辿る
+        reason = getattr(e, "reason", None)
+        e = e.__cause__ or (reason if isinstance(reason, BaseException) else None) or e.__context__
+    return ""
+
+def fetch(url: str, max_bytes: int = MAX_BODY_BYTES, session=None):
+    """HTML 以外は本文を読まない。本文は max_bytes まで"""
+    session = session or get_session()
+    r = _request(session, "GET", url, headers={"Accept":"text/html"}, timeout=TO, allow_redirects=True, stream=True)
     ct = r.headers.get("content-type","").split(";")[0]
-    return url, r.status_code, ct, r.text
+    if not _is_html(ct):
+        r.close()
+        return url, r.status_code, ct, ""
+    return url, r.status_code, ct, read_text(r, max_bytes)
 
-def fetch_head(url: str):
-    r = requests.head(url, headers={"User-Agent": UA}, timeout=TO, allow_redirects=True)
+def fetch_head(url: str, session=None):
+    r = _request(session or get_session(), "HEAD", url, timeout=TO, allow_redirects=True)
     return url, r.status_code, r.headers.get("content-type","")
 
-def fetch_many(urls: list[str], limit: int = 50):
-    out = []
-    for u in urls[:limit]:
+def head_or_get_status(session, url: str, timeout: float = TO, cond_headers: dict | None = None,
+                       max_bytes: int = SOFT404_MAX_BYTES, stop=None, head_only: bool = False,
+                       errors: list | None = None):
+    """
+    先に HEAD（安い）で 404/410 を拾う → 不明なら GET して本文を返す（soft404 判定用）
+    cond_headers（If-None-Match / If-Modified-Since）を付けた場合、304 ならそのまま返す
+    HEAD で HTML 以外と分かれば GET しない。本文は先頭 max_bytes まで、stop が True を返した時点で打ち切り
+    head_only なら HEAD が 2xx/3xx を返した時点で本文を読まずに返す（時間切れ間近の縮退用）
+    HEAD が接続段階で失敗した（connection_failure）なら GET でも同じなので取り直さない。
+    errors を渡すと、握りつぶした例外をそこへ積む（ホストの健全性判定用）
+    return: (code, final_url, body, headers)  GET した場合は GET のステータス・URL。取得失敗時は code=-1
+    """
+    st, final_url, hdrs = 0, url, {}
+    try:
+        r = _request(session, "HEAD", url, headers=cond_headers or None, timeout=timeout, allow_redirects=True)
+        st, final_url, hdrs = r.status_code, r.url or url, r.headers
+    except Exception as e:
+        # _request で計上済み。接続できたが HEAD を受け付けないサーバもあるので、GET で取り直す
+        if errors is not None:
+            errors.append(e)
+        if connection_failure(e):
+            return -1, final_url, "", hdrs
+    if st in (304, 404, 410):
+        return st, final_url, "", hdrs
+    if 200 <= st < 300 and hdrs.get("content-type") and not _is_html(hdrs.get("content-type")):
+        return st, final_url, "", hdrs
+    if head_only and 200 <= st < 400:
+        return st, final_url, "", hdrs
+    try:
+        r = _request(session, "GET", url, headers={"Accept":"text/html"}, timeout=timeout, allow_redirects=True, stream=True)
+    except Exception as e:
+        if errors is not None:
+            errors.append(e)
+        return -1, final_url, "", hdrs
+    if _is_html(r.headers.get("content-type","")):
         try:
-            out.append(fetch(u))
-            time.sleep(0.7)  # polite
-        except Exception:
-            pass
-    return out
+            body = read_text(r, max_bytes, stop)
+        except Exception as e:
+            get_metrics().error("fetcher.read", e)
+            body = ""
+    else:
+        body = ""
+        r.close()
+    return r.status_code, (r.url or final_url), body, r.headers  # GET した場合は GET の結果（HEAD を拒むサーバがある）
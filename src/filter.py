@@ -1,75 +1,250 @@
 import os, re
+from itertools import islice
+import numpy as np
+from .utils import split_url
 JA_RE = re.compile(r'[\u3040-\u30ff\u4e00-\u9fff]')  # ひら・カタ・漢
-ATTACH_EXT = re.compile(r'\.(pdf|zip|docx?|xlsx?|pptx?|svg|jpe?g|png|gif|webp)(?:$|\?)', re.I)
-UTIL_PATH = re.compile(r'/(index\.[a-z0-9]+|wp-content/uploads/|feed|rss|atom|sitemap(\.xml)?|login|signin|register|cart|wp-admin)(/|$)', re.I)
-NUM_SLD = re.compile(r'://\d{1,3}(\.\d{1,3}){3}|://[a-z]*\d+[a-z]*\.')
+ATTACH_EXTS = ("pdf", "zip", "docx?", "xlsx?", "pptx?", "svg", "jpe?g", "png", "gif", "webp")
+UTIL_PATHS = ("index\\.[a-z0-9]+", "wp-content/uploads/", "feed", "rss", "atom", "sitemap(\\.xml)?",
+              "login", "signin", "register", "cart", "wp-admin")
+# 小文字化した URL のパス以降に当てる（re.I より速い）
+ATTACH_EXT = re.compile(r'\.(?:' + "|".join(ATTACH_EXTS) + r')(?:$|\?)')
+UTIL_PATH = re.compile(r'/(?:' + "|".join(UTIL_PATHS) + r')(?:/|$)')
+NUM_LABEL = re.compile(r'[a-z]*\d+[a-z]*')  # 数字入りの SLD（先頭ラベル）。IPv4 もここに当たる
 
 HTTPS_ONLY = os.getenv("HTTPS_ONLY","1") == "1"
 FREE_INCLUDE_COM_IN_JA = os.getenv("FREE_INCLUDE_COM_IN_JA","1") == "1"
 
+# 前段フィルタの理由コード（REASONS[code]、0 は通過）。判定はこの順で最初に当たったもの
+REASONS = ("", "http-scheme", "blocklist", "tld-org", "attachment", "utility", "numeric-sld", "com-nonja", "non-ja")
+(KEEP, HTTP_SCHEME, BLOCKLIST, TLD_ORG, ATTACHMENT, UTILITY, NUMERIC_SLD, COM_NONJA, NON_JA) = range(len(REASONS))
+
+class DomainTrie:
+    """ドメインのサフィックス木（ラベルを末尾から辿る）。x.com を登録すると x.com と *.x.com に一致し、box.com には一致しない"""
+    def __init__(self, domains=()):
+        self.root: dict = {}
+        for d in domains or ():
+            self.add(d)
+
+    def add(self, domain: str):
+        node = self.root
+        for label in reversed(domain.strip().strip(".").lower().split(".")):
+            node = node.setdefault(label, {})
+        node[None] = domain  # 終端
+
+    def match(self, host: str) -> str | None:
+        """return: 一致した登録ドメイン（無ければ None）"""
+        node = self.root
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return None
+            if None in node:
+                return node[None]
+        return None
+
+class URLFilter:
+    """
+    HTTP 前のフィルタ（pre_http_filter の本体）。URL の scheme://netloc 部分ごとに、ホストだけで決まる判定
+    （scheme・ブロックリスト・TLD・数字 SLD・.jp/.com）を 1 回だけ計算して使い回し、
+    URL ごとにはパス以降（添付ファイル・ユーティリティパス）と日本語の有無だけを見る。
+    filter() は候補をまとめて判定し（同じ URL は 1 回）、通過マスクと理由コードの配列を返す
+    """
+    MAX_HOSTS = 200_000  # ホスト判定のメモの上限（超えたら捨てて作り直す）
+
+    def __init__(self, blocklist=(), https_only: bool | None = None, com_in_ja: bool | None = None):
+        self.trie = DomainTrie(blocklist)
+        self.https_only = HTTPS_ONLY if https_only is None else https_only
+        self.com_in_ja = FREE_INCLUDE_COM_IN_JA if com_in_ja is None else com_in_ja
+        self._hosts: dict[str, tuple[int, bool, bool, bool]] = {}
+
+    def _host(self, prefix: str) -> tuple[int, bool, bool, bool]:
+        """prefix（scheme://netloc）→ (ホストだけで決まる理由コード, 数字 SLD か, .jp か, .com か)"""
+        scheme, host, _, _ = split_url(prefix)
+        labels = host.split(".")
+        if not host or (self.https_only and scheme != "https"):
+            code = HTTP_SCHEME
+        elif self.trie.match(host):
+            code = BLOCKLIST
+        else:
+            code = TLD_ORG if labels[-1] == "org" else KEEP
+        v = (code, len(labels) > 1 and NUM_LABEL.fullmatch(labels[0]) is not None,
+             labels[-1] == "jp", labels[-1] == "com")
+        if len(self._hosts) >= self.MAX_HOSTS:
+            self._hosts.clear()
+        self._hosts[prefix] = v
+        return v
+
+    def check(self, url: str) -> int:
+        """return: 理由コード（KEEP=0 なら通過）"""
+        i = url.find("://")
+        if i < 0:
+            return HTTP_SCHEME
+        j = url.find("/", i + 3)
+        prefix = url[:j] if j >= 0 else url
+        if "?" in prefix or "#" in prefix:
+            j = min(k for k in (prefix.find("?"), prefix.find("#")) if k >= 0)
+            prefix = url[:j]
+        code, numeric, jp_host, com_host = self._hosts.get(prefix) or self._host(prefix)
+        if code:
+            return code
+        if j >= 0:
+            low = url.lower()
+            if ATTACH_EXT.search(low, j):
+                return ATTACHMENT
+            if UTIL_PATH.search(low, j):
+                return UTILITY
+        if numeric:
+            return NUMERIC_SLD
+        # 日本語ヒント：.jp or 日本語含有。 .com は FREE_INCLUDE_COM_IN_JA=1 のとき日本語に限定許可
+        is_jp = jp_host or JA_RE.search(url) is not None
+        if com_host and not (self.com_in_ja and is_jp):
+            return COM_NONJA
+        if not is_jp:
+            return NON_JA
+        return KEEP
+
+    def filter(self, urls) -> tuple[np.ndarray, np.ndarray]:
+        """return: (通過マスク bool[n], 理由コード uint8[n])"""
+        seen: dict[str, int] = {}
+        check = self.check
+        codes = np.fromiter((seen[u] if u in seen else seen.setdefault(u, check(u)) for u in urls),
+                            dtype=np.uint8, count=len(urls))
+        return codes == KEEP, codes
+
+def reason_counts(codes: np.ndarray) -> dict[str, int]:
+    """理由コードの配列 → {理由: 件数}（通過分は含めない）"""
+    n = np.bincount(codes, minlength=len(REASONS))
+    return {REASONS[i]: int(n[i]) for i in range(1, len(REASONS)) if n[i]}
+
+_url_filter: URLFilter | None = None
+
+def get_url_filter() -> URLFilter:
+    """config.yaml の domain_blocklist から作ったフィルタ"""
+    global _url_filter
+    if _url_filter is None:
+        from .config import load_config
+        _url_filter = URLFilter(load_config().get("domain_blocklist") or ())
+    return _url_filter
+
 def pre_http_filter(url: str) -> tuple[bool, str]:
-    if HTTPS_ONLY and not url.startswith("https://"):
-        return (False, "http-scheme")
-    if url.endswith(".org") or re.search(r'\.org(?=/|$)', url):
-        return (False, "tld-org")
-    if ATTACH_EXT.search(url):
-        return (False, "attachment")
-    if UTIL_PATH.search(url):
-        return (False, "utility")
-    if NUM_SLD.search(url):
-        return (False, "numeric-sld")
-    # 日本語ヒント：.jp or 日本語含有。 .com は FREE_INCLUDE_COM_IN_JA=1 のとき日本語に限定許可
-    is_jp = (".jp/" in url) or bool(JA_RE.search(url))
-    if ".com/" in url and not (FREE_INCLUDE_COM_IN_JA and is_jp):
-        return (False, "com-nonja")
-    if not (".jp/" in url or is_jp):
-        return (False, "non-ja")
-    return (True, "")
+    code = get_url_filter().check(url)
+    return (code == KEEP, REASONS[code])
+
+SOFT404_WORDS = ("not found", "404", "ページが見つかりません")
 
 def soft404_text(text: str) -> bool:
     t = text.lower()
-    return ("not found" in t or "404" in t or "ページが見つかりません" in t or len(t.strip()) < 60)
+    return any(w in t for w in SOFT404_WORDS) or len(t.strip()) < 60
 
 # vendor/news/docrepo の簡約版（C ルールの要点）
+# ルール: any=どれかが出現 / all=全て出現 / min_count・max_count=出現回数の条件 / target=url なら URL を対象 / flags: i
+# config.yaml の penalty_rules で差し替え可能
+DEFAULT_PENALTY_RULES = {
+    "vendor_penalty": {"cap": 2.0, "rules": [
+        {"weight": 1.0, "any": ["価格", "料金", "資料請求", "お問い合わせ", "導入事例", "無料トライアル", "デモ", "ログイン", "サインイン", "購入"]},
+        {"weight": 0.8, "any": [r'/(pricing|price|products?|solutions?|lp|contact|demo|trial|signup|register)(/|$)']},
+        {"weight": 0.6, "any": ["会社情報", "採用", "IR", "プレスリリース"]},
+        {"weight": 0.6, "any": ['"@type":"Product"', '"@type":"Offer"']},
+    ]},
+    "news_penalty": {"cap": 1.5, "rules": [
+        {"weight": 1.0, "target": "url", "any": [r'/news/.*\d{4}[-/]\d{2}[-/]\d{2}']},
+        {"weight": 0.6, "all": ['property="og:type" content="article"', r'<time[^>]+datetime=']},
+        {"weight": 0.6, "any": ["ニュース", "速報", "プレスリリース", "配信"]},
+    ]},
+    "docrepo_penalty": {"cap": 1.0, "rules": [
+        {"weight": 1.0, "flags": "i",
+         "min_count": {r'href="[^"]+\.(pdf|docx?|pptx?|xlsx?|zip|svg|jpe?g|png|webp)"': 5},
+         "max_count": {r'<p\b': 3}},
+    ]},
+}
+
+class PenaltyEngine:
+    """
+    ペナルティ規則を一度だけコンパイルし、1 ページ分の全ペナルティをまとめて計算する。
+    - any の語句は 1 本の正規表現（選言）にまとめて 1 回の検索で判定
+    - 同じパターンを複数ルールが参照する場合は 1 ページにつき 1 回だけ評価（例: プレスリリース）
+    - 出現回数の条件は必要な件数に達した時点で数えるのをやめ、cap に達したグループは残りを評価しない
+    """
+    def __init__(self, penalty_rules: dict | None = None):
+        self.groups = []  # [(name, cap, [(weight, is_url, any_rx, [all_rx], [(rx, min)], [(rx, max)])])]
+        for gname, g in (penalty_rules or DEFAULT_PENALTY_RULES).items():
+            rules = []
+            for r in g.get("rules", []):
+                fl = re.I if "i" in r.get("flags", "") else 0
+                anys = r.get("any") or []
+                rules.append((
+                    float(r.get("weight", 0.0)),
+                    r.get("target", "html") == "url",
+                    re.compile("|".join(f"(?:{p})" for p in anys), fl) if anys else None,
+                    [re.compile(p, fl) for p in r.get("all") or []],
+                    [(re.compile(p, fl), int(n)) for p, n in (r.get("min_count") or {}).items()],
+                    [(re.compile(p, fl), int(n)) for p, n in (r.get("max_count") or {}).items()],
+                ))
+            self.groups.append((gname, float(g.get("cap", 1e9)), rules))
+
+    @staticmethod
+    def _rule_hits(rule, html: str, url: str, memo: dict) -> bool:
+        weight, is_url, any_rx, all_rx, mins, maxs = rule
+        text = url if is_url else html
+        def found(rx) -> bool:
+            k = (rx, is_url, "s")
+            if k not in memo:
+                memo[k] = rx.search(text) is not None
+            return memo[k]
+        def at_least(rx, n: int) -> bool:
+            k = (rx, is_url, n)
+            if k not in memo:
+                memo[k] = sum(1 for _ in islice(rx.finditer(text), n)) >= n
+            return memo[k]
+        if any_rx is not None and not found(any_rx):
+            return False
+        if not all(found(rx) for rx in all_rx):
+            return False
+        # 上限条件は早く確定しやすい（通常の記事は <p> がすぐ上限を超える）ので先に評価
+        if any(at_least(rx, n + 1) for rx, n in maxs):
+            return False
+        return all(at_least(rx, n) for rx, n in mins)
+
+    def scan(self, html: str, url: str = "") -> dict[str, float]:
+        """return: {ペナルティ名: 値}"""
+        html, url = html or "", url or ""
+        memo: dict = {}
+        out = {}
+        for gname, cap, rules in self.groups:
+            score = 0.0
+            for rule in rules:
+                if score >= cap:
+                    break
+                if self._rule_hits(rule, html, url, memo):
+                    score += rule[0]
+            out[gname] = min(score, cap)
+        return out
+
+_engine: PenaltyEngine | None = None
+
+def get_penalty_engine() -> PenaltyEngine:
+    """config.yaml の penalty_rules から作ったエンジン（未指定なら既定ルール）"""
+    global _engine
+    if _engine is None:
+        from .config import load_config
+        conf = load_config()
+        _engine = PenaltyEngine(conf.get("penalty_rules"))
+    return _engine
+
 def vendor_penalty(html: str) -> float:
-    score = 0.0
-    if re.search(r'価格|料金|資料請求|お問い合わせ|導入事例|無料トライアル|デモ|ログイン|サインイン|購入', html):
-        score += 1.0
-    if re.search(r'/(pricing|price|products?|solutions?|lp|contact|demo|trial|signup|register)(/|$)', html):
-        score += 0.8
-    if re.search(r'会社情報|採用|IR|プレスリリース', html):
-        score += 0.6
-    if '"@type":"Product"' in html or '"@type":"Offer"' in html:
-        score += 0.6
-    return min(score, 2.0)
+    return get_penalty_engine().scan(html).get("vendor_penalty", 0.0)
 
 def news_penalty(html: str, url: str) -> float:
-    s = 0.0
-    if re.search(r'/news/.*\d{4}[-/]\d{2}[-/]\d{2}', url):
-        s += 1.0
-    if 'property="og:type" content="article"' in html and re.search(r'<time[^>]+datetime=', html):
-        s += 0.6
-    if re.search(r'ニュース|速報|プレスリリース|配信', html):
-        s += 0.6
-    return min(s, 1.5)
+    return get_penalty_engine().scan(html, url).get("news_penalty", 0.0)
 
 def docrepo_penalty(html: str) -> float:
-    links = len(re.findall(r'href="[^"]+\.(pdf|docx?|pptx?|xlsx?|zip|svg|jpe?g|png|webp)"', html, flags=re.I))
-    p_count = len(re.findall(r'<p\b', html, flags=re.I))
-    s = 0.0
-    if links >= 5 and p_count <= 3:
-        s += 1.0
-    return min(s, 1.0)
+    return get_penalty_engine().scan(html).get("docrepo_penalty", 0.0)
 
 def post_http_filter(url: str, html: str, content_type: str, status: int) -> tuple[bool, str, dict]:
     if not (content_type or "").lower().startswith("text/html"):
         return (False, "non-html", {})
     if status in (404, 410):
         return (False, str(status), {})
-    penalties = {
-        "vendor_penalty": vendor_penalty(html),
-        "news_penalty": news_penalty(html, url),
-        "docrepo_penalty": docrepo_penalty(html),
-    }
+    penalties = get_penalty_engine().scan(html, url)
     # soft404 は「除外」でなく、検査対象ページの評価には使わない（対象はリンク先）
     return (True, "", penalties)
@@ -1,5 +1,6 @@
 import argparse
 from .pipeline import run
+from .metrics import Profiler, set_profiler
 
 def main():
     p = argparse.ArgumentParser()
@@ -7,6 +8,8 @@ def main():
     p.add_argument("--scan", action="store_true")
     p.add_argument("--suggest", action="store_true")
     p.add_argument("--time-budget-min", type=int, default=180)
+    # cprofile: outputs/profile.pstats / sample: outputs/profile_sample.txt（折り畳みスタック）
+    p.add_argument("--profile", choices=["cprofile", "sample"], default=None)
     args = p.parse_args()
 
     # フラグ未指定ならフル実行
@@ -14,6 +17,8 @@ def main():
     s = args.scan     or (not args.discover and not args.suggest)
     g = args.suggest  or (not args.discover and not args.scan)
 
+    if args.profile:
+        set_profiler(Profiler(args.profile))
     run(d, s, g, args.time_budget_min)
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+from collections import deque
+from .utils import normalize_text
+
+try:  # pyahocorasick があれば C 実装を使う（無ければ純 Python 版）
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+def _norm(s: str) -> str:
+    return normalize_text(s).lower()
+
+class TermMatcher:
+    """
+    カタログ全行のクエリ語を 1 つの Aho-Corasick オートマトンにまとめ、
+    アンカーテキスト 1 回の走査でヒットした全カタログ行を返す（NFKC 正規化・小文字化して比較）
+    """
+    def __init__(self, row_terms: list[list[str]]):
+        self.terms: list[str] = []
+        self.rows_of: list[list[int]] = []   # term id -> カタログ行
+        tid: dict[str, int] = {}
+        for row, terms in enumerate(row_terms):
+            for t in terms:
+                t = _norm(t)
+                if not t:
+                    continue
+                if t not in tid:
+                    tid[t] = len(self.terms)
+                    self.terms.append(t)
+                    self.rows_of.append([])
+                if row not in self.rows_of[tid[t]]:
+                    self.rows_of[tid[t]].append(row)
+        self.n_rows = len(row_terms)
+        if ahocorasick is not None:
+            self._auto = ahocorasick.Automaton()
+            for t, i in tid.items():
+                self._auto.add_word(t, i)
+            if self.terms:
+                self._auto.make_automaton()
+        else:
+            self._auto = None
+            self._build()
+
+    @classmethod
+    def from_catalog(cls, rows: list[list[str]]) -> "TermMatcher":
+        """カタログ行（A 列 = queries_top10_pipe）から作る。行番号は rows のインデックス"""
+        return cls([[t.strip() for t in (r[0] if r else "").split("|") if t.strip()] for r in rows])
+
+    def _build(self):
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[int]] = [[]]
+        for i, t in enumerate(self.terms):
+            s = 0
+            for ch in t:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                s = nxt
+            out[s].append(i)
+        fail = [0] * len(goto)
+        q = deque(goto[0].values())
+        while q:
+            s = q.popleft()
+            for ch, nxt in goto[s].items():
+                q.append(nxt)
+                f = fail[s]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self._goto, self._fail, self._out = goto, fail, out
+
+    def find_terms(self, text: str) -> set[int]:
+        """text に含まれる term id の集合（text は正規化済みであること）"""
+        if not self.terms or not text:
+            return set()
+        if self._auto is not None:
+            return {i for _, i in self._auto.iter(text)}
+        goto, fail, out = self._goto, self._fail, self._out
+        found: set[int] = set()
+        s = 0
+        for ch in text:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]:
+                found.update(out[s])
+        return found
+
+    def match(self, text: str, min_terms: int = 1) -> dict[int, list[str]]:
+        """
+        return: {カタログ行: ヒットした語}（ヒット語数が min_terms 以上の行のみ）
+        """
+        hits: dict[int, list[str]] = {}
+        for i in self.find_terms(_norm(text)):
+            for row in self.rows_of[i]:
+                hits.setdefault(row, []).append(self.terms[i])
+        need = max(1, int(min_terms))
+        return {r: sorted(ts) for r, ts in hits.items() if len(ts) >= need}
+
+    def signature(self) -> str:
+        # チェックポイントの識別用
+        return "\n".join(f"{t}\t{','.join(map(str, rs))}" for t, rs in zip(self.terms, self.rows_of))
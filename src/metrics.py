@@ -0,0 +1,261 @@
+import bisect, cProfile, io, json, os, pstats, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+
+# ホスト別レイテンシのヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def status_class(code: int) -> str:
+    if code is None or code <= 0:
+        return "error"
+    return f"{code // 100}xx"
+
+class Metrics:
+    """
+    実行 1 回分の計測値（スレッドセーフ）。
+    - counters: 名前 → キー → 件数（例: requests / 2xx、excluded_pre / tld-org、errors / fetcher.head:Timeout）
+    - timers:   区間名 → 合計秒数・回数
+    - latency:  名前 → ホスト → LATENCY_BUCKETS ごとの件数・合計・最大
+    - sections: 他の集計（段ごとの統計・持ち時間・CC/CDX 照会など）をそのまま載せる
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters: dict[str, Counter] = {}
+            self.timers: dict[str, list] = {}
+            self.latency: dict[str, dict[str, dict]] = {}
+            self.sections: dict[str, object] = {}
+
+    def incr(self, name: str, key: str = "total", n: int = 1):
+        with self._lock:
+            self.counters.setdefault(name, Counter())[key] += n
+
+    def error(self, where: str, e: BaseException | None = None):
+        """握りつぶしていた例外を場所・種類ごとに数える"""
+        self.incr("errors", f"{where}:{type(e).__name__}" if e is not None else where)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            t = self.timers.setdefault(name, [0.0, 0])
+            t[0] += seconds
+            t[1] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - t)
+
+    def timed_iter(self, name: str, it):
+        """it の各 next() にかかった時間を name に積む（生成器を close すると元の it も閉じる）"""
+        it = iter(it)
+        try:
+            while True:
+                t = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self.add_time(name, time.perf_counter() - t)
+                yield item
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+
+    def observe(self, name: str, host: str, seconds: float):
+        with self._lock:
+            h = self.latency.setdefault(name, {}).get(host)
+            if h is None:
+                h = self.latency[name][host] = {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "count": 0,
+                                                "sum": 0.0, "max": 0.0}
+            h["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            h["count"] += 1
+            h["sum"] += seconds
+            h["max"] = max(h["max"], seconds)
+
+    def section(self, name: str, value):
+        with self._lock:
+            self.sections[name] = value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started,
+                "wall_s": round(time.time() - self.started, 3),
+                "counters": {k: dict(v) for k, v in self.counters.items()},
+                "timers": {k: {"seconds": round(v[0], 3), "count": v[1]} for k, v in self.timers.items()},
+                "latency_buckets_s": list(LATENCY_BUCKETS),
+                "latency": {k: {h: dict(v) for h, v in hosts.items()} for k, hosts in self.latency.items()},
+                **self.sections,
+            }
+
+    def write(self, out_dir: str = "outputs") -> dict:
+        """out_dir/metrics.json と out_dir/report.md を書く"""
+        os.makedirs(out_dir, exist_ok=True)
+        d = self.to_dict()
+        with open(os.path.join(out_dir, "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump(d, f, ensure_ascii=False, indent=2)
+        with open(os.path.join(out_dir, "report.md"), "w", encoding="utf-8") as f:
+            f.write(render_report(d))
+        return d
+
+def _pct(h: dict, q: float) -> str:
+    # バケットの上端で近似したパーセンタイル
+    need, acc = q * h["count"], 0
+    for i, n in enumerate(h["buckets"]):
+        acc += n
+        if acc >= need and n:
+            return f"≤{LATENCY_BUCKETS[i]}s" if i < len(LATENCY_BUCKETS) else f">{LATENCY_BUCKETS[-1]}s"
+    return "-"
+
+def stage_wall(s: dict) -> float:
+    """StreamPipeline.stats の 1 段分から、最初の着手〜最後の完了の秒数"""
+    return (s["last_s"] - s["first_s"]) if s.get("first_s") is not None else 0.0
+
+def render_report(d: dict, top_hosts: int = 15) -> str:
+    out = ["# Broken Link Builder 実行レポート", "",
+           f"- 開始: {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(d['started_at']))} UTC",
+           f"- 所要: {d['wall_s']:.1f}s", ""]
+    c = d["counters"]
+    out += ["## 結果", "", "| 項目 | 件数 |", "|---|---:|",
+            f"| 候補ページ | {c.get('candidates', {}).get('discovered', 0)} |",
+            f"| 取得したページ | {c.get('pages', {}).get('fetched', 0)} |",
+            f"| 検査したリンク | {c.get('links', {}).get('checked', 0)} |",
+            f"| 壊れリンク | {sum((d.get('broken') or {}).get('by_domain', {}).values())} |",
+            f"| ダウンロード（MB） | {c.get('bytes', {}).get('downloaded', 0) / 1e6:.1f} |", ""]
+    broken = d.get("broken") or {}
+    if broken.get("by_domain"):
+        out += ["## 壊れリンクのあるドメイン", "", "| ドメイン | 件数 |", "|---|---:|"]
+        out += [f"| {h} | {n} |" for h, n in list(broken["by_domain"].items())[:top_hosts]] + [""]
+    if broken.get("top"):
+        out += ["## 代替スコア上位の壊れリンク", "", "| ページ | リンク先 | アンカー | コード | 代替記事 | スコア |",
+                "|---|---|---|---:|---|---:|"]
+        out += [f"| {b['page_url']} | {b['href']} | {b['anchor'].replace('|', ' ')} | "
+                f"{'soft404' if b['soft_404'] else 'host_down' if b['code'] == -1 else b['code']} | "
+                f"{b['replacement_url']} | {b['score']:.2f} |"
+                for b in broken["top"]] + [""]
+    stages = d.get("stages") or {}
+    if stages:
+        out += ["## 段ごと（処理時間は全ワーカーの合計、区間は最初の着手〜最後の完了）", "",
+                "| 段 | 入力 | 出力 | 処理時間(s) | 区間(s) | 退避 |", "|---|---:|---:|---:|---:|---:|"]
+        out += [f"| {k} | {v['in']} | {v['out']} | {v['busy_s']:.1f} | {stage_wall(v):.1f} | {v.get('spilled', 0)} |"
+                for k, v in stages.items()]
+        out.append("")
+    if d["timers"]:
+        out += ["## 区間", "", "| 区間 | 秒 | 回数 |", "|---|---:|---:|"]
+        out += [f"| {k} | {v['seconds']:.2f} | {v['count']} |"
+                for k, v in sorted(d["timers"].items(), key=lambda kv: -kv[1]["seconds"])]
+        out.append("")
+    for name, c in sorted(d["counters"].items()):
+        out += [f"## {name}", "", "| キー | 件数 |", "|---|---:|"]
+        out += [f"| {k} | {v} |" for k, v in sorted(c.items(), key=lambda kv: -kv[1])] + [""]
+    for name, hosts in sorted(d["latency"].items()):
+        out += [f"## レイテンシ: {name}（件数上位 {top_hosts} ホスト）", "",
+                "| ホスト | 件数 | 平均(s) | p50 | p95 | 最大(s) |", "|---|---:|---:|---:|---:|---:|"]
+        for h, v in sorted(hosts.items(), key=lambda kv: -kv[1]["count"])[:top_hosts]:
+            out.append(f"| {h} | {v['count']} | {v['sum'] / v['count']:.2f} | {_pct(v, 0.5)} | {_pct(v, 0.95)} | {v['max']:.2f} |")
+        out.append("")
+    down = (d.get("host_health") or {}).get("down") or {}
+    if down:
+        out += ["## 停止したリンク先ホスト（以後のリンクはリクエストせずに壊れ扱い）", "",
+                "| ホスト | 理由 | 連続失敗 |", "|---|---|---:|"]
+        out += [f"| {h} | {v['reason']} | {v['failures']} |" for h, v in list(down.items())[:top_hosts * 2]] + [""]
+    budget = d.get("budget") or {}
+    if budget.get("events"):
+        out += ["## 持ち時間", ""]
+        out += [f"- {e['elapsed_s']}s: {e['event']}" for e in budget["events"]] + [""]
+    if d.get("profile"):
+        out += ["## プロファイル", "", "```", d["profile"].rstrip(), "```", ""]
+    return "\n".join(out)
+
+METRICS = Metrics()
+
+def get_metrics() -> Metrics:
+    """プロセス内で共有する計測値"""
+    return METRICS
+
+class Profiler:
+    """
+    --profile 用。cprofile: スレッドごとに cProfile を取り、終了時にまとめる（thread() を通したスレッドのみ）
+    sample: interval_s ごとに全スレッドのスタックを採取し、折り畳みスタック（flamegraph.pl 形式）で書く
+    """
+    def __init__(self, mode: str = "", interval_s: float = 0.005):
+        self.mode = mode or ""
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._profiles: list[cProfile.Profile] = []
+        self._stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @contextmanager
+    def thread(self):
+        """このスレッドの処理を cProfile で計測する（cprofile モード以外は何もしない）"""
+        if self.mode != "cprofile":
+            yield
+            return
+        p = cProfile.Profile()
+        p.enable()
+        try:
+            yield
+        finally:
+            p.disable()
+            with self._lock:
+                self._profiles.append(p)
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        if self.mode == "sample":
+            self._thread = threading.Thread(target=self._sample, name="sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self, out_dir: str = "outputs", top: int = 30) -> str:
+        """結果をファイルに書き、レポート用の上位の要約を返す"""
+        os.makedirs(out_dir, exist_ok=True)
+        if self.mode == "cprofile" and self._profiles:
+            st = pstats.Stats(self._profiles[0])
+            for p in self._profiles[1:]:
+                st.add(p)
+            st.dump_stats(os.path.join(out_dir, "profile.pstats"))
+            buf = io.StringIO()
+            pstats.Stats(os.path.join(out_dir, "profile.pstats"), stream=buf).sort_stats("cumulative").print_stats(top)
+            return buf.getvalue()
+        if self.mode == "sample" and self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            with open(os.path.join(out_dir, "profile_sample.txt"), "w", encoding="utf-8") as f:
+                for stack, n in self._stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+            leaf = Counter()
+            for stack, n in self._stacks.items():
+                leaf[stack.rsplit(";", 1)[-1]] += n
+            total = sum(leaf.values()) or 1
+            return "\n".join(f"{n / total:6.1%}  {fn}" for fn, n in leaf.most_common(top))
+        return ""
+
+PROFILER = Profiler()
+
+def set_profiler(p: Profiler):
+    global PROFILER
+    PROFILER = p
+
+def get_profiler() -> Profiler:
+    return PROFILER
@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+from .utils import normalize_url
+
+@dataclass(slots=True)
+class Candidate:
+    """探索で見つかった候補ページ 1 件（候補URL シートの 1 行）"""
+    page_url: str
+    source_query: str
+    title: str = ""
+
+    def row(self, found_at: str) -> list[str]:
+        return [self.page_url, self.title, self.source_query, found_at]
+
+@dataclass(slots=True)
+class LinkCheck:
+    """候補ページ内の外部リンク 1 本（検査待ち）。queries はそのページに当たった全クエリ"""
+    page_url: str
+    queries: tuple[str, ...]
+    href: str
+    anchor_text: str
+
+    def to_json(self) -> list:
+        return [self.page_url, list(self.queries), self.href, self.anchor_text]
+
+    @classmethod
+    def from_json(cls, v: list) -> "LinkCheck":
+        return cls(v[0], tuple(v[1]), v[2], v[3])
+
+@dataclass(slots=True)
+class BrokenLink:
+    """壊れリンクと代替記事（検査結果シートの 1 行）"""
+    link: LinkCheck
+    code: int
+    soft_404: bool
+    replacement_url: str = ""
+    score: float = 0.0
+
+    def row(self) -> list[str]:
+        return [self.link.page_url, self.link.href, self.link.anchor_text, str(self.code or 0),
+                "1" if self.soft_404 else "0", self.replacement_url, f"{self.score:.2f}"]
+
+class PageQueryIndex:
+    """
+    正規化ページ URL → そのページを見つけたクエリ（登録順・重複なし）。
+    クエリ文字列は 1 回だけ保持し、ページ側はクエリ番号の list だけを持つ
+    """
+    __slots__ = ("_qid", "_queries", "_pages")
+
+    def __init__(self):
+        self._qid: dict[str, int] = {}
+        self._queries: list[str] = []
+        self._pages: dict[str, list[int]] = {}
+
+    def add(self, page_url: str, query: str) -> bool:
+        """return: このページが初出なら True（取得は初出のときだけ）"""
+        i = self._qid.get(query)
+        if i is None:
+            i = self._qid[query] = len(self._queries)
+            self._queries.append(query)
+        key = normalize_url(page_url)
+        ids = self._pages.get(key)
+        if ids is None:
+            self._pages[key] = [i]
+            return True
+        if i not in ids:
+            ids.append(i)
+        return False
+
+    def queries(self, page_url: str) -> tuple[str, ...]:
+        return tuple(self._queries[i] for i in self._pages.get(normalize_url(page_url), ()))
+
+    def __contains__(self, page_url: str) -> bool:
+        return normalize_url(page_url) in self._pages
+
+    def __len__(self) -> int:
+        return len(self._pages)
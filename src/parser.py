@@ -1,20 +1,165 @@
 from bs4 import BeautifulSoup
-import re
+from html.parser import HTMLParser
+import os
+from .metrics import get_metrics
 
-def find_anchors_for_query(html: str, query_terms: list[str]) -> list[tuple[str,str]]:
-    """
-    return: list of (href, anchor_text)
-    """
+# 高速な C 実装のパーサがあれば使う（無ければ従来どおり BeautifulSoup + html.parser）
+try:
+    from selectolax.lexbor import LexborHTMLParser as _Lexbor
+except ImportError:
+    _Lexbor = None
+try:
+    import lxml.html as _lxml_html
+    from lxml import etree as _etree
+except ImportError:
+    _lxml_html = _etree = None
+
+HTML_BACKEND = os.getenv("BLB_HTML_BACKEND", "auto")  # auto / selectolax / lxml / bs4
+NON_TEXT_TAGS = ("script", "style", "template")        # 本文テキストに含めない（bs4 の get_text と同じ）
+STREAM_CHUNK = 16 * 1024
+
+def _backend() -> str:
+    b = HTML_BACKEND
+    if b == "selectolax" and _Lexbor is not None: return b
+    if b == "lxml" and _lxml_html is not None: return b
+    if b == "auto":
+        if _Lexbor is not None: return "selectolax"
+        if _lxml_html is not None: return "lxml"
+    return "bs4"
+
+def _join(strings) -> str:
+    return " ".join(s for s in (t.strip() for t in strings) if s)
+
+def _slx_text(node) -> str:
+    return _join(n.text_content for n in node.traverse(include_text=True) if n.tag == "-text")
+
+def _parse_selectolax(html: str, want_text: bool):
+    tree = _Lexbor(html)
+    anchors = [(a.attributes.get("href") or "", _slx_text(a)) for a in tree.css("a")]
+    text = ""
+    if want_text:
+        tree.strip_tags(list(NON_TEXT_TAGS))
+        text = _slx_text(tree.root) if tree.root else ""
+    return anchors, text
+
+def _parse_lxml(html: str, want_text: bool):
+    doc = _lxml_html.fromstring(html)
+    anchors = [(a.get("href") or "", _join(a.itertext())) for a in doc.iter("a")]
+    text = ""
+    if want_text:
+        for el in list(doc.iter(*NON_TEXT_TAGS)):
+            el.drop_tree()
+        text = _join(doc.itertext())
+    return anchors, text
+
+def _parse_bs4(html: str, want_text: bool):
     soup = BeautifulSoup(html, "html.parser")
+    anchors = [(a.get("href") or "", a.get_text(" ", strip=True) or "") for a in soup.find_all("a")]
+    return anchors, (soup.get_text(" ", strip=True) if want_text else "")
+
+def _parse(html: str, want_text: bool):
+    b = _backend()
+    if b != "bs4" and html:
+        try:
+            return _parse_selectolax(html, want_text) if b == "selectolax" else _parse_lxml(html, want_text)
+        except Exception as e:
+            get_metrics().error(f"parser.{b}", e)  # エンコーディング宣言付きの XHTML 等は bs4 で読み直す
+    return _parse_bs4(html or "", want_text)
+
+def _match(anchors, query_terms: list[str] | None) -> list[tuple[str,str]]:
     out = []
-    for a in soup.find_all("a"):
-        txt = (a.get_text(" ", strip=True) or "")
-        href = a.get("href") or ""
+    for href, txt in anchors:
         if not href or not txt: continue
-        if any(q in txt for q in query_terms):
+        if query_terms is None or any(q in txt for q in query_terms):
             out.append((href, txt))
     return out
 
+def parse_page(html: str, query_terms: list[str] | None = None) -> tuple[list[tuple[str,str]], str]:
+    """
+    1 回のパースでアンカーと本文テキストを返す
+    return: ([(href, anchor_text)], text)  query_terms を渡すとアンカーテキストに語を含むものに限定
+    """
+    anchors, text = _parse(html, True)
+    return _match(anchors, query_terms), text
+
+class _AnchorStream(HTMLParser):
+    # lxml が無い場合のストリーミング用（標準ライブラリ、ツリーを作らない）
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.done: list[tuple[str,str]] = []
+        self._href = None
+        self._buf: list[str] = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in NON_TEXT_TAGS:
+            self._skip += 1
+        elif tag == "a":
+            self._close()
+            self._href = dict(attrs).get("href") or ""
+            self._buf = []
+
+    def handle_endtag(self, tag):
+        if tag in NON_TEXT_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag == "a":
+            self._close()
+
+    def handle_data(self, data):
+        if self._href is not None and not self._skip:
+            self._buf.append(data)
+
+    def _close(self):
+        if self._href is not None:
+            self.done.append((self._href, _join(self._buf)))
+            self._href = None
+
+def iter_anchors(chunks, query_terms: list[str] | None = None, limit: int | None = None):
+    """
+    HTML をチャンク（str / bytes の iterable）で受け取り、(href, anchor_text) を逐次返す。
+    limit 件見つかった時点で残りを読まずに終了する
+    """
+    n = 0
+    if _etree is not None:
+        pp = _etree.HTMLPullParser(events=("end",), tag="a")
+        feed, events = pp.feed, (lambda: ((a.get("href") or "", _join(a.itertext())) for _, a in pp.read_events()))
+        close = pp.close
+    else:
+        sp = _AnchorStream()
+        def feed(c):
+            sp.feed(c.decode("utf-8", "replace") if isinstance(c, bytes) else c)
+        def events():
+            out, sp.done = sp.done, []
+            return out
+        close = sp.close
+    for chunk in chunks:
+        feed(chunk)
+        for href, txt in _match(events(), query_terms):
+            yield href, txt
+            n += 1
+            if limit is not None and n >= limit:
+                return
+    try:
+        close()
+    except Exception:
+        return
+    for href, txt in _match(events(), query_terms):
+        yield href, txt
+        n += 1
+        if limit is not None and n >= limit:
+            return
+
+def find_anchors_for_query(html: str, query_terms: list[str], limit: int | None = None) -> list[tuple[str,str]]:
+    """
+    return: list of (href, anchor_text)
+    limit を指定するとストリーミングで走査し、limit 件見つかった時点で打ち切る
+    """
+    if limit is not None:
+        chunks = (html[i:i + STREAM_CHUNK] for i in range(0, len(html or ""), STREAM_CHUNK))
+        return list(iter_anchors(chunks, query_terms, limit))
+    anchors, _ = _parse(html, False)
+    return _match(anchors, query_terms)
+
 def text_only(html: str) -> str:
-    soup = BeautifulSoup(html, "html.parser")
-    return soup.get_text(" ", strip=True)
+    _, text = _parse(html, True)
+    return text
@@ -1,10 +1,19 @@
-import os, time, urllib.parse
-from .sheets import open_sheet, read_catalog, append_candidates, append_results, write_exclusion_log, utcnow
-from .searchers import discover_candidates
-from .filter import pre_http_filter, post_http_filter, soft404_text
-from .fetcher import fetch_many, fetch_head
-from .parser import find_anchors_for_query, text_only
-from .scorer import fit_score
+import os, heapq, urllib.parse
+from collections import Counter
+from .sheets import open_sheet, read_catalog, SheetWriter, utcnow
+from .searchers import iter_candidate_batches, top_catalog_rows, IndexQueryExecutor
+from .filter import get_url_filter, reason_counts, post_http_filter
+from .fetcher import fetch, MAX_BODY_BYTES, SOFT404_MAX_BYTES
+from .checker import check_link, LinkDeduper, HostHealth, HOST_DOWN, _verdict
+from .cache import open_link_cache, open_discovery_state
+from .parser import find_anchors_for_query
+from .scorer import FitScorer
+from .config import REQUEST_TIMEOUT, SHEET_NAME_CANDIDATES, SHEET_NAME_RESULTS, SHEET_NAME_EXCLUDED, load_config
+from .stream import StreamPipeline, HostSlots
+from .budget import TimeBudget, BudgetScheduler, ResumeLog
+from .models import Candidate, LinkCheck, BrokenLink, PageQueryIndex
+from .client import get_session
+from .metrics import get_metrics, get_profiler
 
 TOPK = int(os.getenv("TOPK_PER_QUERY","10"))
 MAX_QUERIES = int(os.getenv("MAX_QUERIES","200"))
@@ -13,100 +22,237 @@ PER_DOMAIN_MAX_PER_QUERY = int(os.getenv("PER_DOMAIN_MAX_PER_QUERY","1"))
 def _host(u: str) -> str:
     return urllib.parse.urlparse(u).netloc
 
+REPORT_TOP = 20  # report.md に載せる壊れリンクの件数
+
 def run(do_discover: bool=True, do_scan: bool=True, do_suggest: bool=True, time_budget_min: int=180):
-    t0 = time.time()
+    m = get_metrics()
+    m.reset()
+    prof = get_profiler()
+    prof.start()
+    conf = load_config()
+    bc = conf.get("budget", {}) or {}
+    budget = TimeBudget(time_budget_min, float(bc.get("reserve_s", 120)))
+    workers = int(conf.get("max_workers", 3))
+    interval_s = float(conf.get("sleep_ms_between_fetches", 700)) / 1000.0
+    max_body = int(conf.get("max_body_kb", MAX_BODY_BYTES // 1024)) * 1024
+    soft404_max = int(conf.get("soft404_max_kb", SOFT404_MAX_BYTES // 1024)) * 1024
+    soft404_pats = conf.get("soft404_patterns")  # 未指定なら filter.soft404_text
+    stc = conf.get("stream", {}) or {}
     sh = open_sheet()
-    cat = read_catalog(sh)  # A:G
+    cat = read_catalog(sh)  # A:G（キャッシュされ、discover_candidates でも再利用）
+    sc = conf.get("sheets", {}) or {}
+    writer = SheetWriter(sh, sc.get("spool_dir", "outputs/spool"), int(sc.get("batch_rows", 500)))
     now = utcnow()
 
-    # --- Discover (CC/CDX)
-    discovered = []
+    # catalog lookup: query -> カタログ行番号（同じクエリを持つ行はすべて代替候補）
+    # 探索と同じく、クリック数の多い上位 MAX_QUERIES 行
+    targets = top_catalog_rows(cat, MAX_QUERIES)
+    q2rows = {}
+    for i, r in enumerate(targets):
+        for q in (r[0] or "").split("|"):
+            q2rows.setdefault(q, []).append(i)
+    scorer = FitScorer([r[2] or (r[0] or "").replace("|", " ") for r in targets])
+
+    session = get_session()
+    cache = open_link_cache(conf)
+    links = LinkDeduper(cache)
+    # 接続できないホストが続いたら以後のリンクはリクエストせずに壊れ扱い（期限切れドメインで持ち時間を使い切らない）
+    health = HostHealth.from_config(conf)
+    # 前回から変わっていない語は再照会せず、新しく見つかった URL だけを流す
+    state = open_discovery_state(conf)
+    index_ex = IndexQueryExecutor.from_config(conf)
+    # 見込みの大きいホストを先に：過去に壊れリンクが見つかった候補ページのホスト / 壊れていたリンク先のホスト
+    page_hits = state.host_hits() if state is not None else {}
+    link_hits = cache.broken_hosts() if cache is not None else {}
+    yield_hits = {}  # 今回見つかった分（終了時に state へ積む）
+    resume = ResumeLog(bc["resume_path"]) if bc.get("resume_path") else None
+
+    # discover → pre-filter → fetch → post-filter/extract → check → write を有界キューでつなぐ。
+    # 取得とリンク検査が重なって進み、HTML は抽出段を抜けた時点で手放すので、メモリは件数に比例しない
     per_host = {}
-    for page_url, title, source_query in discover_candidates(sh, int(MAX_QUERIES), int(TOPK)):
-        ok, reason = pre_http_filter(page_url)
-        if not ok:
-            continue
-        h = _host(page_url)
-        if per_host.get((source_query, h), 0) >= PER_DOMAIN_MAX_PER_QUERY:
-            continue
-        per_host[(source_query, h)] = per_host.get((source_query, h), 0) + 1
-        discovered.append((page_url, title, source_query, now))
-
-    append_candidates(sh, discovered)
-
-    # --- Fetch
-    fetched = fetch_many([d[0] for d in discovered], limit= len(discovered))
-
-    # --- Post-HTTP filter and 404 scan
-    exclusion_rows = []
-    result_rows = []
-
-    # catalog lookup: query -> (self_url, self_title)
-    q2self = {}
-    for r in cat[:MAX_QUERIES]:
-        qpipe, self_url, self_title = r[0], r[1], r[2]
-        for q in (qpipe or "").split("|"):
-            q2self[q] = (self_url, self_title)
-
-    for (url, status, ct, html) in fetched:
+    pages = PageQueryIndex()  # ページ → source_query（複数クエリで見つかった同一ページは 1 回だけ取得）
+    broken: list[BrokenLink] = []  # 採点待ちの壊れリンク
+    by_domain, top = Counter(), []  # report.md 用（候補ページのドメイン別件数 / スコア上位）
+
+    url_filter = get_url_filter()
+
+    def prefilter(batch: list[Candidate]):
+        # 1 語分の候補をまとめて HTTP 前フィルタにかける
+        m.incr("candidates", "discovered", len(batch))
+        keep, codes = url_filter.filter([c.page_url for c in batch])
+        for reason, n in reason_counts(codes).items():
+            m.incr("excluded_pre", reason, n)
+        rows, out = [], []
+        for c, ok in zip(batch, keep):
+            if not ok:
+                continue
+            h = _host(c.page_url)
+            if per_host.get((c.source_query, h), 0) >= PER_DOMAIN_MAX_PER_QUERY:
+                m.incr("excluded_pre", "per_domain_cap")
+                continue
+            per_host[(c.source_query, h)] = per_host.get((c.source_query, h), 0) + 1
+            rows.append(c.row(now))
+            # 取得前に見つかった別クエリは抽出時に合流する（抽出後に見つかった分は対象外）
+            if pages.add(c.page_url, c.source_query):
+                out.append(c.page_url)
+        writer.add(SHEET_NAME_CANDIDATES, rows)
+        return out
+
+    def fetch_page(url):
+        try:
+            page = fetch(url, max_body)
+        except Exception:
+            m.incr("pages", "failed")
+            return ()  # 失敗した URL は除く（例外は fetcher で計上済み）
+        m.incr("pages", "fetched")
+        return (page,)
+
+    def extract(page):
+        url, status, ct, html = page
         ok, reason, penalties = post_http_filter(url, html, ct, status)
         if not ok:
-            exclusion_rows.append([url, "", "", reason, now])
-            continue
-
-        # アンカー抽出（このページの source_query は discovered から逆引き）
-        qs = [d[2] for d in discovered if d[0] == url]
+            m.incr("excluded_post", reason)
+            writer.add(SHEET_NAME_EXCLUDED, [[url, "", "", reason, now]])
+            return ()
+        # アンカー抽出（このページを見つけた全クエリのいずれかをアンカーテキストに含むもの）
+        qs = pages.queries(url)
         if not qs:  # 安全策
-            continue
-        anchors = find_anchors_for_query(html, qs)
-
+            return ()
+        out = []
         # 外部リンクのみ対象
         page_host = _host(url)
-        targets = []
-        for href, atext in anchors:
+        for href, atext in find_anchors_for_query(html, qs):
             if href.startswith("//"): href = "https:" + href
             if href.startswith("/"):  href = f"https://{page_host}{href}"
             if not href.startswith("http"): continue
             if _host(href) == page_host: continue
-            targets.append((href, atext))
-
-        # 先に HEAD（安い）で 404/410 を拾う → 不明なら GET して soft404
-        for href, atext in targets:
-            try:
-                _, st, ctype = fetch_head(href)
-            except Exception:
-                st, ctype = 0, ""
-            is_soft = False
-            if st in (404, 410):
-                pass
-            else:
-                # GET して soft404 チェック（軽量パス）
-                try:
-                    from .fetcher import fetch
-                    _, st2, ct2, html2 = fetch(href)
-                    st = st or st2
-                    ctype = ctype or ct2
-                    if str(ctype).lower().startswith("text/html"):
-                        is_soft = soft404_text(text_only(html2))
-                except Exception:
-                    continue
-
-            if st in (404, 410) or is_soft:
-                # 該当クエリの自社記事を代替に
-                # （同一ページに複数クエリが当たる場合は最初のものを採用）
-                self_url, self_title = q2self.get(qs[0], ("", ""))
-                score = fit_score(atext, self_title or "")
-                result_rows.append([
-                    url,
-                    href,
-                    atext,
-                    str(st or 0),
-                    "1" if is_soft else "0",
-                    self_url,
-                    f"{score:.2f}"
-                ])
-
-    if exclusion_rows:
-        write_exclusion_log(sh, exclusion_rows)
-    if result_rows:
-        append_results(sh, result_rows)
+            item = LinkCheck(url, qs, href, atext)
+            # 同じリンク先は 1 回だけ検査（検査中のものは結果が出た時点で配られる）
+            how, v = links.admit(href, item)
+            m.incr("links", "extracted")
+            if how != "wait":
+                out.append((item, v))
+        return out
+
+    def check(job):
+        # 先に HEAD（安い）で 404/410 を拾う → 不明なら GET して soft404（時間切れ間近は HEAD のみ）
+        item, v = job
+        if v is not None:
+            return ((item, v),)
+        href = item.href
+        try:
+            v = check_link(session, href, REQUEST_TIMEOUT, soft404_pats, cache, soft404_max, soft404=not sched.degraded,
+                           health=health)
+        except Exception as e:
+            m.error("pipeline.check", e)
+            v = _verdict(-1, href, False)
+        m.incr("links", "checked")
+        done = [item] + links.resolve(href, v)
+        if v["note"] == "head_only" and resume is not None:
+            # HEAD は通ったが soft404 は未判定：次回に GET で判定し直す
+            for it in done:
+                resume.add({"stage": "check", "item": it.to_json()})
+            return ()
+        return [(it, v) for it in done]
+
+    def check_host(job):
+        # 結果が出ているもの・停止中のホストへのものはホストの間隔待ちをせずに流す
+        if job[1] is not None or (health is not None and health.is_down(job[0].href)):
+            return None
+        return _host(job[0].href)
+
+    def write(res):
+        item, v = res
+        down = v["note"].startswith(HOST_DOWN)
+        if v["code"] in (404, 410) or v["soft_404"] or down:
+            h = _host(item.page_url)
+            yield_hits[h] = yield_hits.get(h, 0) + 1
+            by_domain[h] += 1
+            m.incr("links", HOST_DOWN if down else "soft_404" if v["soft_404"] else str(v["code"]))
+            broken.append(BrokenLink(item, v["code"], v["soft_404"]))
+            if len(broken) >= score_batch:
+                flush_broken()
+        return ()
+
+    def flush_broken():
+        # 代替記事の採点：溜まった壊れリンクのアンカーをまとめて 1 回の行列演算で
+        # （ページに当たった全クエリの自社記事から最も近いものを採用。無ければカタログ全体から）
+        batch = broken[:]
+        del broken[:]
+        with m.timer("score"):
+            cands = [sorted({i for q in b.link.queries for i in q2rows.get(q, ())}) or None for b in batch]
+            best = scorer.top_k([b.link.anchor_text for b in batch], k=1, candidates=cands)
+        for b, hits in zip(batch, best):
+            if hits:
+                b.replacement_url, b.score = targets[hits[0][0]][1], hits[0][1]
+        top[:] = heapq.nlargest(REPORT_TOP, top + batch, key=lambda b: b.score)
+        writer.add(SHEET_NAME_RESULTS, [b.row() for b in batch])
+
+    # 時間切れで処理しきれなかった取得待ち・検査待ちは再開用ファイルへ退避し、次回はそこから始める
+    def spill_fetch(url):
+        if resume is not None:
+            resume.add({"stage": "fetch", "url": url, "qs": list(pages.queries(url))})
+
+    def spill_check(job):
+        if resume is not None:
+            for it in [job[0]] + links.abandon(job[0].href):
+                resume.add({"stage": "check", "item": it.to_json()})
+
+    preload = []
+    for rec in (resume.load() if resume is not None else []):
+        if rec.get("stage") == "fetch":
+            first = [pages.add(rec["url"], q) for q in rec["qs"]]
+            if first and first[0]:
+                preload.append(("fetch", rec["url"]))
+        elif rec.get("stage") == "check":
+            item = LinkCheck.from_json(rec["item"])
+            how, v = links.admit(item.href, item)
+            if how != "wait":
+                preload.append(("check", (item, v)))
+
+    score_batch = int(stc.get("score_batch", 256))
+    # 取得とリンク検査は同じ HostSlots を共有し、同一ホストへは合わせて 1 本・interval_s 間隔
+    pipe = StreamPipeline(int(stc.get("queue_size", 64)), HostSlots(1, interval_s))
+    pipe.stage("prefilter", prefilter)
+    pipe.stage("fetch", fetch_page, int(stc.get("fetch_workers", workers)), host_of=_host,
+               priority=lambda h: page_hits.get(h, 0), spill=spill_fetch)
+    pipe.stage("extract", extract, int(stc.get("extract_workers", 1)))
+    pipe.stage("check", check, int(stc.get("check_workers", workers)),
+               host_of=check_host,
+               priority=lambda h: link_hits.get(h, 0), spill=spill_check)
+    pipe.stage("write", write)
+    sched = BudgetScheduler(budget, pipe, float(bc.get("degrade_frac", 0.25)))
+    sched.start()
+    try:
+        found = ([Candidate(u, q) for u in urls] for q, urls in
+                 m.timed_iter("discover", iter_candidate_batches(sh, int(MAX_QUERIES), int(TOPK), state=state,
+                                                                 executor=index_ex)))
+        with m.timer("stream"), prof.thread():  # 探索（候補の生成）はこのスレッドで走る
+            pipe.run(found, preload)
+        flush_broken()
+        if resume is not None:
+            resume.done()  # 読み戻した分は処理済み（残りは新しいファイルへ退避済み）
+        with m.timer("sheets.close"):
+            writer.close()  # 失敗時は送らずに spool を残す（次回に再送）
+    finally:
+        sched.finish()
+        if state is not None:
+            for h, n in yield_hits.items():
+                state.add_host_hits(h, n)
+            state.close()
+        if cache is not None:
+            cache.close()
+        # 段ごとの件数・処理時間、CC/CDX 照会の統計、持ち時間の使い方をまとめて outputs/metrics.json・report.md へ
+        m.section("stages", pipe.stats)
+        m.section("index_query", index_ex.report())
+        m.section("budget", {**sched.report(), "spilled": resume.count if resume is not None else 0})
+        if health is not None:
+            m.section("host_health", health.report())
+        m.section("broken", {"by_domain": dict(by_domain.most_common()),
+                             "top": [{"page_url": b.link.page_url, "href": b.link.href, "anchor": b.link.anchor_text,
+                                      "code": b.code, "soft_404": b.soft_404, "replacement_url": b.replacement_url,
+                                      "score": round(b.score, 3)} for b in top]})
+        summary = prof.stop()
+        if summary:
+            m.section("profile", summary)
+        m.write("outputs")
@@ -1,5 +1,83 @@
-import difflib
+import zlib
+import numpy as np
+from .utils import normalize_text
+
+NGRAM = 2          # 文字 n-gram
+DIM = 1 << 12      # ハッシュ後の次元数
+CHUNK = 1024       # 一度に掛け合わせるアンカー行数（メモリ上限）
+
+def _grams(s: str, n: int) -> list[str]:
+    s = normalize_text(s).lower()
+    if len(s) < n:
+        return [s] if s else []
+    return [s[i:i + n] for i in range(len(s) - n + 1)]
+
+def vectorize(texts: list[str], n: int = NGRAM, dim: int = DIM) -> np.ndarray:
+    """文字 n-gram をハッシュした出現回数ベクトル（行ごとに L2 正規化、float32）"""
+    rows, cols = [], []
+    for i, t in enumerate(texts):
+        for g in _grams(t, n):
+            rows.append(i)
+            cols.append(zlib.crc32(g.encode("utf-8")) % dim)  # 実行ごとに変わらないハッシュ
+    m = np.zeros((len(texts), dim), dtype=np.float32)
+    if rows:
+        np.add.at(m, (np.asarray(rows), np.asarray(cols)), 1.0)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    np.divide(m, norms, out=m, where=norms > 0)
+    return m
+
+def similarity_matrix(anchors: list[str], titles: list[str], n: int = NGRAM, dim: int = DIM) -> np.ndarray:
+    """anchors × titles のコサイン類似度（0..1）を 1 回の行列積で計算"""
+    return vectorize(anchors, n, dim) @ vectorize(titles, n, dim).T
+
+class FitScorer:
+    """カタログタイトルのベクトルを一度だけ作っておき、アンカーを小分けに採点する（ストリーミング用）"""
+    def __init__(self, titles: list[str], n: int = NGRAM, dim: int = DIM):
+        self.n, self.dim = n, dim
+        self.size = len(titles)
+        self._T = vectorize(titles, n, dim).T if titles else None
+
+    def top_k(self, anchors: list[str], k: int = 5,
+              candidates: list[list[int] | None] | None = None) -> list[list[tuple[int, float]]]:
+        """
+        アンカーごとに上位 k 件のタイトルを返す。
+        candidates[i] を渡すとアンカー i はそのタイトル番号の中だけで順位付けする（None なら全件）
+        return: [[(title_index, score), ...] 降順, ...]（anchors と同じ順序）
+        """
+        if not anchors:
+            return []
+        if self._T is None:
+            return [[] for _ in anchors]
+        k = min(k, self.size)
+        out = []
+        for s in range(0, len(anchors), CHUNK):
+            sim = vectorize(anchors[s:s + CHUNK], self.n, self.dim) @ self._T
+            if candidates is not None:
+                # 候補外は -1（コサインは 0 以上なので上位には来ない）
+                keep = np.zeros(sim.shape, dtype=bool)
+                for i, cand in enumerate(candidates[s:s + CHUNK]):
+                    if cand is None:
+                        keep[i] = True
+                    elif cand:
+                        keep[i, list(cand)] = True
+                sim[~keep] = -1.0
+            top = np.argpartition(-sim, k - 1, axis=1)[:, :k] if k < self.size else \
+                np.broadcast_to(np.arange(self.size), sim.shape)
+            top_s = np.take_along_axis(sim, top, axis=1)
+            order = np.argsort(-top_s, axis=1, kind="stable")
+            top, top_s = np.take_along_axis(top, order, axis=1), np.take_along_axis(top_s, order, axis=1)
+            for idx, sc in zip(top.tolist(), top_s.tolist()):
+                out.append([(j, v) for j, v in zip(idx, sc) if v >= 0.0])
+        return out
+
+def batch_fit_scores(anchors: list[str], titles: list[str], k: int = 5,
+                     candidates: list[list[int] | None] | None = None,
+                     n: int = NGRAM, dim: int = DIM) -> list[list[tuple[int, float]]]:
+    """
+    全アンカー × 全カタログタイトルを一括で採点し、アンカーごとに上位 k 件を返す（FitScorer.top_k と同じ）
+    """
+    return FitScorer(titles, n, dim).top_k(anchors, k, candidates)
 
 def fit_score(anchor_text: str, catalog_title: str) -> float:
-    # 文字列類似度（0..1）
-    return difflib.SequenceMatcher(None, anchor_text, catalog_title).ratio()
+    # 文字列類似度（0..1）。batch_fit_scores と同じ n-gram コサイン
+    return float(similarity_matrix([anchor_text], [catalog_title])[0, 0])
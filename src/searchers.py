@@ -1,10 +1,15 @@
-import os, json, time, random, requests, re
-from typing import List
+import os, json, time, re, threading, requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .sheets import read_catalog
+from .client import get_session
+from .utils import TokenBucket
+from .metrics import get_metrics
 
-UA = os.getenv("BLB_UA", "BLB/1.0 (+contact: you@example.com)")
 TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "12"))
 CC_INDEX = os.getenv("CC_INDEX", "CC-MAIN-2024-33-index")
+# エンドポイント（テストではローカルのスタブサーバに向ける）
+CC_INDEX_BASE = os.getenv("CC_INDEX_BASE", "https://index.commoncrawl.org")
+CDX_ENDPOINT = os.getenv("CDX_ENDPOINT", "https://web.archive.org/cdx/search/cdx")
 
 def _json_lines(text: str):
     for line in text.splitlines():
@@ -12,37 +17,178 @@ def _json_lines(text: str):
         if not line: continue
         try:
             yield json.loads(line)
-        except Exception:
+        except Exception as e:
+            get_metrics().error("searchers.json_line", e)
             continue
 
-def _cc_query(pattern: str, limit: int) -> List[str]:
-    u = f"https://index.commoncrawl.org/{CC_INDEX}"
-    p = {"url": pattern, "output": "json", "limit": str(limit)}
-    r = requests.get(u, params=p, headers={"User-Agent": UA}, timeout=TIMEOUT)
-    r.raise_for_status()
-    urls = []
-    for obj in _json_lines(r.text):
-        url = obj.get("url") or ""
-        if url.startswith("https://"):
-            urls.append(url)
-    return urls
-
-def _cdx_query(pattern: str, limit: int) -> List[str]:
-    # Wayback CDX はレート・フィルタ厳しめ。UA を明示し、失敗時は空配列
-    try:
-        u = "https://web.archive.org/cdx/search/cdx"
-        p = {"url": pattern, "output": "json", "filter":"statuscode:200", "limit": str(limit)}
-        r = requests.get(u, params=p, headers={"User-Agent": UA}, timeout=TIMEOUT)
-        r.raise_for_status()
-        rows = r.json()[1:]  # 先頭はヘッダ
-        out = []
-        for c in rows:
-            # c[2]=original URL
-            if len(c) > 2 and str(c[2]).startswith("https://"):
-                out.append(c[2])
-        return out
-    except Exception:
-        return []
+class EndpointStats:
+    """エンドポイントごとのリクエスト数・ページ数・エラー数・レイテンシ"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.pages = 0
+        self.errors: dict[str, int] = {}
+        self.latencies: list[float] = []
+
+    def ok(self, dt: float):
+        with self._lock:
+            self.requests += 1
+            self.pages += 1
+            self.latencies.append(dt)
+
+    def error(self, kind: str, dt: float | None = None):
+        # dt が None なら応答は受け取れたが中身が壊れていた（リクエスト数は ok 側で計上済み）
+        with self._lock:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+            if dt is not None:
+                self.requests += 1
+                self.latencies.append(dt)
+
+    def summary(self) -> dict:
+        with self._lock:
+            lat = sorted(self.latencies)
+            pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))], 3) if lat else 0.0
+            return {"requests": self.requests, "pages": self.pages, "errors": dict(self.errors),
+                    "latency_s": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)}}
+
+class IndexQueryExecutor:
+    """
+    CC インデックス / Wayback CDX の照会を語ごとに並列実行する。
+    - エンドポイントごとに別々のトークンバケット（cc_rate_per_s / cdx_rate_per_s）
+    - CC は showNumPages → page=0..、CDX は showResumeKey → resumeKey でページを辿る（max_pages まで）
+    - 失敗はその語・エンドポイントだけ空にして種類ごとに数える（stats）
+    """
+    def __init__(self, session=None, max_workers: int = 4, cc_rate_per_s: float = 1.0,
+                 cdx_rate_per_s: float = 0.5, burst: int = 1, max_pages: int = 3,
+                 cc_index: str = "", timeout: float = TIMEOUT):
+        self.session = session
+        self.max_workers = max(1, int(max_workers))
+        self.max_pages = max(1, int(max_pages))
+        self.cc_index = cc_index or CC_INDEX
+        self.timeout = timeout
+        self.buckets = {"cc": TokenBucket(cc_rate_per_s, burst), "cdx": TokenBucket(cdx_rate_per_s, burst)}
+        self.stats = {"cc": EndpointStats(), "cdx": EndpointStats()}
+
+    @classmethod
+    def from_config(cls, conf: dict, session=None) -> "IndexQueryExecutor":
+        iq = conf.get("index_query", {}) or {}
+        return cls(session, int(iq.get("workers", 4)), float(iq.get("cc_rate_per_s", 1.0)),
+                   float(iq.get("cdx_rate_per_s", 0.5)), int(iq.get("burst", 1)), int(iq.get("max_pages", 3)))
+
+    def _get(self, ep: str, url: str, params: dict):
+        """1 リクエスト（レート制限・計測込み）。404（該当なし）は None、それ以外の失敗は例外"""
+        self.buckets[ep].acquire()
+        t = time.perf_counter()
+        try:
+            r = (self.session or get_session()).get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.stats[ep].error(type(e).__name__, time.perf_counter() - t)
+            raise
+        dt = time.perf_counter() - t
+        if r.status_code == 404:  # pywb の "No Captures found"
+            self.stats[ep].ok(dt)
+            return None
+        if r.status_code >= 400:
+            self.stats[ep].error(f"http_{r.status_code}", dt)
+            r.raise_for_status()
+        self.stats[ep].ok(dt)
+        return r
+
+    def cc_query(self, pattern: str, limit: int) -> list[str]:
+        # まず page 0 を取り、足りないときだけページ数を聞いて続きを辿る（1 語 1 リクエストで済むことが多い）
+        u = f"{CC_INDEX_BASE}/{self.cc_index}"
+        urls, pages = [], 1
+        page = 0
+        while page < min(pages, self.max_pages):
+            r = self._get("cc", u, {"url": pattern, "output": "json", "page": str(page),
+                                    "limit": str(limit - len(urls))})
+            if r is None:
+                break
+            for obj in _json_lines(r.text):
+                url = obj.get("url") or ""
+                if url.startswith("https://"):
+                    urls.append(url)
+            if len(urls) >= limit:
+                break
+            if page == 0 and self.max_pages > 1:
+                pages = self._cc_num_pages(u, pattern)
+            page += 1
+        return urls[:limit]
+
+    def _cc_num_pages(self, u: str, pattern: str) -> int:
+        r = self._get("cc", u, {"url": pattern, "showNumPages": "true", "output": "json"})
+        if r is None:
+            return 1
+        try:
+            d = r.json()
+            return int(d.get("pages", 1) if isinstance(d, dict) else d)
+        except (ValueError, TypeError):
+            self.stats["cc"].error("bad_json")
+            return 1
+
+    def cdx_query(self, pattern: str, limit: int) -> list[str]:
+        urls, resume = [], ""
+        for _ in range(self.max_pages):
+            p = {"url": pattern, "output": "json", "filter": "statuscode:200",
+                 "limit": str(limit - len(urls)), "showResumeKey": "true"}
+            if resume:
+                p["resumeKey"] = resume
+            r = self._get("cdx", CDX_ENDPOINT, p)
+            if r is None:
+                break
+            try:
+                rows = r.json() or []
+            except ValueError:
+                self.stats["cdx"].error("bad_json")
+                break
+            # [ヘッダ, 行..., [], [resumeKey]]（続きが無ければ末尾の 2 行は無い）
+            resume = ""
+            if len(rows) >= 2 and rows[-2] == [] and len(rows[-1]) == 1:
+                resume, rows = rows[-1][0], rows[:-2]
+            for c in rows[1:]:
+                # c[2]=original URL
+                if len(c) > 2 and str(c[2]).startswith("https://"):
+                    urls.append(c[2])
+            if len(urls) >= limit or not resume:
+                break
+        return urls[:limit]
+
+    def _safe(self, fn, pattern: str, limit: int) -> list[str]:
+        try:
+            return fn(pattern, limit)
+        except requests.RequestException:
+            return []  # stats に計上済み
+
+    def iter_run(self, terms: list[str], limit: int = 10):
+        """
+        yield: (term, [url, ...])（CC → CDX の順で重複除去）。両エンドポイントが終わった語から順に返す
+        語 × エンドポイントを 1 タスクとして並列に投げ、各エンドポイントは自分のバケットの速さで進む
+        """
+        terms = list(dict.fromkeys(terms))
+        ex = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futs = {}
+            for t in terms:
+                futs[ex.submit(self._safe, self.cc_query, _pattern_for(t), limit)] = (t, 0)
+                futs[ex.submit(self._safe, self.cdx_query, _pattern_for(t), limit)] = (t, 1)
+            parts: dict[str, list] = {}
+            for f in as_completed(futs):
+                t, k = futs[f]
+                got = parts.setdefault(t, [None, None])
+                got[k] = f.result()
+                if got[0] is not None and got[1] is not None:
+                    del parts[t]
+                    yield t, list(dict.fromkeys(got[0] + got[1]))
+        finally:
+            ex.shutdown(wait=True, cancel_futures=True)  # 途中で読むのをやめたら未着手の照会は捨てる
+
+    def run(self, terms: list[str], limit: int = 10) -> dict[str, list[str]]:
+        """return: {term: [url, ...]}（terms の順）"""
+        got = dict(self.iter_run(terms, limit))
+        return {t: got[t] for t in dict.fromkeys(terms)}
+
+    def report(self) -> dict:
+        return {ep: st.summary() for ep, st in self.stats.items()}
 
 def _terms(qpipe: str) -> list[str]:
     ts = []
@@ -58,23 +204,50 @@ def _pattern_for(t: str) -> str:
     safe = re.sub(r'\s+', '-', t)
     return f"*.jp/*{safe}*"
 
-def discover_candidates(sh, max_queries=200, topk=10, per_query_limit=20) -> list[tuple[str,str,str]]:
+def top_catalog_rows(rows: list, n: int) -> list:
+    """クリック数の多い順に上位 n 行（見込みの大きい候補を先に流す。同数ならカタログ順）"""
+    return sorted(rows, key=lambda r: -int(getattr(r, "clicks_total", 0) or 0))[:n]
+
+def iter_candidate_batches(sh, max_queries=200, topk=10, per_query_limit=20, state=None,
+                           executor: IndexQueryExecutor | None = None):
+    """
+    yield: (source_query, [page_url, ...])。照会が終わった語から順に、語ごとにまとめて流す（ストリーミング用）
+    state（cache.DiscoveryState）を渡すと、同じ CC_INDEX・同じカタログ行（last_seen_utc / new_flag）で
+    照会済みの語は再照会せず、前回までに見つかっていない URL だけを返す
+    照会は executor（IndexQueryExecutor）で並列に行う（照会回数・レイテンシ・エラーは executor.report()）
+    """
+    executor = executor or IndexQueryExecutor()
+    rows = top_catalog_rows(read_catalog(sh), max_queries)
+    sigs, seen = {}, set()  # term -> row signature（同じ語が複数行にあれば最初の行で判定）
+    for r in rows:
+        sig = state.row_signature(r) if state is not None else ""
+        for t in _terms(r[0]):
+            if t in seen:
+                continue
+            seen.add(t)
+            if state is None or not state.is_fresh(t, executor.cc_index, sig):
+                sigs[t] = sig
+    for t, urls in executor.iter_run(list(sigs), min(per_query_limit, 10)):
+        urls = urls[:topk]
+        # 早期 HTTP 前フィルタは pipeline 側で実施（語ごとに一括）
+        new = state.unseen(t, executor.cc_index, urls) if state is not None else urls
+        if new:
+            yield t, new
+        # 流し終えてから記録する（途中で打ち切られた語は次回もう一度照会する）
+        if state is not None:
+            state.record(t, executor.cc_index, sigs[t], urls)
+
+def iter_candidates(sh, max_queries=200, topk=10, per_query_limit=20, state=None,
+                    executor: IndexQueryExecutor | None = None):
+    """yield: (page_url, title_placeholder, source_query)。引数は iter_candidate_batches と同じ"""
+    for t, urls in iter_candidate_batches(sh, max_queries, topk, per_query_limit, state, executor):
+        for u in urls:
+            yield u, "", t
+
+def discover_candidates(sh, max_queries=200, topk=10, per_query_limit=20, state=None,
+                        executor: IndexQueryExecutor | None = None) -> list[tuple[str,str,str]]:
     """
     return: list of (page_url, title_placeholder, source_query)
-    title_placeholder は空でOK（後段で取得）
+    title_placeholder は空でOK（後段で取得）。引数は iter_candidates と同じ
     """
-    rows = read_catalog(sh)
-    out = []
-    for r in rows[:max_queries]:
-        qpipe, self_url = r[0], r[1]
-        for t in _terms(qpipe):
-            pat = _pattern_for(t)
-            cc = _cc_query(pat, min(per_query_limit, 10))
-            cdx = _cdx_query(pat, min(per_query_limit, 10))
-            urls = list(dict.fromkeys(cc + cdx))  # de-dup keep order
-            # 早期 HTTP 前フィルタは pipeline 側で実施
-            for u in urls[:topk]:
-                out.append((u, "", t))
-        # polite
-        time.sleep(0.7 + random.random()*0.3)
-    return out
+    return list(iter_candidates(sh, max_queries, topk, per_query_limit, state, executor))
@@ -1,7 +1,10 @@
 # すでに同等がある場合は読み飛ばし。シグネチャだけ合わせてください。
-import os, json, gspread
+import os, csv, json, time, threading, gspread
 from datetime import datetime, timezone
+from typing import NamedTuple
 from google.oauth2.service_account import Credentials
+from .metrics import get_metrics
+from .config import SHEET_NAME_CATALOG, SHEET_NAME_CANDIDATES, SHEET_NAME_RESULTS, SHEET_NAME_EXCLUDED
 
 def _client():
     info = json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_JSON"])
@@ -9,28 +12,196 @@ def _client():
     return gspread.authorize(Credentials.from_service_account_info(info, scopes=scopes))
 
 def open_sheet():
+    # BLB_LOCAL_CATALOG を指定するとローカル CSV を読む FakeSpreadsheet（オフライン実行・テスト用）
+    local = os.getenv("BLB_LOCAL_CATALOG", "")
+    if local:
+        return FakeSpreadsheet.from_csv(local)
     return _client().open_by_key(os.environ["GOOGLE_SHEET_ID"])
 
-def read_catalog(sh=None):
+class CatalogRow(NamedTuple):
+    """カタログ A:G の 1 行（タプルなので r[0], r[1] のような従来の添字アクセスも可）"""
+    queries_top10_pipe: str
+    url: str
+    title: str
+    clicks_total: int
+    first_seen_utc: str
+    last_seen_utc: str
+    new_flag: str
+
+    @property
+    def terms(self) -> list[str]:
+        return [t.strip() for t in (self.queries_top10_pipe or "").split("|") if t.strip()]
+
+    @classmethod
+    def from_values(cls, row: list[str]) -> "CatalogRow":
+        v = (list(row) + [""] * 7)[:7]
+        try:
+            clicks = int(float(v[3] or 0))
+        except ValueError:
+            clicks = 0
+        return cls(v[0], v[1], v[2], clicks, v[4], v[5], v[6])
+
+_catalog_cache: dict = {}
+
+def read_catalog(sh=None, refresh: bool = False) -> list[CatalogRow]:
+    """カタログを 1 回だけ読み、同じスプレッドシートに対してはキャッシュを返す"""
     sh = sh or open_sheet()
-    ws = sh.worksheet("カタログ")
-    rows = ws.get_all_values()[1:]  # skip header
-    return rows
+    key = getattr(sh, "id", None) or id(sh)
+    if refresh or key not in _catalog_cache:
+        ws = sh.worksheet(SHEET_NAME_CATALOG)
+        rows = ws.get_all_values()[1:]  # skip header
+        _catalog_cache[key] = [CatalogRow.from_values(r) for r in rows]
+    return _catalog_cache[key]
 
 def append_candidates(sh, rows):
     if not rows: return
-    ws = sh.worksheet("候補URL")
+    ws = sh.worksheet(SHEET_NAME_CANDIDATES)
     ws.append_rows(rows, value_input_option="RAW")
 
 def append_results(sh, rows):
     if not rows: return
-    ws = sh.worksheet("検査結果")
+    ws = sh.worksheet(SHEET_NAME_RESULTS)
     ws.append_rows(rows, value_input_option="RAW")
 
 def write_exclusion_log(sh, rows):
     if not rows: return
-    ws = sh.worksheet("除外ログ")
+    ws = sh.worksheet(SHEET_NAME_EXCLUDED)
     ws.append_rows(rows, value_input_option="RAW")
 
 def utcnow():
     return datetime.now(timezone.utc).isoformat()
+
+def _is_quota_error(e: Exception) -> bool:
+    code = getattr(getattr(e, "response", None), "status_code", None)
+    return code in (429, 500, 502, 503)
+
+class SheetWriter:
+    """
+    行を出た順にローカルの追記専用ファイル（spool_dir/<シート名>.jsonl）へ書き、batch_rows 行ごとに append_rows する。
+    送信済み行数は <シート名>.sent に記録するので、途中で落ちても次回起動時に未送信分から再送する。
+    429/5xx はバックオフして再試行する
+    """
+    def __init__(self, sh, spool_dir: str = "outputs/spool", batch_rows: int = 500,
+                 max_retries: int = 6, backoff_s: float = 2.0):
+        self.sh = sh
+        self.spool_dir = spool_dir
+        self.batch_rows = max(1, int(batch_rows))
+        self.max_retries = max_retries
+        self.backoff_s = backoff_s
+        self._lock = threading.Lock()
+        self._pending: dict[str, list] = {}
+        self._sent: dict[str, int] = {}
+        os.makedirs(spool_dir, exist_ok=True)
+        for f in sorted(os.listdir(spool_dir)):
+            if f.endswith(".jsonl"):
+                self._recover(f[:-len(".jsonl")])
+
+    def _path(self, sheet: str, ext: str) -> str:
+        return os.path.join(self.spool_dir, f"{sheet}.{ext}")
+
+    def _recover(self, sheet: str):
+        # 前回の実行で送れなかった行を読み戻す
+        with open(self._path(sheet, "jsonl"), encoding="utf-8") as f:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    break  # 書きかけの末尾行
+        sent = 0
+        if os.path.exists(self._path(sheet, "sent")):
+            with open(self._path(sheet, "sent")) as f:
+                sent = int(f.read().strip() or 0)
+        self._sent[sheet] = sent
+        self._pending[sheet] = rows[sent:]
+
+    def add(self, sheet: str, rows):
+        if not rows: return
+        rows = [list(r) for r in rows]
+        with self._lock:
+            with open(self._path(sheet, "jsonl"), "a", encoding="utf-8") as f:
+                for r in rows:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            self._sent.setdefault(sheet, 0)
+            self._pending.setdefault(sheet, []).extend(rows)
+            while len(self._pending[sheet]) >= self.batch_rows:
+                self._flush_batch(sheet)
+
+    def _flush_batch(self, sheet: str):
+        batch = self._pending[sheet][:self.batch_rows]
+        ws = self.sh.worksheet(sheet)
+        m = get_metrics()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with m.timer("sheets.append"):
+                    ws.append_rows(batch, value_input_option="RAW")
+                m.incr("sheet_rows", sheet, len(batch))
+                break
+            except Exception as e:
+                if not _is_quota_error(e) or attempt >= self.max_retries:
+                    raise
+                m.incr("sheet_retries", sheet)
+                time.sleep(min(64.0, self.backoff_s * (2 ** attempt)))
+        self._pending[sheet] = self._pending[sheet][len(batch):]
+        self._sent[sheet] += len(batch)
+        tmp = self._path(sheet, "sent.tmp")
+        with open(tmp, "w") as f:
+            f.write(str(self._sent[sheet]))
+        os.replace(tmp, self._path(sheet, "sent"))
+
+    def flush(self):
+        with self._lock:
+            for sheet in list(self._pending):
+                while self._pending[sheet]:
+                    self._flush_batch(sheet)
+
+    def close(self):
+        """全件送信できたら spool を消す"""
+        self.flush()
+        with self._lock:
+            for sheet in list(self._pending):
+                for ext in ("jsonl", "sent"):
+                    if os.path.exists(self._path(sheet, ext)):
+                        os.remove(self._path(sheet, ext))
+            self._pending.clear()
+            self._sent.clear()
+
+class FakeQuotaError(Exception):
+    """FakeWorksheet が返すクォータ超過（gspread.APIError と同じく response.status_code を持つ）"""
+    class _Resp:
+        status_code = 429
+    response = _Resp()
+
+class FakeWorksheet:
+    """gspread.Worksheet の get_all_values / append_rows だけを持つメモリ上の代替"""
+    def __init__(self, title: str, values: list[list[str]] | None = None, fail_every: int = 0):
+        self.title = title
+        self.values = [list(r) for r in (values or [])]
+        self.calls = 0
+        self.fail_every = fail_every  # n > 0 なら n 回に 1 回 FakeQuotaError を投げる
+
+    def get_all_values(self):
+        return [list(r) for r in self.values]
+
+    def append_rows(self, rows, value_input_option="RAW"):
+        self.calls += 1
+        if self.fail_every and self.calls % self.fail_every == 0:
+            raise FakeQuotaError("quota exceeded")
+        self.values.extend([str(c) for c in r] for r in rows)
+
+class FakeSpreadsheet:
+    """gspread.Spreadsheet の worksheet() だけを持つメモリ上の代替（存在しないシートは空で作る）"""
+    def __init__(self, sheets: dict[str, list[list[str]]] | None = None, fail_every: int = 0):
+        self.id = f"fake-{id(self)}"
+        self.fail_every = fail_every
+        self._ws = {name: FakeWorksheet(name, v, fail_every) for name, v in (sheets or {}).items()}
+
+    def worksheet(self, name: str) -> FakeWorksheet:
+        if name not in self._ws:
+            self._ws[name] = FakeWorksheet(name, [], self.fail_every)
+        return self._ws[name]
+
+    @classmethod
+    def from_csv(cls, catalog_csv: str) -> "FakeSpreadsheet":
+        with open(catalog_csv, encoding="utf-8-sig", newline="") as f:
+            return cls({SHEET_NAME_CATALOG: list(csv.reader(f))})
@@ -0,0 +1,276 @@
+import queue, threading, time
+from .metrics import get_profiler
+
+_END = object()  # キューの終端
+
+class HostSlots:
+    """
+    ホスト単位の同時実行数と最小間隔を、複数の HostQueue（取得・リンク検査など）で共有する。
+    同じホストへのページ取得とリンク検査が同時に走らないよう、パイプライン全体で 1 つ使う
+    """
+    def __init__(self, per_host: int = 1, interval_s: float = 0.0):
+        self.per_host = max(1, int(per_host))
+        self.interval_s = max(0.0, float(interval_s))
+        self.cond = threading.Condition()
+        self.busy: dict[str, int] = {}
+        self.next_at: dict[str, float] = {}
+
+    def ready_in(self, host: str, now: float) -> float | None:
+        """host をいま使えるなら 0、間隔待ちなら残り秒数、同時実行数の上限なら None（cond 保持中に呼ぶ）"""
+        if host is None:
+            return 0.0
+        if self.busy.get(host, 0) >= self.per_host:
+            return None
+        return max(0.0, self.next_at.get(host, 0.0) - now)
+
+    def take(self, host: str, now: float):
+        if host is None:
+            return
+        self.busy[host] = self.busy.get(host, 0) + 1
+        self.next_at[host] = now + self.interval_s
+
+    def release(self, host: str):
+        if host is None:
+            return
+        with self.cond:
+            self.busy[host] -= 1
+            self.cond.notify_all()
+
+class HostQueue:
+    """
+    ホストごとの FIFO を束ねた有界キュー。get は「上限に達しておらず間隔も空いた」ホストの先頭を返すので、
+    1 ホストの待ちが他ホストの処理を止めない（host=None の項目は即時）
+    """
+    def __init__(self, maxsize: int, slots: HostSlots, priority=None):
+        self.maxsize = max(1, int(maxsize))
+        self.slots = slots
+        self.priority = priority  # host -> 数値（大きいほど先）。None なら到着順
+        self.lanes: dict = {}
+        self.size = 0
+        self.closed = False
+        self.draining = False  # True ならホスト制限を無視して即座に返す（退避用）
+
+    def put(self, host, item, abort: threading.Event):
+        cond = self.slots.cond
+        with cond:
+            while self.size >= self.maxsize and not abort.is_set():
+                cond.wait(0.5)
+            self.lanes.setdefault(host, []).append(item)
+            self.size += 1
+            cond.notify_all()
+
+    def get(self):
+        """return: (host, item)。閉じられて空なら (None, _END)"""
+        cond = self.slots.cond
+        with cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                if self.draining and self.lanes:
+                    host = next(iter(self.lanes))
+                    item = self.lanes[host].pop(0)
+                    if not self.lanes[host]:
+                        del self.lanes[host]
+                    self.size -= 1
+                    cond.notify_all()
+                    return None, item
+                ready = None in self.lanes  # host=None（即時）の項目を最優先
+                pick, pick_p = None, None
+                for host in (() if ready else self.lanes):
+                    r = self.slots.ready_in(host, now)
+                    if r == 0.0:
+                        p = self.priority(host) if self.priority is not None else 0
+                        if not ready or p > pick_p:
+                            ready, pick, pick_p = True, host, p
+                        if self.priority is None:
+                            break
+                    elif r is not None:
+                        wait = r if wait is None else min(wait, r)
+                if ready:
+                    lane = self.lanes[pick]
+                    item = lane.pop(0)
+                    if not lane:
+                        del self.lanes[pick]
+                    self.size -= 1
+                    self.slots.take(pick, now)
+                    cond.notify_all()
+                    return pick, item
+                if self.closed and not self.size:
+                    return None, _END
+                cond.wait(wait)
+
+    def close(self):
+        with self.slots.cond:
+            self.closed = True
+            self.slots.cond.notify_all()
+
+    def drain(self):
+        with self.slots.cond:
+            self.draining = True
+            self.slots.cond.notify_all()
+
+    def __len__(self):
+        return self.size
+
+class StreamPipeline:
+    """
+    段（stage）を有界キューでつないだストリーミング実行。
+    各段は fn(item) -> 次段へ流す項目の iterable を workers 本のスレッドで処理し、キューが一杯なら上流が待つ（背圧）。
+    host_of を指定した段は HostQueue（HostSlots を共有）でホスト単位の並列数・間隔を守る。
+    どこかの段で例外が出たら残りを読み捨てて止め、run() で送出する。
+    close_intake() で新しい入力の取り込みをやめ（キューの分は処理する）、
+    stop() で取り込みをやめたうえ spill を指定した段は残りを処理せず spill(item) に渡す（時間切れの退避用）
+    """
+    def __init__(self, queue_size: int = 64, slots: HostSlots | None = None):
+        self.queue_size = max(1, int(queue_size))
+        self.slots = slots or HostSlots()
+        self.stages: list[dict] = []
+        self.stats: dict[str, dict] = {}
+        self.intake_closed = False
+        self.stopping = False
+        self._abort = threading.Event()
+        self._error: BaseException | None = None
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter()
+
+    def stage(self, name: str, fn, workers: int = 1, host_of=None, priority=None, spill=None) -> "StreamPipeline":
+        """priority: host -> 数値（host_of を指定した段で、使えるホストのうち大きいものから処理）"""
+        self.stages.append({"name": name, "fn": fn, "workers": max(1, int(workers)), "host_of": host_of,
+                            "priority": priority, "spill": spill})
+        # first_s / last_s: run() 開始から、この段が最初の項目に着手した / 最後の項目を終えた時刻（秒）
+        self.stats[name] = {"in": 0, "out": 0, "busy_s": 0.0, "spilled": 0, "first_s": None, "last_s": None}
+        return self
+
+    def close_intake(self):
+        self.intake_closed = True
+
+    def stop(self):
+        self.intake_closed = True
+        self.stopping = True
+        for st in self.stages:
+            if st["spill"] is not None and isinstance(st.get("q"), HostQueue):
+                st["q"].drain()
+
+    def pending(self) -> dict[str, int]:
+        """段ごとのキュー待ち件数"""
+        out = {}
+        for st in self.stages:
+            q = st.get("q")
+            out[st["name"]] = 0 if q is None else (len(q) if isinstance(q, HostQueue) else q.qsize())
+        return out
+
+    def _fail(self, e: BaseException):
+        with self._lock:
+            if self._error is None:
+                self._error = e
+        self._abort.set()
+
+    def _put(self, i: int, item):
+        st = self.stages[i]
+        q = st["q"]
+        if st["host_of"] is not None:
+            q.put(st["host_of"](item), item, self._abort)
+            return
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _close(self, i: int):
+        st = self.stages[i]
+        if st["host_of"] is not None:
+            st["q"].close()
+        else:
+            for _ in range(st["workers"]):
+                st["q"].put(_END)  # 各段のキューは workers 分だけ余分に確保してある
+
+    def _worker(self, i: int):
+        st = self.stages[i]
+        stats = self.stats[st["name"]]
+        last = i + 1 == len(self.stages)
+        try:
+            while True:
+                if st["host_of"] is not None:
+                    host, item = st["q"].get()
+                else:
+                    host, item = None, st["q"].get()
+                if item is _END:
+                    break
+                if self._abort.is_set():
+                    self.slots.release(host)
+                    continue  # 読み捨て（上流を詰まらせない）
+                if self.stopping and st["spill"] is not None:
+                    self.slots.release(host)
+                    try:
+                        st["spill"](item)
+                        with self._lock:
+                            stats["spilled"] += 1
+                    except BaseException as e:
+                        self._fail(e)
+                    continue
+                try:
+                    t = time.perf_counter()
+                    try:
+                        outs = list(st["fn"](item) or ())
+                    finally:
+                        self.slots.release(host)  # 下流の空きを待つ間はホストを塞がない
+                    done_at = time.perf_counter()
+                    with self._lock:
+                        stats["in"] += 1
+                        stats["out"] += len(outs)
+                        stats["busy_s"] += done_at - t
+                        if stats["first_s"] is None or t - self._t0 < stats["first_s"]:
+                            stats["first_s"] = t - self._t0
+                        stats["last_s"] = max(stats["last_s"] or 0.0, done_at - self._t0)
+                    if not last:
+                        for out in outs:
+                            self._put(i + 1, out)
+                except BaseException as e:
+                    self._fail(e)
+        finally:
+            with self._lock:
+                st["alive"] -= 1
+                done = st["alive"] == 0
+            if done and not last:
+                self._close(i + 1)
+
+    def _profiled(self, i: int):
+        with get_profiler().thread():  # --profile cprofile のときだけ計測
+            self._worker(i)
+
+    def run(self, source, preload=None):
+        """
+        source（iterable）を先頭段に流し、全段が処理し終えるまで待つ。
+        preload: [(段の名前, 項目), ...] を source より先に途中の段へ直接流す（前回の退避分の再開用）
+        """
+        self._t0 = time.perf_counter()
+        for st in self.stages:
+            st["alive"] = st["workers"]
+            st["q"] = (HostQueue(self.queue_size, self.slots, st["priority"]) if st["host_of"] is not None
+                       else queue.Queue(self.queue_size + st["workers"]))
+        threads = [threading.Thread(target=self._profiled, args=(i,), name=f"{st['name']}-{k}", daemon=True)
+                   for i, st in enumerate(self.stages) for k in range(st["workers"])]
+        for t in threads:
+            t.start()
+        names = {st["name"]: i for i, st in enumerate(self.stages)}
+        try:
+            for name, item in preload or ():
+                if self._abort.is_set():
+                    break
+                self._put(names[name], item)
+            for item in source:
+                if self._abort.is_set() or self.intake_closed:
+                    break
+                self._put(0, item)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if hasattr(source, "close"):
+                source.close()  # 取り込みをやめた生成器の後始末（未着手の照会を捨てる）
+            self._close(0)
+            for t in threads:
+                t.join()
+        if self._error is not None:
+            raise self._error
@@ -1,14 +1,92 @@
+import json, math
 from .utils import tokenize, jaccard, normalize_text
 
-def suggest_replacement(anchor_text: str, page_title: str, catalog_rows: list[dict]) -> tuple[str, float]:
-    """Catalogの (url, title, queries) から最も近いものを返す（URL, fit_score）"""
-    a = set(tokenize(anchor_text + " " + page_title))
-    best = ("", 0.0)
-    for row in catalog_rows:
-        title = normalize_text(row.get("title",""))
-        queries = normalize_text(row.get("queries_top10_pipe","").replace("|"," "))
-        b = set(tokenize(title + " " + queries))
-        score = jaccard(a, b)
-        if score > best[1]:
-            best = (row.get("url",""), score)
-    return best
+def _row_dict(row) -> dict:
+    # dict（従来）でも sheets.CatalogRow でも受け付ける
+    return row if isinstance(row, dict) else row._asdict()
+
+def _char_ngrams(tokens: list[str], n: int) -> set[str]:
+    # 空白で区切れない日本語アンカー向け：トークン内の文字 n-gram
+    out = set()
+    for t in tokens:
+        if len(t) <= n:
+            out.add(t)
+        else:
+            out.update(t[i:i + n] for i in range(len(t) - n + 1))
+    return out
+
+class CatalogIndex:
+    """
+    カタログの転置インデックス（トークン → カタログ行）。行ごとのトークン集合と IDF を前計算しておき、
+    アンカーとトークンを共有する行だけを採点する（共有しない行の Jaccard は 0 なので結果は総当たりと同じ）。
+    ngram > 0 なら文字 n-gram もトークンとして加える
+    """
+    def __init__(self, catalog_rows=None, ngram: int = 0):
+        self.ngram = int(ngram)
+        self.urls: list[str] = []
+        self.tokens: list[frozenset] = []
+        self.postings: dict[str, list[int]] = {}
+        self.idf: dict[str, float] = {}
+        for row in catalog_rows or []:
+            row = _row_dict(row)
+            title = normalize_text(row.get("title",""))
+            queries = normalize_text(row.get("queries_top10_pipe","").replace("|"," "))
+            self._add(row.get("url",""), self.features(title + " " + queries))
+        self._build_idf()
+
+    def features(self, text: str) -> frozenset:
+        toks = tokenize(text)
+        feats = set(toks)
+        if self.ngram > 0:
+            feats |= _char_ngrams(toks, self.ngram)
+        return frozenset(feats)
+
+    def _add(self, url: str, feats: frozenset):
+        i = len(self.urls)
+        self.urls.append(url)
+        self.tokens.append(feats)
+        for t in feats:
+            self.postings.setdefault(t, []).append(i)
+
+    def _build_idf(self):
+        n = len(self.urls)
+        self.idf = {t: math.log((n + 1) / (len(rows) + 1)) + 1.0 for t, rows in self.postings.items()}
+
+    def _score(self, a: frozenset, b: frozenset, scoring: str) -> float:
+        if scoring == "idf":
+            union = a | b
+            if not union: return 0.0
+            w = lambda ts: sum(self.idf.get(t, 1.0) for t in ts)
+            return w(a & b) / w(union)
+        return jaccard(a, b)
+
+    def top_k(self, anchor_text: str, page_title: str = "", k: int = 5, scoring: str = "jaccard") -> list[tuple[str, float]]:
+        """return: [(url, score)] スコア降順（同点はカタログ順）"""
+        a = self.features(anchor_text + " " + page_title)
+        cand = sorted({i for t in a for i in self.postings.get(t, ())})
+        scored = [(self.urls[i], self._score(a, self.tokens[i], scoring), i) for i in cand]
+        scored = [s for s in scored if s[1] > 0]
+        scored.sort(key=lambda s: (-s[1], s[2]))
+        return [(u, sc) for u, sc, _ in scored[:k]]
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"ngram": self.ngram, "urls": self.urls, "tokens": [sorted(t) for t in self.tokens]},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "CatalogIndex":
+        with open(path, encoding="utf-8") as f:
+            d = json.load(f)
+        idx = cls(ngram=d.get("ngram", 0))
+        for url, toks in zip(d["urls"], d["tokens"]):
+            idx._add(url, frozenset(toks))
+        idx._build_idf()
+        return idx
+
+def suggest_replacement(anchor_text: str, page_title: str, catalog_rows: list[dict],
+                        index: CatalogIndex | None = None) -> tuple[str, float]:
+    """Catalogの (url, title, queries) から最も近いものを返す（URL, fit_score）。index があれば再トークン化しない"""
+    index = index or CatalogIndex(catalog_rows)
+    top = index.top_k(anchor_text, page_title, k=1)
+    return top[0] if top else ("", 0.0)
@@ -1,5 +1,5 @@
-import re, html, unicodedata
-from urllib.parse import urlparse
+import re, html, time, threading, unicodedata
+from urllib.parse import urlparse, urlsplit, urlunsplit
 
 WS_RE = re.compile(r"\s+", re.U)
 NON_WORD = re.compile(r"[^\w\u3040-\u30ff\u4e00-\u9fff-]+")
@@ -26,3 +26,66 @@ def host_of(u: str) -> str:
         return (urlparse(u).hostname or "").lower().lstrip("www.")
     except Exception:
         return ""
+
+_URL_PARTS = re.compile(r'([A-Za-z][A-Za-z0-9+.\-]*)://([^/?#]*)([^?#]*)(?:\?([^#]*))?')
+
+def split_url(u: str) -> tuple[str, str, str, str]:
+    """
+    絶対 URL を 1 回の正規表現で (scheme, host, path, query) に分ける（大量のリンクを捌く用の軽量版）。
+    scheme・host は小文字、host は userinfo・ポートを除く（urlparse().hostname と同じ）。絶対 URL でなければ全て空
+    """
+    m = _URL_PARTS.match(u)
+    if m is None:
+        return "", "", "", ""
+    host = m.group(2).rpartition("@")[2]
+    if host.startswith("["):
+        host = host[1:host.find("]")]  # IPv6
+    else:
+        host = host.partition(":")[0]
+    return m.group(1).lower(), host.lower(), m.group(3), m.group(4) or ""
+
+class TokenBucket:
+    """平均 rate_per_s 回/秒・最大 burst 回連続のレート制限（acquire は順番に待つ）。rate_per_s <= 0 なら無制限"""
+    def __init__(self, rate_per_s: float, burst: int = 1):
+        self.rate = float(rate_per_s)
+        self.burst = max(1, int(burst))
+        self._tokens = float(self.burst)
+        self._at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+            self._at = now
+            self._tokens -= 1.0  # 足りなければ前借りして、その分だけ待つ
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = {"gclid", "fbclid", "yclid", "msclkid", "mc_cid", "mc_eid", "_ga", "igshid", "ref_src"}
+
+def normalize_url(u: str) -> str:
+    """
+    キャッシュ・重複排除用の URL 正規化
+    scheme/host 小文字化・既定ポート除去・末尾スラッシュ除去・フラグメント除去・トラッキング用パラメータ除去
+    """
+    try:
+        p = urlsplit(u.strip())
+    except Exception:
+        return u
+    scheme = p.scheme.lower()
+    host = (p.hostname or "").lower()
+    try:
+        port = p.port
+    except ValueError:
+        port = None
+    netloc = host if (port is None or DEFAULT_PORTS.get(scheme) == port) else f"{host}:{port}"
+    path = p.path.rstrip("/") or "/"
+    query = "&".join(kv for kv in p.query.split("&")
+                     if kv and not (kv.split("=", 1)[0].lower().startswith("utm_")
+                                    or kv.split("=", 1)[0].lower() in TRACKING_PARAMS))
+    return urlunsplit((scheme, netloc, path, query, ""))
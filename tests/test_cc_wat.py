@@ -0,0 +1,50 @@
+import gzip, json
+import pytest
+from src import cc_wat
+from src.matcher import TermMatcher
+
+def _write_wat(path, n_records=4, links_per_record=3):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for r in range(n_records):
+            links = [{"url": f"https://ext{r}-{k}.jp/p", "text": f"棲み分けの記事 {r}-{k}"} for k in range(links_per_record)]
+            f.write(json.dumps({"Envelope": {
+                "WARC-Header-Metadata": {"WARC-Target-URI": f"https://site{r}.jp/page"},
+                "Payload-Metadata": {"HTTP-Response-Metadata": {"HTML-Metadata": {"Links": links}}}}},
+                ensure_ascii=False) + "\n")
+
+def _scan(path, ckpt):
+    ckpt.mkdir(exist_ok=True)
+    return cc_wat._scan_wat_file(None, str(path), ["棲み分け"], None, 100, 100, 30, 6, 1, [],
+                                 ckpt_dir=str(ckpt), prefilter=False)
+
+@pytest.mark.parametrize("crash_after", [1, 3, 5])
+def test_resume_after_mid_record_crash_keeps_every_item(tmp_path, monkeypatch, crash_after):
+    wat = tmp_path / "a.wat.gz"
+    _write_wat(wat)
+    expected = [i["link_url"] for i in _scan(wat, tmp_path / "full")]
+    assert len(expected) == 12
+
+    real = cc_wat._iter_outlinks_from_wat
+
+    def crashing(*a, **kw):
+        for n, item in enumerate(real(*a, **kw)):
+            if n == crash_after:
+                raise OSError("connection reset")
+            yield item
+
+    monkeypatch.setattr(cc_wat, "_iter_outlinks_from_wat", crashing)
+    _scan(wat, tmp_path / "ck")
+    monkeypatch.setattr(cc_wat, "_iter_outlinks_from_wat", real)
+    assert [i["link_url"] for i in _scan(wat, tmp_path / "ck")] == expected
+
+@pytest.mark.parametrize("min_terms", [0, 1])
+def test_prefilter_rejects_lines_without_catalog_terms_when_matcher_given(min_terms):
+    # TermMatcher.match は min_terms=0 でも 1 語以上の一致を求めるので、生バイトの段階でも弾く
+    pf = cc_wat.make_prefilter(None, [], min_terms, matcher=TermMatcher([["棲み分け"], ["データ移行"]]))
+    assert not pf('{"Links": [{"text": "会社概要"}]}'.encode("utf-8"))
+    assert pf('{"Links": [{"text": "データ移行の手順"}]}'.encode("utf-8"))
+    assert pf(b'{"Links": [{"text": "\\u68f2\\u307f\\u5206\\u3051"}]}')  # JSON エスケープ表記
+
+def test_prefilter_without_matcher_keeps_min_terms_zero():
+    pf = cc_wat.make_prefilter(None, ["棲み分け"], 0)
+    assert pf('{"Links": [{"text": "会社概要"}]}'.encode("utf-8"))
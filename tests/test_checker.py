@@ -0,0 +1,145 @@
+import socket, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from src.checker import HostHealth, check_link, HOST_DOWN
+from src.fetcher import head_or_get_status
+
+class Clock:
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+def _refused():
+    e = requests.exceptions.ConnectionError("refused")
+    e.__cause__ = ConnectionRefusedError(111, "Connection refused")
+    return e
+
+def _nxdomain():
+    e = requests.exceptions.ConnectionError("nxdomain")
+    e.__cause__ = socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    return e
+
+class Resp:
+    def __init__(self, code):
+        self.status_code, self.url, self.headers = code, "", {"content-type": "image/png"}
+
+    def close(self):
+        pass
+
+class Session:
+    """request ごとに outcomes の先頭を返す（例外なら送出）"""
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kw):
+        self.calls += 1
+        o = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(o, BaseException):
+            raise o
+        return Resp(o)
+
+def test_trips_after_threshold_and_probes_after_cooldown():
+    clock = Clock()
+    h = HostHealth(threshold=3, cooldown_s=60, clock=clock)
+    u = "https://dead.example/a"
+    assert not h.failure(u, "refused")
+    assert not h.failure(u, "refused")
+    assert h.failure(u, "refused")
+    assert h.is_down(u) and h.down(u) == "refused"
+    assert h.down("https://DEAD.example/b") == "refused"  # ホスト単位
+    clock.t += 61
+    assert h.down(u) == ""            # 期限切れ：1 本だけ通す
+    assert h.down(u) == "refused"     # 確認中は他を通さない
+    h.failure(u, "refused")           # 確認に失敗：停止し直す
+    assert h.down(u) == "refused"
+    clock.t += 61
+    assert h.down(u) == ""
+    h.success(u)                      # 応答あり：復帰
+    assert not h.is_down(u) and h.down(u) == ""
+    assert not h.failure(u, "refused")  # 連続失敗数も戻っている
+
+def test_release_returns_probe():
+    clock = Clock()
+    h = HostHealth(threshold=1, cooldown_s=10, clock=clock)
+    u = "https://dead.example/"
+    h.failure(u, "tls")
+    clock.t += 11
+    assert h.down(u) == ""
+    h.release(u)
+    assert h.down(u) == ""
+
+def test_nxdomain_trips_at_once_for_dns_ttl():
+    clock = Clock()
+    h = HostHealth(threshold=3, cooldown_s=10, dns_ttl_s=100, clock=clock)
+    u = "https://gone.example/"
+    assert h.failure(u, "nxdomain")
+    clock.t += 50
+    assert h.down(u) == "nxdomain"
+    clock.t += 51
+    assert h.down(u) == ""
+
+def test_check_link_reports_every_connection_failure_as_host_down():
+    h = HostHealth(threshold=3)
+    s = Session(_refused())
+    notes = [check_link(s, f"https://dead.example/p{i}", 1, None, health=h)["note"] for i in range(5)]
+    assert notes == [f"{HOST_DOWN}:refused"] * 5
+    assert s.calls == 3  # 接続失敗では GET で取り直さず、停止後はリクエストしない
+    v = check_link(Session(_nxdomain()), "https://gone.example/", 1, None, health=h)
+    assert (v["code"], v["is_broken"], v["note"]) == (-1, True, f"{HOST_DOWN}:nxdomain")
+
+def test_read_timeout_neither_counts_nor_resets():
+    h = HostHealth(threshold=2)
+    u = "https://slow.example/"
+    check_link(Session(_refused()), u, 1, None, health=h)
+    v = check_link(Session(requests.exceptions.ReadTimeout("slow")), u, 1, None, health=h)
+    assert v["note"] == "fetch_error"
+    check_link(Session(_refused()), u, 1, None, health=h)
+    assert h.is_down(u)
+    assert check_link(Session(404), "https://ok.example/", 1, None, health=h)["code"] == 404
+
+def test_probe_released_when_request_raises():
+    clock = Clock()
+    h = HostHealth(threshold=1, cooldown_s=10, clock=clock)
+    u = "https://dead.example/"
+    h.failure(u, "refused")
+    clock.t += 11
+    s = Session(KeyboardInterrupt())
+    with pytest.raises(KeyboardInterrupt):
+        check_link(s, u, 1, None, health=h)
+    assert h.down(u) == ""
+
+class _RejectsHead(BaseHTTPRequestHandler):
+    """HEAD は 405、GET は 404 ページ（本文に「見つかりません」）"""
+    def do_HEAD(self):
+        self.send_response(405)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        body = "<html><body>ページが見つかりません</body></html>".encode("utf-8")
+        self.send_response(404)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *a):
+        pass
+
+@pytest.fixture
+def rejects_head():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _RejectsHead)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}/gone"
+    srv.shutdown()
+
+def test_get_status_wins_over_rejected_head(rejects_head):
+    with requests.Session() as s:
+        assert head_or_get_status(s, rejects_head, 5)[0] == 404
+        for pats in (None, ["見つかりません"], ["no such words"]):
+            v = check_link(s, rejects_head, 5, pats)
+            assert (v["code"], v["soft_404"], v["is_broken"]) == (404, False, True)
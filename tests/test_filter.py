@@ -0,0 +1,55 @@
+import pytest
+from src.filter import URLFilter, DomainTrie, REASONS, reason_counts
+
+BLOCKLIST = ["facebook.com", "x.com"]
+
+# 部品（scheme / host / path）ごとに判定する。旧実装（URL 全体への正規表現）と判定が変わる境界も含めて固定する
+CASES = [
+    ("https://a.jp/記事", ""),
+    ("https://a.jp", ""),                      # 旧: non-ja（".jp/" が無い）→ ホストで判定
+    ("https://A.JP/a", ""),
+    ("https://a.co.jp/記事?p=1", ""),
+    ("http://a.jp/", "http-scheme"),
+    ("a.jp/", "http-scheme"),
+    ("https://x.com/a", "blocklist"),
+    ("https://a.x.com/a", "blocklist"),        # サブドメインも
+    ("https://www.facebook.com/p", "blocklist"),
+    ("https://box.com/a", "com-nonja"),        # 末尾一致でもラベル境界でなければ対象外
+    ("https://a.org/x", "tld-org"),
+    ("https://a.jp/x.org/y", ""),              # 旧: tld-org（パス中の .org）
+    ("https://a.jp/f.PDF", "attachment"),
+    ("https://a.jp/img.png?w=1", "attachment"),
+    ("https://a.jp/feed", "utility"),
+    ("https://a.jp/wp-content/uploads/", "utility"),
+    ("https://a.jp/login?x=1", ""),
+    ("https://site12.jp/", "numeric-sld"),
+    ("https://1.2.3.4/", "numeric-sld"),
+    ("https://ex.com/棲み分け", ""),           # .com は日本語を含めば通す
+    ("https://ex.com/a", "com-nonja"),
+    ("https://ex.com:443/", "com-nonja"),      # 旧: non-ja（".com/" が無い）
+    ("https://y.net/a.com/b", "non-ja"),       # 旧: com-nonja（パス中の ".com/"）
+    ("https://ex.net/a", "non-ja"),
+]
+
+@pytest.fixture
+def url_filter():
+    return URLFilter(BLOCKLIST, https_only=True, com_in_ja=True)
+
+@pytest.mark.parametrize("url,reason", CASES)
+def test_check_reason(url_filter, url, reason):
+    assert REASONS[url_filter.check(url)] == reason
+
+def test_filter_batch_matches_check(url_filter):
+    urls = [u for u, _ in CASES] * 2
+    keep, codes = url_filter.filter(urls)
+    assert [REASONS[c] for c in codes] == [r for _, r in CASES] * 2
+    assert keep.tolist() == [r == "" for _, r in CASES] * 2
+    assert reason_counts(codes)["blocklist"] == 6
+
+def test_domain_trie_matches_on_label_boundaries():
+    t = DomainTrie(["x.com", "Example.CO.JP"])
+    assert t.match("x.com") == "x.com"
+    assert t.match("a.b.x.com") == "x.com"
+    assert t.match("box.com") is None
+    assert t.match("com") is None
+    assert t.match("www.example.co.jp") == "Example.CO.JP"  # 登録時の表記を返す（照合は小文字）
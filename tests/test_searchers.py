@@ -0,0 +1,48 @@
+import json
+from src.searchers import IndexQueryExecutor, top_catalog_rows
+from src.sheets import CatalogRow
+
+class Resp:
+    def __init__(self, body):
+        self.status_code, self.text = 200, body
+
+    def json(self):
+        return json.loads(self.text)
+
+class CCIndex:
+    """CC インデックスの代わり：page_size 件ずつ pages ページ。受けたパラメータを記録する"""
+    def __init__(self, pages: int, page_size: int):
+        self.pages, self.page_size = pages, page_size
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(params)
+        if params.get("showNumPages"):
+            return Resp(json.dumps({"pages": self.pages}))
+        p = int(params["page"])
+        n = min(self.page_size, int(params["limit"]))
+        return Resp("\n".join(json.dumps({"url": f"https://a.jp/{p}/{i}"}) for i in range(n)))
+
+def _ex(session, max_pages=3):
+    return IndexQueryExecutor(session, cc_rate_per_s=0, cdx_rate_per_s=0, max_pages=max_pages)
+
+def test_cc_query_skips_page_count_when_page0_is_enough():
+    s = CCIndex(pages=4, page_size=10)
+    assert len(_ex(s).cc_query("*.jp/*x*", 5)) == 5
+    assert len(s.calls) == 1 and not s.calls[0].get("showNumPages")
+
+def test_cc_query_follows_pages_when_short():
+    s = CCIndex(pages=2, page_size=3)
+    urls = _ex(s).cc_query("*.jp/*x*", 10)
+    assert len(urls) == 6
+    assert [c.get("page", "n") for c in s.calls] == ["0", "n", "1"]
+    assert s.calls[2]["limit"] == "7"
+
+def test_cc_query_single_page_never_asks_count():
+    s = CCIndex(pages=4, page_size=3)
+    assert len(_ex(s, max_pages=1).cc_query("*.jp/*x*", 10)) == 3
+    assert len(s.calls) == 1
+
+def test_top_catalog_rows_sorts_before_slicing():
+    rows = [CatalogRow.from_values([f"t{i}", "", "", str(c)]) for i, c in enumerate([5, 1, 9, 7, 5])]
+    assert [r[0] for r in top_catalog_rows(rows, 3)] == ["t2", "t3", "t0"]
@@ -0,0 +1,50 @@
+import os
+import pytest
+from src.sheets import SheetWriter, FakeSpreadsheet, FakeQuotaError
+from src.metrics import get_metrics
+
+def _rows(a, b):
+    return [[f"https://a.jp/{i}", str(i)] for i in range(a, b)]
+
+def test_sends_full_batches_and_rest_on_close(tmp_path):
+    sh = FakeSpreadsheet()
+    w = SheetWriter(sh, str(tmp_path), batch_rows=3, backoff_s=0)
+    w.add("結果", _rows(0, 7))
+    assert sh.worksheet("結果").values == _rows(0, 6)
+    assert sh.worksheet("結果").calls == 2
+    w.close()
+    assert sh.worksheet("結果").values == _rows(0, 7)
+    assert os.listdir(tmp_path) == []  # 全件送れたら spool は消える
+
+def test_resends_unsent_rows_after_crash(tmp_path):
+    first = FakeSpreadsheet()
+    w = SheetWriter(first, str(tmp_path), batch_rows=3, backoff_s=0)
+    w.add("結果", _rows(0, 5))
+    w.add("候補", _rows(10, 11))
+    # close() せずに落ちた：結果は 3 行送信済み・2 行未送信、候補は 1 行未送信。末尾に書きかけの行
+    with open(tmp_path / "結果.jsonl", "a", encoding="utf-8") as f:
+        f.write('["https://a.jp/tor')
+    second = FakeSpreadsheet()
+    w = SheetWriter(second, str(tmp_path), batch_rows=3, backoff_s=0)
+    w.close()
+    assert first.worksheet("結果").values + second.worksheet("結果").values == _rows(0, 5)
+    assert second.worksheet("候補").values == _rows(10, 11)
+    assert os.listdir(tmp_path) == []
+
+def test_retries_quota_errors_with_backoff(tmp_path):
+    get_metrics().reset()
+    sh = FakeSpreadsheet(fail_every=2)  # 2 回に 1 回 429
+    w = SheetWriter(sh, str(tmp_path), batch_rows=2, backoff_s=0)
+    w.add("結果", _rows(0, 6))
+    w.close()
+    assert sh.worksheet("結果").values == _rows(0, 6)
+    c = get_metrics().to_dict()["counters"]
+    assert c["sheet_retries"]["結果"] == 2 and c["sheet_rows"]["結果"] == 6
+
+def test_gives_up_after_max_retries_and_keeps_spool(tmp_path):
+    w = SheetWriter(FakeSpreadsheet(fail_every=1), str(tmp_path), batch_rows=2, max_retries=2, backoff_s=0)
+    with pytest.raises(FakeQuotaError):
+        w.add("結果", _rows(0, 2))
+    sh = FakeSpreadsheet()
+    SheetWriter(sh, str(tmp_path), batch_rows=2, backoff_s=0).close()  # 次回の起動で再送
+    assert sh.worksheet("結果").values == _rows(0, 2)
@@ -0,0 +1,84 @@
+import threading
+import pytest
+from src.stream import HostSlots, HostQueue, StreamPipeline
+
+def test_stages_keep_order_with_one_worker():
+    out = []
+    pipe = StreamPipeline(queue_size=2)
+    pipe.stage("fan", lambda x: (x, x * 10))
+    pipe.stage("host", lambda x: (x + 1,), host_of=lambda x: "h")  # 同一ホストは到着順
+    pipe.stage("collect", lambda x: out.append(x))
+    pipe.run(range(5), preload=[("collect", -1)])
+    assert out == [-1, 1, 1, 2, 11, 3, 21, 4, 31, 5, 41]
+    assert pipe.stats["fan"]["in"] == 5 and pipe.stats["fan"]["out"] == 10
+    assert pipe.stats["collect"]["in"] == 11
+
+def test_host_queue_priority_and_per_host_limit():
+    slots = HostSlots(per_host=1)
+    q = HostQueue(10, slots, priority={"a": 1, "b": 5, "c": 3}.get)
+    abort = threading.Event()
+    for h, item in [("a", "a1"), ("b", "b1"), ("b", "b2"), ("c", "c1"), (None, "now")]:
+        q.put(h, item, abort)
+    assert q.get() == (None, "now")  # host=None は即時
+    assert q.get() == ("b", "b1")
+    assert q.get() == ("c", "c1")    # b は使用中
+    assert q.get() == ("a", "a1")
+    slots.release("b")
+    assert q.get() == ("b", "b2")
+
+def test_host_slots_interval():
+    slots = HostSlots(per_host=1, interval_s=5.0)
+    assert slots.ready_in("h", 100.0) == 0.0
+    slots.take("h", 100.0)
+    assert slots.ready_in("h", 101.0) is None  # 同時実行数の上限
+    slots.release("h")
+    assert slots.ready_in("h", 101.0) == pytest.approx(4.0)
+    assert slots.ready_in("other", 101.0) == 0.0
+
+def test_host_queue_put_blocks_when_full():
+    q = HostQueue(1, HostSlots())
+    abort = threading.Event()
+    q.put("a", 1, abort)
+    t = threading.Thread(target=q.put, args=("b", 2, abort))
+    t.start()
+    t.join(0.2)
+    assert t.is_alive()  # 背圧：空くまで待つ
+    assert q.get() == ("a", 1)
+    t.join(2)
+    assert not t.is_alive() and len(q) == 1
+
+def test_stop_spills_queued_items():
+    done, spilled = [], []
+    queued = threading.Event()
+
+    def source():
+        yield from range(5)
+        queued.set()
+
+    def check(x):
+        if x == 0:
+            assert queued.wait(5)
+            pipe.stop()
+        done.append(x)
+        return ()
+
+    pipe = StreamPipeline(queue_size=10)
+    pipe.stage("check", check, host_of=lambda x: f"h{x}", spill=spilled.append)
+    pipe.run(source())
+    assert done == [0]
+    assert sorted(spilled) == [1, 2, 3, 4]
+    assert pipe.stats["check"]["spilled"] == 4
+
+def test_error_aborts_without_blocking_upstream():
+    def boom(x):
+        if x == 3:
+            raise ValueError("boom")
+        return (x,)
+
+    out = []
+    pipe = StreamPipeline(queue_size=1)
+    pipe.stage("boom", boom)
+    pipe.stage("collect", lambda x: out.append(x), host_of=lambda x: "h")
+    with pytest.raises(ValueError):
+        pipe.run(range(1000))
+    assert 3 not in out and len(out) < 1000